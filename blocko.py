@@ -1,583 +1,587 @@
+import time
+PROCESS_START_TIME = time.perf_counter()
+
 import arcade
+import pyglet
 import random
-import time
-import json
-import os
 import math
-
-# Constants
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = 800
-SCREEN_TITLE = "bLocKo - The Puzzle Game"
-
-BLOCK_SIZE = 30
-GRID_WIDTH = 10
-GRID_HEIGHT = 20
-BUFFER_ZONE_HEIGHT = 4  # Number of rows above the visible playfield
-
-GRID_ORIGIN_X = (SCREEN_WIDTH - GRID_WIDTH * BLOCK_SIZE) // 2
-GRID_ORIGIN_Y = (SCREEN_HEIGHT - GRID_HEIGHT * BLOCK_SIZE) // 2
-
-BACKGROUND_COLOR = arcade.color.BLACK
-GRID_COLOR = arcade.color.GRAY
-BLOCK_COLORS = [
-    arcade.color.RED,
-    arcade.color.BLUE,
-    arcade.color.GREEN,
-    arcade.color.YELLOW,
-    arcade.color.ORANGE,
-    arcade.color.PURPLE,
-    arcade.color.CYAN
-]
-GHOST_COLOR = (255, 255, 255, 50)
-FLASH_COLOR = arcade.color.WHITE
-
-HARD_DROP_COOLDOWN = 0.5
-INITIAL_DROP_INTERVAL = 1.0
-MIN_DROP_INTERVAL = 0.05
-LOCK_DELAY = 0.75
-
-WALL_KICK_OFFSETS = {
-    'non-I': [
-        (0, 0),
-        (-1, 0),
-        (-1, 1),
-        (0, -2),
-        (-1, -2),
-        (1, 0),
-        (1, 1),
-        (0, 2),
-        (1, -2)
-    ],
-    'I': [
-        (0, 0),
-        (-2, 0),
-        (+1, 0),
-        (-2, -1),
-        (+1, +2),
-        (+2, 0),
-        (-1, 0),
-        (+2, +1),
-        (-1, -2)
-    ]
+import threading
+import json
+import struct
+import functools
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from blocko_core import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE, BLOCK_SIZE, GRID_WIDTH, GRID_HEIGHT,
+    GRID_ORIGIN_X, GRID_ORIGIN_Y, BACKGROUND_COLOR, GRID_COLOR, CELL_PALETTE,
+    GHOST_COLOR, EXPLOSION_COLOR, MAX_PREVIEW_DEPTH, PARTICLE_SPEED, PARTICLE_FADE_RATE, PARTICLE_COUNT, FRAME_TIME,
+    PLAYER_ACTION_PREFIXES, EngineEvent, FixedTimestep, GameMode, GameState, binding_to_string,
+    compile_key_bindings, split_player_action
+)
+from blocko_engine import BlockoEngine
+from blocko_rewind import RewindBuffer
+from blocko_versus import VersusMatch
+from blocko_net import ACTION_BITS, DEFAULT_PORT, NET_TICK_RATE, open_session
+from blocko_spectate import SPECTATOR_PORT, SpectatorFeed
+from blocko_eventlog import EventLog
+from blocko_replay import ReplayRecorder, ReplayWriter
+from blocko_metrics import METRIC_EVENTS, METRICS_FILE, METRICS_INTERVAL, GameMetrics, MetricsSocket
+from blocko_input import InputQueue, AutoShift, LatencyTracker, DAS_PRESETS, ARR_PRESETS, SOFT_DROP_FACTOR_PRESETS, next_preset
+import blocko_storage
+
+# Sounds are loaded on first use by the AssetManager
+SOUND_FILES = {
+    "move": ":resources:sounds/hit1.wav",
+    "rotate": ":resources:sounds/hit2.wav",
+    "combo": ":resources:sounds/hit2.wav",
+    "power_up": ":resources:sounds/hit2.wav",
+    "lock": ":resources:sounds/hit3.wav",
+    "line_clear": ":resources:sounds/coin1.wav",
+    "game_over": ":resources:sounds/gameover1.wav"
 }
-
-BLOCK_SHAPES = [
-    [(0,1), (1,1), (1,0), (1,2), (2,1)],  # F
-    [(0,2), (1,2), (2,2), (3,2), (4,2)],  # I
-    [(0,0), (1,0), (2,0), (3,0), (3,1)],  # L
-    [(0,1), (1,1), (2,1), (2,0), (3,0)],  # N
-    [(0,0), (0,1), (1,0), (1,1), (2,0)],  # P
-    [(0,1), (1,0), (1,1), (1,2), (2,1)],  # T
-    [(0,0), (0,2), (1,0), (1,1), (1,2)],  # U
-    [(0,0), (1,0), (2,0), (2,1), (2,2)],  # V
-    [(0,0), (1,0), (1,1), (2,1), (2,2)],  # W
-    [(0,1), (1,0), (1,1), (2,1), (3,1)],  # Y
-    [(0,0), (0,1), (1,1), (1,2), (2,2)]   # Z
-]
-
-SCORE_SINGLE = 100
-SCORE_DOUBLE = 300
-SCORE_TRIPLE = 600
-SCORE_QUADRUPLE = 1000
-SCORE_BLOCKO = 1500
-SCORE_SOFT_DROP = 1
-SCORE_HARD_DROP = 2
-SCORE_B_SPIN = 800
-
-PARTICLE_SPEED = 2
-PARTICLE_FADE_RATE = 5
-PARTICLE_COUNT = 20
-
-POWER_UP_CHANCE = 0.05
-POWER_UP_TYPES = {
-    "CLEAR_ROW": {"chance": 0.3, "duration": 0},
-    "SLOW_TIME": {"chance": 0.3, "duration": 15},
-    "AVALANCHE": {"chance": 0.2, "duration": 0},
-    "BOMB": {"chance": 0.2, "duration": 0}
+MUSIC_FILE = ":resources:music/1918.mp3"
+
+# Sound dispatch: game events map onto sounds, each sound has a polyphony
+# limit and all voices come from one preallocated pool
+SOUND_VOICES = 8
+EVENT_SOUNDS = {
+    EngineEvent.MOVE: "move",
+    EngineEvent.ROTATE: "rotate",
+    EngineEvent.LOCK: "lock",
+    EngineEvent.LINE_CLEAR: "line_clear",
+    EngineEvent.COMBO: "combo",
+    EngineEvent.POWER_UP: "power_up",
+    EngineEvent.GAME_OVER: "game_over"
 }
-
-INITIAL_PRESSURE_INTERVAL = 30
-MIN_PRESSURE_INTERVAL = 10
-INITIAL_PRESSURE_HEIGHT = 1
-MAX_PRESSURE_HEIGHT = 5
-GARBAGE_BLOCK_COLOR = arcade.color.GRAY
-PRESSURE_INCREASE_INTERVAL = 60
-
-# Load sounds
-MOVE_SOUND = arcade.load_sound(":resources:sounds/hit1.wav")
-ROTATE_SOUND = arcade.load_sound(":resources:sounds/hit2.wav")
-LOCK_SOUND = arcade.load_sound(":resources:sounds/hit3.wav")
-LINE_CLEAR_SOUND = arcade.load_sound(":resources:sounds/coin1.wav")
-GAME_OVER_SOUND = arcade.load_sound(":resources:sounds/gameover1.wav")
-BG_MUSIC = arcade.load_sound(":resources:music/1918.mp3")
-
-# Default key bindings
-DEFAULT_KEY_BINDINGS = {
-    "MOVE_LEFT": arcade.key.LEFT,
-    "MOVE_RIGHT": arcade.key.RIGHT,
-    "MOVE_UP": arcade.key.UP,
-    "MOVE_DOWN": arcade.key.DOWN,
-    "SOFT_DROP": arcade.key.DOWN,
-    "HARD_DROP": arcade.key.UP,
-    "ROTATE_LEFT": arcade.key.Z,
-    "ROTATE_RIGHT": arcade.key.X,
-    "HOLD": arcade.key.C,
-    "PAUSE": arcade.key.P,
-    "SELECT": arcade.key.ENTER,
-    "BACK": arcade.key.ESCAPE
+PARTICLE_EVENTS = [EngineEvent.LINE_CLEAR, EngineEvent.ROW_WIPE, EngineEvent.EXPLOSION]
+# What a player action that changed the board emits; a hard drop shows as its lock
+ACTION_EVENTS = [EngineEvent.MOVE, EngineEvent.ROTATE, EngineEvent.HOLD, EngineEvent.LOCK]
+# suspend.bin: game clock followed by an engine snapshot
+SUSPEND_HEADER = struct.Struct("<d")
+
+SOUND_POLYPHONY = {
+    "move": 1,
+    "rotate": 2,
+    "combo": 1,
+    "power_up": 1,
+    "lock": 2,
+    "line_clear": 2,
+    "game_over": 1
 }
 
-class GameMode:
-    MARATHON = 0
-    SPRINT = 1
-    ULTRA = 2
-    PRESSURE = 3
-
-class GameState:
-    MAIN_MENU = 0
-    GAME_MODE_SELECT = 1
-    OPTIONS = 2
-    PLAYING = 3
-    PAUSED = 4
-    GAME_OVER = 5
-    TUTORIAL = 6
-    KEY_BINDING = 7
-
-def key_to_string(key):
-    key_map = {
-        arcade.key.UP: "Up",
-        arcade.key.DOWN: "Down",
-        arcade.key.LEFT: "Left",
-        arcade.key.RIGHT: "Right",
-        arcade.key.ENTER: "Enter",
-        arcade.key.ESCAPE: "Esc",
-        arcade.key.SPACE: "Space",
-        arcade.key.Z: "Z",
-        arcade.key.X: "X",
-        arcade.key.C: "C",
-        arcade.key.P: "P"
-    }
-    return key_map.get(key, chr(key).upper())
-
-class PowerUp:
-    def __init__(self, type):
-        self.type = type
-        self.active = False
-        self.start_time = None
-        self.duration = POWER_UP_TYPES[type]["duration"]
-
-    def activate(self):
-        self.active = True
-        self.start_time = time.time()
-
-    def deactivate(self):
-        self.active = False
-        self.start_time = None
-
-class Block:
-    def __init__(self, shape, color, grid_x, grid_y, block_type='non-I'):
-        self.shape = shape
-        self.color = color
-        self.grid_x = grid_x
-        self.grid_y = grid_y
-        self.block_type = block_type
-        self.rotation_state = 0
-
-    def get_global_positions(self):
-        return [(self.grid_x + x, self.grid_y + y) for x, y in self.shape]
-
-    def move(self, dx, dy):
-        self.grid_x += dx
-        self.grid_y += dy
-
-    def get_width(self):
-        xs = [x for x, y in self.shape]
-        return max(xs) - min(xs) + 1
-
-    def get_height(self):
-        ys = [y for _, y in self.shape]
-        return max(ys) - min(ys) + 1
-
-    def rotate(self, clockwise, game):
-        original_shape = self.shape.copy()
-        original_x = self.grid_x
-        original_y = self.grid_y
-        original_state = self.rotation_state
-    
-        center_x = sum(x for x, _ in self.shape) / len(self.shape)
-        center_y = sum(y for _, y in self.shape) / len(self.shape)
-    
-        if clockwise:
-            self.shape = [(round(-y + center_y + center_x), round(x - center_x + center_y)) for x, y in self.shape]
-            self.rotation_state = (self.rotation_state + 1) % 4
-        else:
-            self.shape = [(round(y - center_y + center_x), round(-x + center_x + center_y)) for x, y in self.shape]
-            self.rotation_state = (self.rotation_state - 1) % 4
-    
-        min_x = min(x for x, _ in self.shape)
-        min_y = min(y for _, y in self.shape)
-        self.shape = [(x - min_x, y - min_y) for x, y in self.shape]
-    
-        kick_set = WALL_KICK_OFFSETS['I' if self.block_type == 'I' else 'non-I']
-        for kick in kick_set:
-            test_x = self.grid_x + kick[0]
-            test_y = self.grid_y + kick[1]
-            if game.is_valid_position([(x + test_x, y + test_y) for x, y in self.shape]):
-                self.grid_x = test_x
-                self.grid_y = test_y
-                return True
-    
-        self.shape = original_shape
-        self.grid_x = original_x
-        self.grid_y = original_y
-        self.rotation_state = original_state
-        return False
+GAME_MODE_ITEMS = ["Marathon", "Sprint", "Ultra", "Pressure", "Practice", "Versus", "Back"]
+OPTION_ITEMS = ["Power-ups", "Difficulty", "Preview", "DAS", "ARR", "Soft Drop", "Event Log", "Replays",
+                "Key Bindings", "Back"]
 
+class AssetManager:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="blocko-assets")
+        self.lock = threading.Lock()
+        self.sounds = {}
+        self.pending = {}
+
+    def get_sound(self, path, streaming=False):
+        with self.lock:
+            sound = self.sounds.get(path)
+            future = self.pending.get(path)
+        if sound is not None:
+            return sound
+        if future is not None:
+            return future.result()
+        return self._load(path, streaming)
+
+    def load_in_background(self, path, streaming=False):
+        with self.lock:
+            if path in self.sounds or path in self.pending:
+                return
+            self.pending[path] = self.executor.submit(self._load, path, streaming)
+
+    def is_ready(self, path):
+        with self.lock:
+            return path in self.sounds
+
+    def _load(self, path, streaming):
+        sound = arcade.load_sound(path, streaming)
+        with self.lock:
+            self.sounds[path] = sound
+            self.pending.pop(path, None)
+        return sound
+
+class Voice:
+    def __init__(self):
+        # Left to itself, pyglet moves past a finished source and tears down the
+        # player's audio stream. Instead the voice stops and rewinds at the end
+        # of its sound, keeping the stream, and goes back to the pool: on the
+        # driver's end of stream event, or after the sound's length for drivers
+        # that do not send one.
+        self.player = pyglet.media.Player()
+        self.player.push_handlers(on_eos=self.on_eos)
+        self.sound_name = None
+        self.busy_until = 0.0
+
+    def start(self, duration):
+        pyglet.clock.unschedule(self.release)
+        pyglet.clock.schedule_once(self.release, duration)
+        self.player.play()
+
+    def release(self, dt=0):
+        pyglet.clock.unschedule(self.release)
+        self.player.pause()
+        self.player.seek(0)
+        self.busy_until = 0.0
+
+    def on_eos(self):
+        self.release()
+        return pyglet.event.EVENT_HANDLED
+
+class SoundDispatcher:
+    def __init__(self, assets, sound_files, polyphony, voice_count=SOUND_VOICES):
+        self.assets = assets
+        self.sound_files = sound_files
+        self.polyphony = polyphony
+        self.voices = [Voice() for _ in range(voice_count)]
+        self.pending = set()
+        self.durations = {}
+
+    def preload(self):
+        for path in self.sound_files.values():
+            self.assets.load_in_background(path)
+
+    def handle_event(self, event, *args):
+        sound_name = EVENT_SOUNDS.get(event)
+        if sound_name:
+            self.pending.add(sound_name)
+
+    def flush(self):
+        # Everything triggered since the last flush plays at most once
+        if not self.pending:
+            return
+        now = time.time()
+        for sound_name in self.pending:
+            self.play(sound_name, now)
+        self.pending.clear()
+
+    def play(self, sound_name, now):
+        sound = self.assets.get_sound(self.sound_files[sound_name])
+        if sound_name not in self.durations:
+            self.durations[sound_name] = sound.get_length()
+        voice = self.pick_voice(sound_name, now)
+        player = voice.player
+        source = sound.source
+        player.pause()
+        if voice.sound_name == sound_name:
+            player.seek(0)
+        elif voice.sound_name is None:
+            player.queue(source)
+        else:
+            # Swapping sources keeps the voice's audio stream when formats match
+            player.queue(source)
+            player.next_source()
+        voice.start(self.durations[sound_name])
+        voice.sound_name = sound_name
+        voice.busy_until = now + self.durations[sound_name]
+
+    def pick_voice(self, sound_name, now):
+        same_sound = [v for v in self.voices if v.sound_name == sound_name and v.busy_until > now]
+        if len(same_sound) >= self.polyphony.get(sound_name, 1):
+            return min(same_sound, key=lambda v: v.busy_until)
+
+        idle = [v for v in self.voices if v.busy_until <= now]
+        if idle:
+            # Prefer a voice that already has this sound queued
+            for voice in idle:
+                if voice.sound_name == sound_name:
+                    return voice
+            return idle[0]
+        return min(self.voices, key=lambda v: v.busy_until)
+
+    def active_voices(self):
+        now = time.time()
+        return sum(1 for v in self.voices if v.busy_until > now)
+
+# Particles move on logic ticks; the sprite itself is only placed at draw
+# time, interpolated between the last two ticks
 class Particle(arcade.SpriteCircle):
     def __init__(self, x, y, color):
         super().__init__(3, color)
         self.center_x = x
         self.center_y = y
+        self.sim_x = self.previous_x = x
+        self.sim_y = self.previous_y = y
         angle = random.uniform(0, 2 * math.pi)
-        speed = random.uniform(1, PARTICLE_SPEED)
-        self.change_x = math.cos(angle) * speed
-        self.change_y = math.sin(angle) * speed
-        self.fade_rate = PARTICLE_FADE_RATE
-
-    def update(self):
-        self.center_x += self.change_x
-        self.center_y += self.change_y
-        self.alpha -= self.fade_rate
-        if self.alpha <= 0:
+        speed = random.uniform(1, PARTICLE_SPEED) / FRAME_TIME
+        self.velocity_x = math.cos(angle) * speed
+        self.velocity_y = math.sin(angle) * speed
+        self.opacity = 255.0
+        self.fade_rate = PARTICLE_FADE_RATE / FRAME_TIME
+
+    def step(self, delta_time):
+        self.previous_x = self.sim_x
+        self.previous_y = self.sim_y
+        self.sim_x += self.velocity_x * delta_time
+        self.sim_y += self.velocity_y * delta_time
+        self.opacity -= self.fade_rate * delta_time
+        if self.opacity <= 0:
             self.remove_from_sprite_lists()
 
+    def interpolate(self, alpha):
+        self.center_x = self.previous_x + (self.sim_x - self.previous_x) * alpha
+        self.center_y = self.previous_y + (self.sim_y - self.previous_y) * alpha
+        self.alpha = max(0.0, self.opacity)
+
+def add_quad(points, colors, left, bottom, size, color):
+    right = left + size
+    top = bottom + size
+    points.extend(((left, bottom), (right, bottom), (right, top), (left, top)))
+    colors.extend((color, color, color, color))
+
+# Where one board and its hold and next previews go on screen. Sizes scale
+# with the cell size from the single player layout.
+class BoardLayout:
+    def __init__(self, origin_x, origin_y, cell_size):
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+        self.cell_size = cell_size
+        self.scale = cell_size / BLOCK_SIZE
+        self.box_size = 80 * self.scale
+        self.hold_center = (origin_x - 100 * self.scale, origin_y + 600 * self.scale)
+        self.next_centers = [(origin_x + GRID_WIDTH * cell_size + 50 * self.scale, origin_y + (600 - i * 100) * self.scale)
+                             for i in range(MAX_PREVIEW_DEPTH)]
+
+    def cell_center(self, x, y):
+        return (self.origin_x + (x + 0.5) * self.cell_size,
+                self.origin_y + (y + 0.5) * self.cell_size)
+
+    def add_cell(self, points, colors, x, y, color):
+        add_quad(points, colors, self.origin_x + x * self.cell_size,
+                 self.origin_y + y * self.cell_size, self.cell_size, color)
+
+    def add_preview(self, points, colors, center, block, color):
+        # Pieces are shrunk to fit the preview box and centred in it
+        size = self.box_size / 5
+        xs = [x for x, _ in block.shape]
+        ys = [y for _, y in block.shape]
+        left = center[0] - (min(xs) + max(xs) + 1) * size / 2
+        bottom = center[1] - (min(ys) + max(ys) + 1) * size / 2
+        for x, y in block.shape:
+            add_quad(points, colors, left + x * size, bottom + y * size, size, color)
+
+    def grid_lines(self):
+        size = self.cell_size
+        right = self.origin_x + GRID_WIDTH * size
+        top = self.origin_y + GRID_HEIGHT * size
+        points = []
+        for x in range(GRID_WIDTH + 1):
+            points += [(self.origin_x + x * size, self.origin_y), (self.origin_x + x * size, top)]
+        for y in range(GRID_HEIGHT + 1):
+            points += [(self.origin_x, self.origin_y + y * size), (right, self.origin_y + y * size)]
+        return points
+
+SINGLE_LAYOUTS = [BoardLayout(GRID_ORIGIN_X, GRID_ORIGIN_Y, BLOCK_SIZE)]
+VERSUS_LAYOUTS = [BoardLayout(110, 100, 22), BoardLayout(506, 100, 22)]
+
+# Every board on screen in three draw calls, however many players there are.
+# Grid lines and preview boxes are built once per layout, settled cells again
+# only when a grid changes, and pieces, ghosts and previews every frame.
+# Cells and pieces hold palette indices, colored from self.palette as they are drawn.
+class BoardBatch:
+    def __init__(self, palette=CELL_PALETTE):
+        self.palette = palette
+        self.frame = None
+        self.frame_layouts = None
+        self.frame_depths = None
+        self.settled = None
+        self.settled_grids = None
+
+    def draw(self, engines, layouts, piece_offsets):
+        depths = [engine.preview_depth for engine in engines]
+        if self.frame_layouts is not layouts or self.frame_depths != depths:
+            self.frame = arcade.ShapeElementList()
+            for layout, depth in zip(layouts, depths):
+                self.frame.append(arcade.create_lines(layout.grid_lines(), GRID_COLOR))
+                for center_x, center_y in [layout.hold_center] + layout.next_centers[:depth]:
+                    self.frame.append(arcade.create_rectangle_outline(
+                        center_x, center_y, layout.box_size, layout.box_size, arcade.color.WHITE))
+            self.frame_layouts = layouts
+            self.frame_depths = depths
+        self.frame.draw()
+
+        grids = [b"".join(engine.grid[:GRID_HEIGHT]) for engine in engines]
+        if grids != self.settled_grids:
+            points, colors = [], []
+            for grid, layout in zip(grids, layouts):
+                for i, cell in enumerate(grid):
+                    if cell:
+                        layout.add_cell(points, colors, i % GRID_WIDTH, i // GRID_WIDTH, self.palette[cell])
+            self.settled = arcade.create_rectangles_filled_with_colors(points, colors) if points else None
+            self.settled_grids = grids
+        if self.settled:
+            self.settled.draw()
+
+        points, colors = [], []
+        for engine, layout, (offset_x, offset_y) in zip(engines, layouts, piece_offsets):
+            block = engine.current_block
+            if block:
+                ghost_y = block.grid_y - engine.get_drop_distance()
+                for x, y in block.shape:
+                    if ghost_y + y < GRID_HEIGHT:
+                        layout.add_cell(points, colors, block.grid_x + x, ghost_y + y, GHOST_COLOR)
+                # Rows above the visible grid are the buffer zone, where pieces spawn out of sight
+                for x, y in block.get_global_positions():
+                    if y < GRID_HEIGHT:
+                        layout.add_cell(points, colors, x + offset_x, y + offset_y, self.palette[block.cell_index])
+            if engine.hold_block:
+                layout.add_preview(points, colors, layout.hold_center, engine.hold_block,
+                                   self.palette[engine.hold_block.cell_index])
+            for center, next_block in zip(layout.next_centers, engine.get_next_blocks()):
+                layout.add_preview(points, colors, center, next_block, self.palette[next_block.cell_index])
+        if points:
+            arcade.create_rectangles_filled_with_colors(points, colors).draw()
+
 class BKGame(arcade.Window):
-    def __init__(self):
+    def __init__(self, net_session=None, spectator_feed=None, metrics_file=None, metrics_socket=None):
         super().__init__(SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_TITLE)
         arcade.set_background_color(BACKGROUND_COLOR)
+        self.assets = AssetManager()
+        self.sound_dispatcher = SoundDispatcher(self.assets, SOUND_FILES, SOUND_POLYPHONY)
+        self.game_mode = GameMode.MARATHON
+        self.writer = blocko_storage.BackgroundWriter()
+        self.settings = blocko_storage.Settings(self.writer)
+        self.key_bindings = self.settings.key_bindings
+        self.power_ups_enabled = self.settings.options["power_ups_enabled"]
+        self.difficulty = self.settings.options["difficulty"]
+        self.preview_depth = self.settings.options["preview_depth"]
+        self.high_score_store = blocko_storage.HighScoreStore(self.writer)
+        options = self.settings.options
+        self.auto_shift = AutoShift(options["das"], options["arr"], options["soft_drop_factor"])
+        # Game time only runs while playing, in fixed ticks; the engine reads it as its clock
+        self.input_queue = InputQueue()
+        self.timestep = FixedTimestep(options["logic_rate"])
+        self.tick = 0
+        self.simulation_time = 0.0
+        self.last_input_time = self.input_queue.clock()
+        self.latency_tracker = LatencyTracker()
+        self.action_events = 0
+        self.running_tick = False
+        self.board_batch = BoardBatch()
+        # Online versus: keys held and keys pressed at all during the current tick
+        self.net_session = net_session
+        self.net_held_mask = 0
+        self.net_tapped_mask = 0
+        self.spectator_feed = spectator_feed
+        self.event_log = EventLog(self.writer) if options["event_log"] else None
+        self.replay_writer = ReplayWriter(self.writer) if options["replays"] else None
+        # Fleet monitoring, dumped every METRICS_INTERVAL
+        self.metrics = GameMetrics() if metrics_file or metrics_socket else None
+        self.metrics_file = metrics_file
+        self.metrics_socket = MetricsSocket(metrics_socket) if metrics_socket else None
+        self.next_metrics_dump = time.perf_counter() + METRICS_INTERVAL
+        self.rewind = RewindBuffer()
+        self.show_debug_overlay = False
+        self.action_handlers = self.create_action_handlers()
+        self.rebuild_key_dispatch()
         self.setup()
         self.game_state = GameState.MAIN_MENU
         self.bg_music = None
+        self.music_requested = False
+        if self.net_session:
+            self.start_net_game()
+        else:
+            self.resume_suspended_game()
+        self.time_to_first_frame = None
         self.frame_count = 0
         self.pressed_keys = set()
 
     def setup(self):
-        self.game_mode = GameMode.MARATHON
-        self.power_ups_enabled = True
-        self.difficulty = 1
-        self.grid = [[None for _ in range(GRID_WIDTH)] for _ in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT)]
-        self.current_block = None
-        self.next_blocks = []
-        self.hold_block = None
-        self.can_hold = True
-        self.score = 0
-        self.level = 1
-        self.lines_cleared = 0
-        self.last_hard_drop_time = -HARD_DROP_COOLDOWN
-        self.next_drop_time = time.time() + INITIAL_DROP_INTERVAL
-        self.drop_interval = INITIAL_DROP_INTERVAL
-        self.flash_lines = []
-        self.is_flashing = False
-        self.flash_timer = 0
-        self.flash_duration = 0.1
-        self.total_flashes = 0
-        self.max_flashes = 4
-        self.flash_visible = True
-        self.lock_timer = None
-        self.high_scores = self.load_high_scores()
+        # Versus boards share a seed, so both players get the same pieces
+        player_count = 2 if self.game_mode == GameMode.VERSUS else 1
+        seed = random.getrandbits(64)
+        self.game_id = random.getrandbits(64)
+        self.engines = []
+        for index in range(player_count):
+            engine = BlockoEngine(self.game_mode, self.power_ups_enabled, clock=self.get_simulation_time, seed=seed,
+                                  preview_depth=self.preview_depth)
+            self.subscribe_effects(index, engine.events)
+            engine.events.subscribe([EngineEvent.LOCK, EngineEvent.GAME_OVER], functools.partial(self.on_engine_event, index))
+            engine.events.subscribe(ACTION_EVENTS, self.on_action_event)
+            self.engines.append(engine)
+        self.engine = self.engines[0]
+        self.auto_shift.reset()
+        self.auto_shifts = [self.auto_shift] + [
+            AutoShift(self.auto_shift.das, self.auto_shift.arr, self.auto_shift.soft_drop_factor)
+            for _ in range(player_count - 1)
+        ]
+        self.versus = VersusMatch(self.engines) if player_count > 1 else None
+        self.layouts = VERSUS_LAYOUTS if self.versus else SINGLE_LAYOUTS
+        self.previous_pieces = [None] * player_count
+        if self.spectator_feed:
+            self.spectator_feed.watch(self.engines)
+        if self.event_log:
+            self.event_log.watch(self.engines, self.get_tick, game_id=self.game_id)
+        # Replays need a single board that only ever moves forward
+        self.replay_recorder = None
+        if self.replay_writer and player_count == 1 and self.game_mode != GameMode.PRACTICE:
+            self.replay_recorder = ReplayRecorder(self.engine, self.auto_shift, self.game_id, seed,
+                                                  self.settings.options["logic_rate"])
+        self.rewind.clear()
+        self.tick = 0
+        self.simulation_time = 0.0
         self.particle_list = arcade.SpriteList()
-        self.start_time = None
-        self.time_limit = None
-        self.animated_blocks = []
-        self.combo_count = 0
-        self.power_ups = {ptype: PowerUp(ptype) for ptype in POWER_UP_TYPES}
-        self.active_power_ups = []
         self.tutorial_step = 0
-        self.combo_display_time = 0
-        self.power_up_display_time = 0
-        self.last_pressure_time = 0
-        self.pressure_interval = INITIAL_PRESSURE_INTERVAL
-        self.pressure_height = INITIAL_PRESSURE_HEIGHT
-        self.pressure_level = 0
-        self.lava_height = 0
         self.menu_selection = 0
         self.mode_selection = 0
         self.option_selection = 0
-        self.key_bindings = self.load_key_bindings()
         self.rebinding_action = None
 
-    def load_high_scores(self):
-        if os.path.exists("high_scores.json"):
-            try:
-                with open("high_scores.json", "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return []
-        return []
-
-    def save_high_scores(self):
-        with open("high_scores.json", "w") as f:
-            json.dump(self.high_scores, f)
-
     def update_high_scores(self):
-        self.high_scores.append({"score": self.score, "level": self.level, "lines": self.lines_cleared})
-        self.high_scores.sort(key=lambda x: x["score"], reverse=True)
-        self.high_scores = self.high_scores[:10]
-        self.save_high_scores()
-
-    def load_key_bindings(self):
-        if os.path.exists("key_bindings.json"):
-            try:
-                with open("key_bindings.json", "r") as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return DEFAULT_KEY_BINDINGS.copy()
-        return DEFAULT_KEY_BINDINGS.copy()
+        engine = self.engine
+        if engine.game_mode in [GameMode.PRACTICE, GameMode.VERSUS]:
+            return
+        self.high_score_store.add(engine.game_mode, engine.score, engine.level, engine.lines_cleared)
 
     def save_key_bindings(self):
-        with open("key_bindings.json", "w") as f:
-            json.dump(self.key_bindings, f)
-
-    def get_ghost_position(self):
-        if not self.current_block:
-            return []
-        
-        ghost_block = Block(
-            self.current_block.shape.copy(),
-            self.current_block.color,
-            self.current_block.grid_x,
-            self.current_block.grid_y,
-            self.current_block.block_type
-        )
-        
-        while self.is_valid_position([(x, y - 1) for x, y in ghost_block.get_global_positions()]):
-            ghost_block.move(0, -1)
-        
-        return ghost_block
-        
-    def spawn_new_block(self):
-        if len(self.next_blocks) < 3:
-            self.next_blocks.extend([self.get_new_block() for _ in range(3 - len(self.next_blocks))])
-        self.current_block = self.next_blocks.pop(0)
-        self.next_blocks.append(self.get_new_block())
-    
-        self.current_block.grid_x = (GRID_WIDTH - self.current_block.get_width()) // 2
-        self.current_block.grid_y = GRID_HEIGHT + BUFFER_ZONE_HEIGHT - self.current_block.get_height()
-    
-        if not self.is_valid_position(self.current_block.get_global_positions()):
+        self.settings.save_key_bindings()
+
+    def save_options(self):
+        self.settings.options["power_ups_enabled"] = self.power_ups_enabled
+        self.settings.options["difficulty"] = self.difficulty
+        self.settings.options["preview_depth"] = self.preview_depth
+        self.settings.options["das"] = self.auto_shift.das
+        self.settings.options["arr"] = self.auto_shift.arr
+        self.settings.options["soft_drop_factor"] = self.auto_shift.soft_drop_factor
+        self.settings.options["event_log"] = self.event_log is not None
+        self.settings.options["replays"] = self.replay_writer is not None
+        self.settings.save_options()
+
+    def on_engine_event(self, index, event, *args):
+        if event == EngineEvent.GAME_OVER:
             self.game_over()
-            return False
-    
-        self.can_hold = True
-        return True
-
-    def get_new_block(self):
-        shape = random.choice(BLOCK_SHAPES)
-        color = random.choice(BLOCK_COLORS)
-        block_type = 'I' if shape == [(0,2), (1,2), (2,2), (3,2), (4,2)] else 'non-I'
-        return Block(shape, color, 0, 0, block_type)
-
-    def hold_piece(self):
-        if not self.can_hold:
-            return
-
-        if self.hold_block:
-            self.current_block, self.hold_block = self.hold_block, self.current_block
-            self.current_block.grid_x = (GRID_WIDTH - self.current_block.get_width()) // 2
-            self.current_block.grid_y = GRID_HEIGHT + BUFFER_ZONE_HEIGHT - 1
+        if event == EngineEvent.LOCK and not self.versus and not self.engine.is_game_over:
+            self.suspend_game()
+            if self.engine.game_mode == GameMode.PRACTICE:
+                self.rewind.record(self.save_state())
+
+    def on_action_event(self, event, *args):
+        self.action_events += 1
+
+    def subscribe_effects(self, index, events):
+        events.subscribe(list(EVENT_SOUNDS), self.sound_dispatcher.handle_event)
+        events.subscribe(PARTICLE_EVENTS, functools.partial(self.show_particles, index))
+        if self.metrics:
+            events.subscribe(METRIC_EVENTS, self.metrics.on_engine_event)
+
+    def show_particles(self, index, event, *args):
+        if event == EngineEvent.EXPLOSION:
+            self.create_explosion_particles(index, *args)
         else:
-            self.hold_block = self.current_block
-            self.spawn_new_block()
-
-        self.can_hold = False
-
-    def move_block(self, dx, dy):
-        if self.current_block:
-            new_positions = [(x + dx, y + dy) for x, y in self.current_block.get_global_positions()]
-            if self.is_valid_position(new_positions):
-                self.current_block.move(dx, dy)
-                if dy == -1:
-                    self.score += SCORE_SOFT_DROP
-                arcade.play_sound(MOVE_SOUND)
-                return True
-        return False
-    
-    def is_valid_position(self, positions):
-        for x, y in positions:
-            if x < 0 or x >= GRID_WIDTH or y < 0:
-                return False
-            if y < GRID_HEIGHT + BUFFER_ZONE_HEIGHT and self.grid[int(y)][int(x)] is not None:
-                return False
-        return True
-
-    def hard_drop(self):
-        if not self.current_block:
-            return
-        drop_distance = 0
-        while self.move_block(0, -1):
-            drop_distance += 1
-        self.score += SCORE_HARD_DROP * drop_distance
-        self.place_block()
-        arcade.play_sound(LOCK_SOUND)
-
-    def place_block(self):
-        for x, y in self.current_block.get_global_positions():
-            if 0 <= y < GRID_HEIGHT and 0 <= x < GRID_WIDTH:
-                self.grid[int(y)][int(x)] = self.current_block.color
-        self.clear_lines()
-        self.spawn_new_block()
-        self.lock_timer = None
-        arcade.play_sound(LOCK_SOUND)
-        
-    def clear_lines(self):
-        lines_to_clear = []
-        for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
-            if all(self.grid[y][x] is not None for x in range(GRID_WIDTH)):
-                lines_to_clear.append(y)
-    
-        if lines_to_clear:
-            self.flash_lines = lines_to_clear.copy()
-            self.is_flashing = True
-            self.flash_timer = 0
-            self.flash_visible = True
-            self.total_flashes = 0
-            arcade.play_sound(LINE_CLEAR_SOUND)
-            self.create_clear_particles(lines_to_clear)
-            self.update_combo(len(lines_to_clear))
-            if self.power_ups_enabled:
-                self.spawn_power_up_block()
-    
-            for y in sorted(lines_to_clear, reverse=True):
-                del self.grid[y]
-    
-            for _ in range(len(lines_to_clear)):
-                self.grid.insert(0, [None for _ in range(GRID_WIDTH)])
-    
-            self.lines_cleared += len(lines_to_clear)
-            self.score += self.calculate_score(len(lines_to_clear))
-            self.update_level()
-
-    def calculate_score(self, lines_cleared):
-        base_scores = {1: SCORE_SINGLE, 2: SCORE_DOUBLE, 3: SCORE_TRIPLE, 4: SCORE_QUADRUPLE, 5: SCORE_BLOCKO}
-        return base_scores.get(lines_cleared, SCORE_BLOCKO) * self.level
-
-    def update_level(self):
-        self.level = min(self.lines_cleared // 10 + 1, 15)
-        self.drop_interval = max(MIN_DROP_INTERVAL, INITIAL_DROP_INTERVAL - 0.05 * (self.level - 1))
-
-    def update_combo(self, lines_cleared):
-        if lines_cleared > 0:
-            self.combo_count += 1
-            combo_bonus = self.combo_count * 50 * self.level
-            self.score += combo_bonus
-            self.combo_display_time = time.time()
-            arcade.play_sound(ROTATE_SOUND)  # Use as combo sound
-        else:
-            self.combo_count = 0
-
-    def create_clear_particles(self, lines):
-        for y in lines:
-            for x in range(GRID_WIDTH):
-                if self.grid[y][x]:
-                    screen_x = GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE // 2
-                    screen_y = GRID_ORIGIN_Y + (y - BUFFER_ZONE_HEIGHT) * BLOCK_SIZE + BLOCK_SIZE // 2
-                    for _ in range(PARTICLE_COUNT // GRID_WIDTH):
-                        particle = Particle(screen_x, screen_y, self.grid[y][x])
-                        self.particle_list.append(particle)
-
-    def spawn_power_up_block(self):
-        if random.random() < POWER_UP_CHANCE:
-            power_up_type = random.choices(
-                list(POWER_UP_TYPES.keys()), 
-                weights=[POWER_UP_TYPES[t]["chance"] for t in POWER_UP_TYPES]
-            )[0]
-            self.activate_power_up(power_up_type)
-
-    def activate_power_up(self, type):
-        power_up = self.power_ups[type]
-        power_up.activate()
-        self.active_power_ups.append(power_up)
-        self.power_up_display_time = time.time()
-        arcade.play_sound(ROTATE_SOUND)  # Use as power-up sound
-
-        if type == "CLEAR_ROW":
-            self.clear_random_row()
-        elif type == "SLOW_TIME":
-            self.drop_interval *= 1.5
-        elif type == "AVALANCHE":
-            self.trigger_avalanche()
-        elif type == "BOMB":
-            self.trigger_bomb()
-
-    def clear_random_row(self):
-        row = random.randint(0, GRID_HEIGHT - 1)
-        if any(self.grid[row]):
-            self.grid[row] = [None for _ in range(GRID_WIDTH)]
-            self.create_clear_particles([row])
-
-    def trigger_avalanche(self):
-        self.settle_all_blocks()
-
-    def settle_all_blocks(self):
-        blocks_moved = False
-        for x in range(GRID_WIDTH):
-            column_settled = self.settle_column(x)
-            blocks_moved = blocks_moved or column_settled
-
-        if blocks_moved:
-            self.clear_lines()
-
-    def settle_column(self, x):
-        column = [self.grid[y][x] for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT)]
-        settled_column = [block for block in column if block is not None]
-        blocks_moved = len(settled_column) != len([block for block in column if block is not None])
-
-        settled_column = [None] * (GRID_HEIGHT + BUFFER_ZONE_HEIGHT - len(settled_column)) + settled_column
-
-        for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
-            if self.grid[y][x] != settled_column[y]:
-                self.grid[y][x] = settled_column[y]
-
-        return blocks_moved
-
-    def trigger_bomb(self):
-        bomb_x = random.randint(0, GRID_WIDTH - 1)
-        bomb_y = random.randint(0, GRID_HEIGHT - 1)
-
-        for y in range(max(0, bomb_y - 2), min(GRID_HEIGHT + BUFFER_ZONE_HEIGHT, bomb_y + 3)):
-            for x in range(max(0, bomb_x - 2), min(GRID_WIDTH, bomb_x + 3)):
-                if self.grid[y][x]:
-                    self.grid[y][x] = None
-                    self.create_explosion_particles(x, y)
-
-        self.settle_all_blocks()
-
-    def create_explosion_particles(self, x, y):
-        screen_x = GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE // 2
-        screen_y = GRID_ORIGIN_Y + (y - BUFFER_ZONE_HEIGHT) * BLOCK_SIZE + BLOCK_SIZE // 2
+            self.create_clear_particles(index, args[0])
+
+    def create_clear_particles(self, index, cells):
+        for x, y, cell in cells:
+            screen_x, screen_y = self.layouts[index].cell_center(x, y)
+            for _ in range(PARTICLE_COUNT // GRID_WIDTH):
+                particle = Particle(screen_x, screen_y, self.board_batch.palette[cell])
+                self.particle_list.append(particle)
+
+    def create_explosion_particles(self, index, x, y):
+        screen_x, screen_y = self.layouts[index].cell_center(x, y)
         for _ in range(20):
-            particle = Particle(screen_x, screen_y, arcade.color.ORANGE)
+            particle = Particle(screen_x, screen_y, EXPLOSION_COLOR)
             self.particle_list.append(particle)
 
-    def update_power_ups(self):
-        current_time = time.time()
-        for power_up in self.active_power_ups[:]:
-            if power_up.duration > 0 and current_time - power_up.start_time > power_up.duration:
-                if power_up.type == "SLOW_TIME":
-                    self.drop_interval /= 1.5
-                power_up.deactivate()
-                self.active_power_ups.remove(power_up)
-
     def game_over(self):
         self.game_state = GameState.GAME_OVER
+        # A game that ends inside a tick is saved by run_logic_tick once that tick is recorded
+        if not self.running_tick:
+            self.save_replay()
         self.stop_background_music()
-        arcade.play_sound(GAME_OVER_SOUND)
         self.update_high_scores()
-        self.current_block = None
+        self.export_latency()
+        self.writer.write_file(blocko_storage.SUSPEND_FILE, None)
+
+    def save_state(self):
+        return SUSPEND_HEADER.pack(self.simulation_time) + self.engine.snapshot()
+
+    def load_state(self, data):
+        simulation_time, = SUSPEND_HEADER.unpack_from(data)
+        self.engine.restore(data[SUSPEND_HEADER.size:])
+        self.simulation_time = simulation_time
+        self.tick = round(simulation_time / self.timestep.step)
+        self.previous_pieces = [None]
+        if self.spectator_feed:
+            self.spectator_feed.invalidate()
+
+    def suspend_game(self):
+        # Saved after every lock and on pause, so a power cut loses at most one piece
+        if self.versus:
+            return
+        self.writer.write_file(blocko_storage.SUSPEND_FILE, self.save_state())
+
+    def resume_suspended_game(self):
+        data = blocko_storage.load_file(blocko_storage.SUSPEND_FILE)
+        if not data:
+            return
+        try:
+            self.load_state(data)
+        except (struct.error, ValueError, IndexError) as e:
+            print(f"Could not resume suspended game: {e}")
+            self.setup()
+            return
+        self.game_mode = self.engine.game_mode
+        # The recorder was made for a fresh game, so a resumed one is not recorded
+        self.replay_recorder = None
+        if self.game_mode == GameMode.PRACTICE:
+            self.rewind.record(data)
+        if self.metrics:
+            self.metrics.start_game(self.simulation_time)
+        self.game_state = GameState.PAUSED
+        self.start_background_music()
+
+    def rewind_game(self, forward=False):
+        # Practice mode only: step back or forward one piece
+        if self.engine.game_mode != GameMode.PRACTICE:
+            return
+        if forward:
+            data = self.rewind.redo()
+        elif self.engine.is_game_over:
+            # The lock that topped out is never recorded, so taking it back
+            # returns to the last recorded state
+            data = self.rewind.state
+        else:
+            data = self.rewind.undo()
+        if data is None:
+            return
+        self.load_state(data)
+        self.auto_shift.reset()
+        if self.game_state == GameState.GAME_OVER:
+            self.game_state = GameState.PAUSED
+            self.start_background_music()
+        self.suspend_game()
+
+    def export_latency(self):
+        # One JSON line per export, latencies in milliseconds
+        report = self.latency_tracker.summary()
+        if not report:
+            return
+        line = json.dumps({
+            "time": time.time(),
+            "mode": self.game_mode,
+            "logic_rate": round(1 / self.timestep.step),
+            "actions": {
+                action_type: {name: round(value * 1000, 2) if name != "count" else value
+                              for name, value in stats.items()}
+                for action_type, stats in report.items()
+            }
+        })
+        self.writer.submit(lambda: blocko_storage.append_file(blocko_storage.LATENCY_LOG_FILE, line + "\n"))
         
     def on_draw(self):
+        draw_start = time.perf_counter()
+        if self.metrics:
+            self.metrics.frame_started(draw_start)
         arcade.start_render()
+        self.frame_count += 1
         
         if self.game_state == GameState.MAIN_MENU:
             self.draw_main_menu()
@@ -596,92 +600,104 @@ class BKGame(arcade.Window):
             self.draw_tutorial()
         elif self.game_state == GameState.KEY_BINDING:
             self.draw_key_binding_menu()
+
+        if self.show_debug_overlay:
+            self.draw_debug_overlay()
+
+        # Everything applied before this frame is now on screen
+        presented = time.perf_counter()
+        self.latency_tracker.frame_presented(presented)
+        if self.metrics:
+            self.metrics.observe("blocko_draw_seconds", presented - draw_start)
+
+        if self.time_to_first_frame is None:
+            self.on_first_frame()
+
+    def on_first_frame(self):
+        self.time_to_first_frame = time.perf_counter() - PROCESS_START_TIME
+        print(f"Time to first frame: {self.time_to_first_frame * 1000:.0f} ms")
+        # Now that the menu is up, warm the assets in the background
+        self.sound_dispatcher.preload()
+        self.assets.load_in_background(MUSIC_FILE)
             
+    def get_piece_offset(self, index, alpha):
+        # Only single-cell steps are smoothed; spawns, hard drops and kicks snap
+        block = self.engines[index].current_block
+        previous_piece = self.previous_pieces[index]
+        if not previous_piece or previous_piece[0] is not block:
+            return 0, 0
+        dx = previous_piece[1] - block.grid_x
+        dy = previous_piece[2] - block.grid_y
+        if abs(dx) + abs(dy) != 1:
+            return 0, 0
+        return dx * (1 - alpha), dy * (1 - alpha)
+
     def draw_game(self):
-        # Draw grid and placed blocks
-        for y in range(GRID_HEIGHT):
-            for x in range(GRID_WIDTH):
-                arcade.draw_rectangle_outline(
-                    GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE / 2,
-                    GRID_ORIGIN_Y + y * BLOCK_SIZE + BLOCK_SIZE / 2,
-                    BLOCK_SIZE, BLOCK_SIZE, GRID_COLOR
-                )
-                if self.grid[y][x]:
-                    arcade.draw_rectangle_filled(
-                        GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE / 2,
-                        GRID_ORIGIN_Y + y * BLOCK_SIZE + BLOCK_SIZE / 2,
-                        BLOCK_SIZE, BLOCK_SIZE, self.grid[y][x]
-                    )
-    
-        # Draw ghost block
-        ghost_positions = self.get_ghost_position().get_global_positions()
-        for x, y in ghost_positions:
-            if 0 <= y < GRID_HEIGHT:
-                arcade.draw_rectangle_filled(
-                    GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE / 2,
-                    GRID_ORIGIN_Y + y * BLOCK_SIZE + BLOCK_SIZE / 2,
-                    BLOCK_SIZE, BLOCK_SIZE, GHOST_COLOR
-                )
-    
-        # Draw current block
-        if self.current_block:
-            for x, y in self.current_block.get_global_positions():
-                if 0 <= y < GRID_HEIGHT + BUFFER_ZONE_HEIGHT:
-                    arcade.draw_rectangle_filled(
-                        GRID_ORIGIN_X + x * BLOCK_SIZE + BLOCK_SIZE / 2,
-                        GRID_ORIGIN_Y + (y - BUFFER_ZONE_HEIGHT) * BLOCK_SIZE + BLOCK_SIZE / 2,
-                        BLOCK_SIZE, BLOCK_SIZE, self.current_block.color
-                    )
-    
-        # Draw particles, score, level, hold box, next pieces, and notifications
+        engine = self.engine
+        alpha = self.timestep.alpha() if self.game_state == GameState.PLAYING else 1.0
+        # Boards, pieces and previews, interpolated from where pieces were on the previous tick
+        offsets = [self.get_piece_offset(index, alpha) for index in range(len(self.engines))]
+        self.board_batch.draw(self.engines, self.layouts, offsets)
+        for particle in self.particle_list:
+            particle.interpolate(alpha)
         self.particle_list.draw()
-        arcade.draw_text(f"Score: {self.score}", 10, SCREEN_HEIGHT - 30, arcade.color.WHITE, 20)
-        arcade.draw_text(f"Level: {self.level}", 10, SCREEN_HEIGHT - 60, arcade.color.WHITE, 20)
-        arcade.draw_text(f"Lines: {self.lines_cleared}", 10, SCREEN_HEIGHT - 90, arcade.color.WHITE, 20)
-        self.draw_hold_box()
-        self.draw_next_pieces()
-    
-        # Draw combo and power-up notifications
-        if time.time() - self.combo_display_time < 2:
-            arcade.draw_text(f"Combo x{self.combo_count}!", 
+
+        if self.versus:
+            self.draw_versus_hud()
+            return
+
+        # Draw score, level, preview labels and notifications
+        arcade.draw_text(f"Score: {engine.score}", 10, SCREEN_HEIGHT - 30, arcade.color.WHITE, 20)
+        arcade.draw_text(f"Level: {engine.level}", 10, SCREEN_HEIGHT - 60, arcade.color.WHITE, 20)
+        arcade.draw_text(f"Lines: {engine.lines_cleared}", 10, SCREEN_HEIGHT - 90, arcade.color.WHITE, 20)
+        self.draw_preview_labels(self.layouts[0], 20)
+        if engine.clock() - engine.combo_display_time < 2:
+            arcade.draw_text(f"Combo x{engine.combo_count}!", 
                             SCREEN_WIDTH // 2, SCREEN_HEIGHT - 50,
                             arcade.color.YELLOW, 24, anchor_x="center")
-        if time.time() - self.power_up_display_time < 2:
-            active_power_ups = [p.type for p in self.active_power_ups]
+        if engine.clock() - engine.power_up_display_time < 2:
+            active_power_ups = [p.type for p in engine.active_power_ups]
             arcade.draw_text(f"Power-up: {', '.join(active_power_ups)}", 
                             SCREEN_WIDTH // 2, SCREEN_HEIGHT - 80,
                             arcade.color.CYAN, 20, anchor_x="center")
 
-    def draw_hold_box(self):
-        arcade.draw_rectangle_outline(
-            GRID_ORIGIN_X - 100, SCREEN_HEIGHT - 100,
-            80, 80, arcade.color.WHITE
-        )
-        arcade.draw_text("HOLD", GRID_ORIGIN_X - 100, SCREEN_HEIGHT - 50,
-                         arcade.color.WHITE, 20, anchor_x="center")
-        if self.hold_block:
-            for x, y in self.hold_block.shape:
-                arcade.draw_rectangle_filled(
-                    GRID_ORIGIN_X - 100 + (x + 1) * BLOCK_SIZE,
-                    SCREEN_HEIGHT - 100 + (y + 1) * BLOCK_SIZE,
-                    BLOCK_SIZE, BLOCK_SIZE, self.hold_block.color
-                )
-
-    def draw_next_pieces(self):
-        for i, next_block in enumerate(self.next_blocks[:3]):
-            arcade.draw_rectangle_outline(
-                GRID_ORIGIN_X + GRID_WIDTH * BLOCK_SIZE + 50,
-                SCREEN_HEIGHT - 100 - i * 100,
-                80, 80, arcade.color.WHITE
-            )
-            for x, y in next_block.shape:
-                arcade.draw_rectangle_filled(
-                    GRID_ORIGIN_X + GRID_WIDTH * BLOCK_SIZE + 50 + (x + 1) * BLOCK_SIZE,
-                    SCREEN_HEIGHT - 100 - i * 100 + (y + 1) * BLOCK_SIZE,
-                    BLOCK_SIZE, BLOCK_SIZE, next_block.color
-                )
-        arcade.draw_text("NEXT", GRID_ORIGIN_X + GRID_WIDTH * BLOCK_SIZE + 50,
-                         SCREEN_HEIGHT - 50, arcade.color.WHITE, 20, anchor_x="center")
+    def draw_preview_labels(self, layout, font_size):
+        hold_x, hold_y = layout.hold_center
+        next_x, next_y = layout.next_centers[0]
+        arcade.draw_text("HOLD", hold_x, hold_y + 50 * layout.scale, arcade.color.WHITE, font_size, anchor_x="center")
+        arcade.draw_text("NEXT", next_x, next_y + 50 * layout.scale, arcade.color.WHITE, font_size, anchor_x="center")
+
+    def draw_versus_hud(self):
+        for index, (engine, layout) in enumerate(zip(self.engines, self.layouts)):
+            center_x = layout.origin_x + GRID_WIDTH * layout.cell_size / 2
+            label = f"Player {index + 1}"
+            if self.net_session and index == self.net_session.local_player:
+                label += " (you)"
+            arcade.draw_text(label, center_x, SCREEN_HEIGHT - 40,
+                             arcade.color.WHITE, 24, anchor_x="center")
+            arcade.draw_text(f"Score: {engine.score}  Lines: {engine.lines_cleared}", center_x, layout.origin_y - 30,
+                             arcade.color.WHITE, 16, anchor_x="center")
+            if engine.pending_garbage:
+                arcade.draw_text(f"Incoming: {engine.pending_garbage}", center_x, layout.origin_y - 55,
+                                 arcade.color.RED, 16, anchor_x="center")
+            self.draw_preview_labels(layout, 14)
+
+    def draw_debug_overlay(self):
+        lines = [f"Input queue wait: {self.input_queue.last_latency * 1000:.1f} ms  "
+                 f"Dropped ticks: {self.timestep.dropped_ticks}"]
+        for action_type, stats in sorted(self.latency_tracker.summary().items()):
+            lines.append(f"{action_type}: p50 {stats['p50'] * 1000:.1f}  p95 {stats['p95'] * 1000:.1f}  "
+                         f"p99 {stats['p99'] * 1000:.1f} ms  (n={stats['count']})")
+        if self.net_session:
+            session = self.net_session
+            lines.append(f"Tick {session.tick}, confirmed {session.confirmed_tick}  Rollbacks: {session.rollbacks}  "
+                         f"last {session.last_rollback_time * 1000:.2f} ms, worst {session.max_rollback_time * 1000:.2f} ms  "
+                         f"Stalls: {session.stalls}")
+        if self.spectator_feed:
+            feed = self.spectator_feed
+            lines.append(f"Spectators: {feed.watchers}  Feed encode: {feed.last_encode_time * 1000:.2f} ms")
+        for i, line in enumerate(lines):
+            arcade.draw_text(line, 10, 10 + (len(lines) - 1 - i) * 16, arcade.color.YELLOW, 11)
 
     def draw_main_menu(self):
         arcade.draw_text("bLocKo", SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100,
@@ -693,9 +709,9 @@ class BKGame(arcade.Window):
             arcade.draw_text(item, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 200 - i * 50,
                              color, 30, anchor_x="center")
         
-        move_up = key_to_string(self.key_bindings['MOVE_UP'])
-        move_down = key_to_string(self.key_bindings['MOVE_DOWN'])
-        select = key_to_string(self.key_bindings['SELECT'])
+        move_up = binding_to_string(self.key_bindings['MOVE_UP'])
+        move_down = binding_to_string(self.key_bindings['MOVE_DOWN'])
+        select = binding_to_string(self.key_bindings['SELECT'])
         arcade.draw_text(f"Use {move_up}/{move_down} to navigate, {select} to select", 
                          SCREEN_WIDTH // 2, 50, arcade.color.WHITE, 20, anchor_x="center")
 
@@ -703,15 +719,14 @@ class BKGame(arcade.Window):
         arcade.draw_text("Select Game Mode", SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100,
                          arcade.color.WHITE, 40, anchor_x="center")
         
-        mode_items = ["Marathon", "Sprint", "Ultra", "Pressure", "Back"]
-        for i, item in enumerate(mode_items):
+        for i, item in enumerate(GAME_MODE_ITEMS):
             color = arcade.color.YELLOW if i == self.mode_selection else arcade.color.WHITE
             arcade.draw_text(item, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 200 - i * 50,
                              color, 30, anchor_x="center")
         
-        move_up = key_to_string(self.key_bindings['MOVE_UP'])
-        move_down = key_to_string(self.key_bindings['MOVE_DOWN'])
-        select = key_to_string(self.key_bindings['SELECT'])
+        move_up = binding_to_string(self.key_bindings['MOVE_UP'])
+        move_down = binding_to_string(self.key_bindings['MOVE_DOWN'])
+        select = binding_to_string(self.key_bindings['SELECT'])
         arcade.draw_text(f"Use {move_up}/{move_down} to navigate, {select} to select", 
                          SCREEN_WIDTH // 2, 50, arcade.color.WHITE, 20, anchor_x="center")
 
@@ -721,15 +736,23 @@ class BKGame(arcade.Window):
         
         power_ups_text = "Power-ups: ON" if self.power_ups_enabled else "Power-ups: OFF"
         difficulty_text = f"Difficulty: {self.difficulty}"
-        options_items = [power_ups_text, difficulty_text, "Key Bindings", "Back"]
+        preview_text = f"Preview: {self.preview_depth}"
+        das_text = f"DAS: {round(self.auto_shift.das * 1000)} ms"
+        arr_text = f"ARR: {round(self.auto_shift.arr * 1000)} ms"
+        soft_drop_factor = self.auto_shift.soft_drop_factor
+        soft_drop_text = f"Soft Drop: x{soft_drop_factor}" if soft_drop_factor else "Soft Drop: Instant"
+        event_log_text = "Event Log: ON" if self.event_log else "Event Log: OFF"
+        replays_text = "Replays: ON" if self.replay_writer else "Replays: OFF"
+        options_items = [power_ups_text, difficulty_text, preview_text, das_text, arr_text, soft_drop_text,
+                         event_log_text, replays_text, "Key Bindings", "Back"]
         for i, item in enumerate(options_items):
             color = arcade.color.YELLOW if i == self.option_selection else arcade.color.WHITE
             arcade.draw_text(item, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 200 - i * 50,
                              color, 30, anchor_x="center")
         
-        move_up = key_to_string(self.key_bindings['MOVE_UP'])
-        move_down = key_to_string(self.key_bindings['MOVE_DOWN'])
-        select = key_to_string(self.key_bindings['SELECT'])
+        move_up = binding_to_string(self.key_bindings['MOVE_UP'])
+        move_down = binding_to_string(self.key_bindings['MOVE_DOWN'])
+        select = binding_to_string(self.key_bindings['SELECT'])
         arcade.draw_text(f"Use {move_up}/{move_down} to navigate, {select} to select", 
                          SCREEN_WIDTH // 2, 50, arcade.color.WHITE, 20, anchor_x="center")
 
@@ -737,24 +760,42 @@ class BKGame(arcade.Window):
         arcade.draw_lrtb_rectangle_filled(0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, (0, 0, 0, 150))
         arcade.draw_text("PAUSED", SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2,
                          arcade.color.WHITE, 50, anchor_x="center", anchor_y="center")
-        pause_key = key_to_string(self.key_bindings['PAUSE'])
+        pause_key = binding_to_string(self.key_bindings['PAUSE'])
         arcade.draw_text(f"Press {pause_key} to resume", SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 50,
                          arcade.color.WHITE, 20, anchor_x="center")
+        if self.engine.game_mode == GameMode.PRACTICE:
+            undo = binding_to_string(self.key_bindings['UNDO'])
+            redo = binding_to_string(self.key_bindings['REDO'])
+            arcade.draw_text(f"{undo}/{redo} to step back or forward a piece", SCREEN_WIDTH // 2,
+                             SCREEN_HEIGHT // 2 - 80, arcade.color.WHITE, 20, anchor_x="center")
 
     def draw_game_over_screen(self):
         arcade.draw_lrtb_rectangle_filled(0, SCREEN_WIDTH, SCREEN_HEIGHT, 0, (0, 0, 0, 180))
         arcade.draw_text("GAME OVER", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 + 50,
                          arcade.color.RED, 50, anchor_x="center")
-        arcade.draw_text(f"Final Score: {self.score}", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2,
-                         arcade.color.WHITE, 30, anchor_x="center")
-        select = key_to_string(self.key_bindings['SELECT'])
+        if self.versus:
+            result = f"Player {self.versus.winner + 1} wins!" if self.versus.winner is not None else "Draw"
+            arcade.draw_text(result, SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2, arcade.color.WHITE, 30, anchor_x="center")
+        else:
+            arcade.draw_text(f"Final Score: {self.engine.score}", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2,
+                             arcade.color.WHITE, 30, anchor_x="center")
+        select = binding_to_string(self.key_bindings['SELECT'])
         arcade.draw_text(f"Press {select} to return to main menu",
                          SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 50,
                          arcade.color.WHITE, 25, anchor_x="center")
         
+        if self.versus:
+            return
+        if self.engine.game_mode == GameMode.PRACTICE:
+            undo = binding_to_string(self.key_bindings['UNDO'])
+            arcade.draw_text(f"Press {undo} to take back the last piece",
+                             SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 100,
+                             arcade.color.YELLOW, 20, anchor_x="center")
+            return
+
         arcade.draw_text("High Scores:", SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 100,
                          arcade.color.YELLOW, 25, anchor_x="center")
-        for i, hs in enumerate(self.high_scores[:5]):
+        for i, hs in enumerate(self.high_score_store.top(self.engine.game_mode, 5)):
             arcade.draw_text(f"{i+1}. Score: {hs['score']} (Level {hs['level']})",
                              SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2 - 130 - i * 30,
                              arcade.color.WHITE, 20, anchor_x="center")
@@ -765,13 +806,13 @@ class BKGame(arcade.Window):
         
         tutorial_steps = [
             ["Welcome to bLocKo!", "Clear lines to score points and survive as long as you can!"],
-            [f"Use {key_to_string(self.key_bindings['MOVE_LEFT'])} and {key_to_string(self.key_bindings['MOVE_RIGHT'])} to move blocks left and right"],
-            [f"Press {key_to_string(self.key_bindings['SOFT_DROP'])} for soft drop", f"Press {key_to_string(self.key_bindings['HARD_DROP'])} for hard drop"],
-            [f"Rotate blocks with {key_to_string(self.key_bindings['ROTATE_LEFT'])} and {key_to_string(self.key_bindings['ROTATE_RIGHT'])}"],
-            [f"Hold a piece with {key_to_string(self.key_bindings['HOLD'])}", f"Pause the game with {key_to_string(self.key_bindings['PAUSE'])}"],
+            [f"Use {binding_to_string(self.key_bindings['MOVE_LEFT'])} and {binding_to_string(self.key_bindings['MOVE_RIGHT'])} to move blocks left and right"],
+            [f"Press {binding_to_string(self.key_bindings['SOFT_DROP'])} for soft drop", f"Press {binding_to_string(self.key_bindings['HARD_DROP'])} for hard drop"],
+            [f"Rotate blocks with {binding_to_string(self.key_bindings['ROTATE_LEFT'])} and {binding_to_string(self.key_bindings['ROTATE_RIGHT'])}"],
+            [f"Hold a piece with {binding_to_string(self.key_bindings['HOLD'])}", f"Pause the game with {binding_to_string(self.key_bindings['PAUSE'])}"],
             ["Watch out for power-ups!", "They can help or challenge you"],
             ["In Pressure mode, watch out for rising blocks!", "Clear lines quickly to survive"],
-            ["You're ready to play!", f"Press {key_to_string(self.key_bindings['SELECT'])} to start"]
+            ["You're ready to play!", f"Press {binding_to_string(self.key_bindings['SELECT'])} to start"]
         ]
         
         current_step = tutorial_steps[min(self.tutorial_step, len(tutorial_steps) - 1)]
@@ -779,8 +820,8 @@ class BKGame(arcade.Window):
             arcade.draw_text(line, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 200 - i * 40,
                              arcade.color.WHITE, 20, anchor_x="center")
         
-        select = key_to_string(self.key_bindings['SELECT'])
-        back = key_to_string(self.key_bindings['BACK'])
+        select = binding_to_string(self.key_bindings['SELECT'])
+        back = binding_to_string(self.key_bindings['BACK'])
         arcade.draw_text(f"Press {select} to continue, {back} to return to menu", 
                          SCREEN_WIDTH // 2, 50, arcade.color.WHITE, 20, anchor_x="center")
 
@@ -788,17 +829,21 @@ class BKGame(arcade.Window):
         arcade.draw_text("Key Bindings", SCREEN_WIDTH // 2, SCREEN_HEIGHT - 50,
                          arcade.color.WHITE, 40, anchor_x="center")
         
+        spacing = min(30, 620 // len(self.key_bindings))
         for i, (action, key) in enumerate(self.key_bindings.items()):
             color = arcade.color.YELLOW if i == self.menu_selection else arcade.color.WHITE
-            text = f"{action}: {key_to_string(key)}"
+            text = f"{action}: {binding_to_string(key)}"
+            if action in self.binding_conflicts:
+                color = arcade.color.RED
+                text += " (conflict)"
             if self.rebinding_action == action:
                 text += " (Press new key)"
-            arcade.draw_text(text, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100 - i * 30,
-                             color, 20, anchor_x="center")
+            arcade.draw_text(text, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 100 - i * spacing,
+                             color, min(20, spacing - 8), anchor_x="center")
         
         if not self.rebinding_action:
-            select = key_to_string(self.key_bindings['SELECT'])
-            back = key_to_string(self.key_bindings['BACK'])
+            select = binding_to_string(self.key_bindings['SELECT'])
+            back = binding_to_string(self.key_bindings['BACK'])
             arcade.draw_text(f"Press {select} to rebind, {back} to go back", 
                              SCREEN_WIDTH // 2, 50, arcade.color.WHITE, 20, anchor_x="center")
 
@@ -816,8 +861,7 @@ class BKGame(arcade.Window):
             elif selected == "Quit":
                 arcade.close_window()
         elif self.game_state == GameState.GAME_MODE_SELECT:
-            mode_options = ["Marathon", "Sprint", "Ultra", "Pressure", "Back"]
-            selected = mode_options[self.mode_selection]
+            selected = GAME_MODE_ITEMS[self.mode_selection]
             if selected == "Back":
                 self.game_state = GameState.MAIN_MENU
             else:
@@ -829,14 +873,39 @@ class BKGame(arcade.Window):
                     self.game_mode = GameMode.ULTRA
                 elif selected == "Pressure":
                     self.game_mode = GameMode.PRESSURE
+                elif selected == "Practice":
+                    self.game_mode = GameMode.PRACTICE
+                elif selected == "Versus":
+                    self.game_mode = GameMode.VERSUS
                 self.start_game()
         elif self.game_state == GameState.OPTIONS:
-            option_items = ["Power-ups", "Difficulty", "Key Bindings", "Back"]
-            selected = option_items[self.option_selection]
+            selected = OPTION_ITEMS[self.option_selection]
             if selected == "Power-ups":
                 self.power_ups_enabled = not self.power_ups_enabled
+                self.save_options()
             elif selected == "Difficulty":
                 self.difficulty = (self.difficulty % 3) + 1
+                self.save_options()
+            elif selected == "Preview":
+                self.preview_depth = (self.preview_depth % MAX_PREVIEW_DEPTH) + 1
+                for engine in self.engines:
+                    engine.preview_depth = self.preview_depth
+                self.save_options()
+            elif selected == "DAS":
+                self.auto_shift.das = next_preset(DAS_PRESETS, self.auto_shift.das)
+                self.save_options()
+            elif selected == "ARR":
+                self.auto_shift.arr = next_preset(ARR_PRESETS, self.auto_shift.arr)
+                self.save_options()
+            elif selected == "Soft Drop":
+                self.auto_shift.soft_drop_factor = next_preset(SOFT_DROP_FACTOR_PRESETS, self.auto_shift.soft_drop_factor)
+                self.save_options()
+            elif selected == "Event Log":
+                self.toggle_event_log()
+                self.save_options()
+            elif selected == "Replays":
+                self.replay_writer = None if self.replay_writer else ReplayWriter(self.writer)
+                self.save_options()
             elif selected == "Key Bindings":
                 self.game_state = GameState.KEY_BINDING
                 self.menu_selection = 0
@@ -858,9 +927,9 @@ class BKGame(arcade.Window):
         if self.game_state == GameState.MAIN_MENU:
             self.menu_selection = (self.menu_selection - 1) % 4
         elif self.game_state == GameState.GAME_MODE_SELECT:
-            self.mode_selection = (self.mode_selection - 1) % 5
+            self.mode_selection = (self.mode_selection - 1) % len(GAME_MODE_ITEMS)
         elif self.game_state == GameState.OPTIONS:
-            self.option_selection = (self.option_selection - 1) % 4
+            self.option_selection = (self.option_selection - 1) % len(OPTION_ITEMS)
         elif self.game_state == GameState.KEY_BINDING:
             self.menu_selection = (self.menu_selection - 1) % len(self.key_bindings)
 
@@ -868,250 +937,375 @@ class BKGame(arcade.Window):
         if self.game_state == GameState.MAIN_MENU:
             self.menu_selection = (self.menu_selection + 1) % 4
         elif self.game_state == GameState.GAME_MODE_SELECT:
-            self.mode_selection = (self.mode_selection + 1) % 5
+            self.mode_selection = (self.mode_selection + 1) % len(GAME_MODE_ITEMS)
         elif self.game_state == GameState.OPTIONS:
-            self.option_selection = (self.option_selection + 1) % 4
+            self.option_selection = (self.option_selection + 1) % len(OPTION_ITEMS)
         elif self.game_state == GameState.KEY_BINDING:
             self.menu_selection = (self.menu_selection + 1) % len(self.key_bindings)
 
     def on_key_press(self, key, modifiers):
         if key not in self.pressed_keys:
             self.pressed_keys.add(key)
-            self.handle_key_action(key, modifiers)
+            self.input_queue.push(key, modifiers, True)
 
     def on_key_release(self, key, modifiers):
         if key in self.pressed_keys:
             self.pressed_keys.remove(key)
+            self.input_queue.push(key, modifiers, False)
+
+    def handle_key_release(self, key):
+        # Releases only matter to the held-key handling on the playfield
+        action = self.action_tables[GameState.PLAYING].get(key)
+        if not action:
+            return
+        index, action = split_player_action(action)
+        if index >= len(self.auto_shifts):
+            return
+        auto_shift = self.auto_shifts[index]
+        if action == "MOVE_LEFT":
+            auto_shift.release(-1)
+        elif action == "MOVE_RIGHT":
+            auto_shift.release(1)
+        elif action == "SOFT_DROP":
+            auto_shift.release_soft_drop()
+
+    def rebuild_key_dispatch(self):
+        # One key -> handler table per state; rebuilt whenever bindings change
+        self.action_tables, self.binding_conflicts = compile_key_bindings(self.key_bindings)
+        self.key_dispatch = {
+            state: {key: self.action_handlers[state][action] for key, action in table.items()}
+            for state, table in self.action_tables.items()
+        }
+
+    def create_action_handlers(self):
+        menu = {
+            "MOVE_UP": self.handle_menu_up,
+            "MOVE_DOWN": self.handle_menu_down,
+            "SELECT": self.handle_menu_selection,
+            "BACK": self.handle_menu_back
+        }
+        return {
+            GameState.MAIN_MENU: menu,
+            GameState.GAME_MODE_SELECT: menu,
+            GameState.OPTIONS: menu,
+            GameState.PLAYING: {
+                **self.create_player_handlers(),
+                "PAUSE": self.pause_game,
+                "UNDO": self.rewind_game,
+                "REDO": lambda: self.rewind_game(forward=True),
+                "DEBUG_OVERLAY": self.toggle_debug_overlay
+            },
+            GameState.PAUSED: {
+                "PAUSE": self.resume_game,
+                "UNDO": self.rewind_game,
+                "REDO": lambda: self.rewind_game(forward=True),
+                "DEBUG_OVERLAY": self.toggle_debug_overlay
+            },
+            GameState.GAME_OVER: {
+                "SELECT": self.return_to_main_menu,
+                "UNDO": self.rewind_game
+            },
+            GameState.TUTORIAL: {
+                "SELECT": self.advance_tutorial,
+                "BACK": self.return_to_main_menu
+            },
+            GameState.KEY_BINDING: {
+                "MOVE_UP": self.handle_menu_up,
+                "MOVE_DOWN": self.handle_menu_down,
+                "SELECT": self.start_rebinding,
+                "BACK": self.leave_key_binding_menu
+            }
+        }
+
+    def create_player_handlers(self):
+        handlers = {}
+        for index, prefix in enumerate(PLAYER_ACTION_PREFIXES):
+            handlers.update({
+                prefix + "MOVE_LEFT": self.player_action(index, lambda engine, auto_shift: auto_shift.press(engine, -1)),
+                prefix + "MOVE_RIGHT": self.player_action(index, lambda engine, auto_shift: auto_shift.press(engine, 1)),
+                prefix + "SOFT_DROP": self.player_action(index, lambda engine, auto_shift: auto_shift.press_soft_drop(engine)),
+                prefix + "HARD_DROP": self.player_action(index, lambda engine, auto_shift: engine.hard_drop()),
+                prefix + "ROTATE_LEFT": self.player_action(index, lambda engine, auto_shift: engine.rotate_block(False)),
+                prefix + "ROTATE_RIGHT": self.player_action(index, lambda engine, auto_shift: engine.rotate_block(True)),
+                prefix + "HOLD": self.player_action(index, lambda engine, auto_shift: engine.hold_piece())
+            })
+        return handlers
+
+    def player_action(self, index, action):
+        # Keys of a player who is not in the game do nothing
+        def handler():
+            if index < len(self.engines):
+                action(self.engines[index], self.auto_shifts[index])
+        return handler
 
     def handle_key_action(self, key, modifiers):
-        if self.game_state == GameState.MAIN_MENU:
-            self.handle_main_menu_input(key)
-        elif self.game_state == GameState.GAME_MODE_SELECT:
-            self.handle_game_mode_select_input(key)
-        elif self.game_state == GameState.OPTIONS:
-            self.handle_options_input(key)
-        elif self.game_state == GameState.PLAYING:
-            self.handle_playing_input(key)
-        elif self.game_state == GameState.PAUSED:
-            if key == self.key_bindings["PAUSE"]:
-                self.game_state = GameState.PLAYING
-        elif self.game_state == GameState.GAME_OVER:
-            self.handle_game_over_input(key)
-        elif self.game_state == GameState.TUTORIAL:
-            self.handle_tutorial_input(key)
-        elif self.game_state == GameState.KEY_BINDING:
-            self.handle_key_binding_input(key)
-
-    def handle_main_menu_input(self, key):
-        if key == self.key_bindings["MOVE_UP"]:
-            self.handle_menu_up()
-        elif key == self.key_bindings["MOVE_DOWN"]:
-            self.handle_menu_down()
-        elif key == self.key_bindings["SELECT"]:
-            self.handle_menu_selection()
-
-    def handle_game_mode_select_input(self, key):
-        if key == self.key_bindings["MOVE_UP"]:
-            self.handle_menu_up()
-        elif key == self.key_bindings["MOVE_DOWN"]:
-            self.handle_menu_down()
-        elif key == self.key_bindings["SELECT"]:
-            self.handle_menu_selection()
-        elif key == self.key_bindings["BACK"]:
-            self.handle_menu_back()
-
-    def handle_options_input(self, key):
-        if key == self.key_bindings["MOVE_UP"]:
-            self.handle_menu_up()
-        elif key == self.key_bindings["MOVE_DOWN"]:
-            self.handle_menu_down()
-        elif key == self.key_bindings["SELECT"]:
-            self.handle_menu_selection()
-        elif key == self.key_bindings["BACK"]:
-            self.handle_menu_back()
-
-    def handle_playing_input(self, key):
-        if self.current_block:
-            if key == self.key_bindings["MOVE_LEFT"]:
-                self.move_block(-1, 0)
-            elif key == self.key_bindings["MOVE_RIGHT"]:
-                self.move_block(1, 0)
-            elif key == self.key_bindings["SOFT_DROP"]:
-                self.move_block(0, -1)
-            elif key == self.key_bindings["HARD_DROP"]:
-                self.hard_drop()
-            elif key == self.key_bindings["ROTATE_LEFT"]:
-                if self.current_block.rotate(False, self):
-                    arcade.play_sound(ROTATE_SOUND)
-            elif key == self.key_bindings["ROTATE_RIGHT"]:
-                if self.current_block.rotate(True, self):
-                    arcade.play_sound(ROTATE_SOUND)
-            elif key == self.key_bindings["HOLD"]:
-                self.hold_piece()
-        
-        if key == self.key_bindings["PAUSE"]:
-            self.game_state = GameState.PAUSED
+        if self.rebinding_action:
+            self.rebind_key(key)
+            return
+        handler = self.key_dispatch[self.game_state].get(key)
+        if handler:
+            handler()
+
+    def toggle_debug_overlay(self):
+        self.show_debug_overlay = not self.show_debug_overlay
+
+    def toggle_event_log(self):
+        # Takes effect from the next game
+        if self.event_log:
+            self.event_log.flush()
+            self.event_log = None
+        else:
+            self.event_log = EventLog(self.writer)
 
-    def handle_game_over_input(self, key):
-        if key == self.key_bindings["SELECT"]:
-            self.game_state = GameState.MAIN_MENU
+    def record_replay_input(self, key, pressed):
+        action = self.action_tables[GameState.PLAYING].get(key)
+        if not action:
+            return
+        index, action = split_player_action(action)
+        if index == 0 and action in ACTION_BITS:
+            self.replay_recorder.record_input(action, pressed)
 
-    def handle_tutorial_input(self, key):
-        if key == self.key_bindings["SELECT"]:
-            self.tutorial_step += 1
-            if self.tutorial_step >= 8:  # Adjust based on the number of tutorial steps
-                self.game_state = GameState.GAME_MODE_SELECT
-        elif key == self.key_bindings["BACK"]:
-            self.game_state = GameState.MAIN_MENU
+    def pause_game(self):
+        self.game_state = GameState.PAUSED
+        self.suspend_game()
 
-    def handle_key_binding_input(self, key):
-        if self.rebinding_action:
-            if key != arcade.key.ESCAPE:
-                self.key_bindings[self.rebinding_action] = key
-                self.save_key_bindings()
-            self.rebinding_action = None
-        else:
-            if key == self.key_bindings["MOVE_UP"]:
-                self.handle_menu_up()
-            elif key == self.key_bindings["MOVE_DOWN"]:
-                self.handle_menu_down()
-            elif key == self.key_bindings["SELECT"]:
-                self.rebinding_action = list(self.key_bindings.keys())[self.menu_selection]
-            elif key == self.key_bindings["BACK"]:
-                self.game_state = GameState.OPTIONS
+    def resume_game(self):
+        self.game_state = GameState.PLAYING
 
-    def update(self, delta_time):
-        if self.game_state == GameState.PLAYING:
-            current_time = time.time()
-
-            if self.game_mode in [GameMode.SPRINT, GameMode.ULTRA]:
-                if self.time_limit and current_time - self.start_time >= self.time_limit:
-                    self.game_over()
-                    return
-
-            if current_time >= self.next_drop_time and not self.is_flashing:
-                self.next_drop_time = current_time + self.drop_interval
-                moved = self.move_block(0, -1)
-                if not moved:
-                    if self.lock_timer is None:
-                        self.lock_timer = current_time
-                else:
-                    self.lock_timer = None
-            
-            if self.lock_timer is not None:
-                if current_time - self.lock_timer >= LOCK_DELAY:
-                    self.place_block()
-                    self.lock_timer = None
-
-            if self.is_flashing:
-                self.handle_line_clear_animation(delta_time)
-
-            self.particle_list.update()
-            self.update_power_ups()
-
-            if self.game_mode == GameMode.PRESSURE:
-                self.update_pressure_mode(current_time)
-
-    def handle_line_clear_animation(self, delta_time):
-        self.flash_timer += delta_time
-        if self.flash_timer >= self.flash_duration:
-            self.flash_timer = 0
-            self.flash_visible = not self.flash_visible
-            self.total_flashes += 1
-            if self.total_flashes >= self.max_flashes:
-                self.is_flashing = False
-                self.flash_timer = 0
-                self.total_flashes = 0
-                self.flash_visible = True
-                self.clear_lines()
-
-    def update_pressure_mode(self, current_time):
-        if current_time - self.last_pressure_time >= self.pressure_interval:
-            self.add_pressure_blocks()
-            self.last_pressure_time = current_time
-        
-        if current_time - self.start_time >= PRESSURE_INCREASE_INTERVAL * (self.pressure_level + 1):
-            self.increase_pressure_difficulty()
+    def return_to_main_menu(self):
+        self.game_state = GameState.MAIN_MENU
+        if self.net_session:
+            self.end_net_game()
+
+    def advance_tutorial(self):
+        self.tutorial_step += 1
+        if self.tutorial_step >= 8:  # Adjust based on the number of tutorial steps
+            self.game_state = GameState.GAME_MODE_SELECT
 
-        target_height = (GRID_HEIGHT * BLOCK_SIZE) * (self.pressure_level / 10)
-        self.lava_height += (target_height - self.lava_height) * 0.1
+    def start_rebinding(self):
+        self.rebinding_action = list(self.key_bindings.keys())[self.menu_selection]
 
-    def add_pressure_blocks(self):
-        for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT - 1, self.pressure_height - 1, -1):
-            self.grid[y] = self.grid[y - 1].copy()
+    def leave_key_binding_menu(self):
+        self.game_state = GameState.OPTIONS
+
+    def rebind_key(self, key):
+        if key != arcade.key.ESCAPE:
+            self.key_bindings[self.rebinding_action] = key
+            self.save_key_bindings()
+            self.rebuild_key_dispatch()
+        self.rebinding_action = None
 
-        self.grid[self.pressure_height] = [GARBAGE_BLOCK_COLOR] * GRID_WIDTH
+    def get_simulation_time(self):
+        return self.simulation_time
+
+    def get_tick(self):
+        return self.net_session.tick if self.net_session else self.tick
+
+    def advance_simulation(self, timestamp):
+        elapsed = timestamp - self.last_input_time
+        if elapsed <= 0:
+            return
+        self.last_input_time = timestamp
+        if self.game_state == GameState.PLAYING:
+            for _ in range(self.timestep.advance(elapsed)):
+                self.run_logic_tick()
+
+    def save_replay(self):
+        if self.replay_recorder:
+            self.replay_writer.append(self.replay_recorder)
+            self.replay_recorder = None
+
+    def run_logic_tick(self):
+        step = self.timestep.step
+        for index, engine in enumerate(self.engines):
+            block = engine.current_block
+            self.previous_pieces[index] = (block, block.grid_x, block.grid_y) if block else None
+        if self.net_session:
+            self.run_net_tick()
+            return
+        self.tick += 1
+        self.simulation_time = self.tick * step
+        # Every board moves on the same tick
+        self.running_tick = True
+        for engine, auto_shift in zip(self.engines, self.auto_shifts):
+            auto_shift.update(engine, step)
+            engine.update(step)
+        self.running_tick = False
+        if self.replay_recorder:
+            self.replay_recorder.end_tick()
+            if self.game_state == GameState.GAME_OVER:
+                self.save_replay()
+        for particle in list(self.particle_list):
+            particle.step(step)
+
+    def run_net_tick(self):
+        rollbacks = self.net_session.rollbacks
+        if self.net_session.advance(self.net_held_mask | self.net_tapped_mask):
+            self.net_tapped_mask = 0
+        if self.spectator_feed and self.net_session.rollbacks != rollbacks:
+            self.spectator_feed.invalidate()
+        for particle in list(self.particle_list):
+            particle.step(self.timestep.step)
+        if self.net_session.finished():
+            self.game_over()
 
-        for _ in range(random.randint(1, 2)):
-            empty_index = random.randint(0, GRID_WIDTH - 1)
-            self.grid[self.pressure_height][empty_index] = None
+    def update(self, delta_time):
+        update_start = time.perf_counter()
+        # Run the game up to each queued key event before applying it, so drops
+        # and lock delay see inputs on the tick they happened, not at frame time
+        now = self.input_queue.clock()
+        for timestamp, key, modifiers, pressed in self.input_queue.drain(now):
+            self.advance_simulation(timestamp)
+            if self.net_session and self.game_state == GameState.PLAYING:
+                self.handle_net_key(key, modifiers, pressed)
+                continue
+            # Releases reach the held-key handling in any state, presses only in play
+            if self.replay_recorder and (not pressed or self.game_state == GameState.PLAYING):
+                self.record_replay_input(key, pressed)
+            action = self.action_tables[GameState.PLAYING].get(key) if self.game_state == GameState.PLAYING else None
+            if pressed:
+                action_events = self.action_events
+                self.handle_key_action(key, modifiers)
+                # Only inputs the engine applied are timed; a blocked move or rotation draws nothing new
+                if action and self.action_events != action_events:
+                    self.latency_tracker.record_input(timestamp, split_player_action(action)[1])
+            else:
+                self.handle_key_release(key)
+        self.advance_simulation(now)
+        if self.spectator_feed:
+            self.spectator_feed.publish(self.get_tick())
+        if self.net_session and self.game_state == GameState.GAME_OVER:
+            # Keep our last inputs flowing until the other side has seen the end too
+            self.net_session.poll()
+            self.net_session.send_inputs()
+
+        if self.music_requested and self.assets.is_ready(MUSIC_FILE):
+            self.music_requested = False
+            self.bg_music = arcade.play_sound(self.assets.get_sound(MUSIC_FILE), looping=True, volume=0.5)
+
+        self.sound_dispatcher.flush()
+
+        if self.metrics:
+            update_end = time.perf_counter()
+            self.metrics.observe("blocko_update_seconds", update_end - update_start)
+            if update_end >= self.next_metrics_dump:
+                self.dump_metrics()
+
+    def dump_metrics(self):
+        metrics = self.metrics
+        now = time.perf_counter()
+        self.next_metrics_dump = now + METRICS_INTERVAL
+        write_durations = self.writer.write_durations
+        while write_durations:
+            metrics.observe("blocko_write_seconds", write_durations.popleft())
+        metrics.set("blocko_particles", len(self.particle_list))
+        metrics.set("blocko_sound_voices", self.sound_dispatcher.active_voices())
+        metrics.update_rates(now, self.get_tick() * self.timestep.step)
+        text = metrics.render()
+        if self.metrics_file:
+            self.writer.write_file(self.metrics_file, text)
+        if self.metrics_socket:
+            self.metrics_socket.text = text
+
+    def start_net_game(self):
+        # The rollback session owns both engines and steps them at its own rate
+        session = self.net_session
+        self.game_mode = GameMode.VERSUS
+        self.setup()
+        self.engines = session.engines
+        self.engine = self.engines[0]
+        for index, events in enumerate(session.events):
+            self.subscribe_effects(index, events)
+        if self.spectator_feed:
+            self.spectator_feed.watch(self.engines, session.events)
+        if self.event_log:
+            self.event_log.watch(self.engines, self.get_tick, session.events)
+        self.auto_shifts = session.auto_shifts
+        self.versus = session.match
+        self.timestep = FixedTimestep(NET_TICK_RATE)
+        self.game_state = GameState.PLAYING
+        if self.metrics:
+            self.metrics.start_game()
+        self.start_background_music()
 
-        self.flash_lines = [self.pressure_height]
-        self.is_flashing = True
-        self.flash_timer = 0
-        self.flash_visible = True
-        self.total_flashes = 0
+    def end_net_game(self):
+        self.net_session.close()
+        self.net_session = None
+        self.timestep = FixedTimestep(self.settings.options["logic_rate"])
+        self.game_mode = GameMode.MARATHON
+        self.setup()
 
-    def increase_pressure_difficulty(self):
-        self.pressure_level = min(self.pressure_level + 1, 5)
-        self.pressure_interval = max(MIN_PRESSURE_INTERVAL, self.pressure_interval - 5)
+    def handle_net_key(self, key, modifiers, pressed):
+        # Player one's keys drive the local board; there is no pausing online
+        action = self.action_tables[GameState.PLAYING].get(key)
+        if action in ACTION_BITS:
+            bit = ACTION_BITS[action]
+            if pressed:
+                self.net_held_mask |= bit
+                self.net_tapped_mask |= bit
+            else:
+                self.net_held_mask &= ~bit
+        elif pressed and action not in ["PAUSE", "UNDO", "REDO"]:
+            self.handle_key_action(key, modifiers)
 
     def start_game(self):
         self.setup()
         self.game_state = GameState.PLAYING
-        self.start_time = time.time()
-        
-        if self.game_mode == GameMode.SPRINT:
-            self.time_limit = 120  # 2 minutes for Sprint mode
-        elif self.game_mode == GameMode.ULTRA:
-            self.time_limit = 180  # 3 minutes for Ultra mode
-        else:
-            self.time_limit = None
-    
-        if not self.spawn_new_block():
-            self.game_over()
-            return
-    
-        self.next_drop_time = time.time() + self.drop_interval
+        if self.metrics:
+            self.metrics.start_game()
+        for engine in self.engines:
+            if not engine.start():
+                return
+        if self.replay_recorder:
+            self.replay_recorder.start()
+        if self.game_mode == GameMode.PRACTICE:
+            self.rewind.record(self.save_state())
         self.start_background_music()
-    
-        # Initialize game mode specific variables
-        if self.game_mode == GameMode.PRESSURE:
-            self.last_pressure_time = time.time()
-            self.pressure_level = 0
-            self.lava_height = 0
-                
-    def test_game_over_condition(self):
-        # Fill the grid to test game over condition
-        for y in range(GRID_HEIGHT):
-            for x in range(GRID_WIDTH):
-                self.grid[y][x] = arcade.color.WHITE
-        
-        # Leave top rows empty
-        for y in range(GRID_HEIGHT, GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
-            for x in range(GRID_WIDTH):
-                self.grid[y][x] = None
-        
-        # Attempt to spawn a new block
-        if not self.spawn_new_block():
-            print("Game over condition working correctly")
-        else:
-            print("Game over condition failed")
-    #Call this method after starting the game to test
-    #self.test_game_over_condition()
             
     def start_background_music(self):
         if self.bg_music:
             arcade.stop_sound(self.bg_music)
-        self.bg_music = arcade.play_sound(BG_MUSIC, looping=True, volume=0.5)  # Adjust volume here (0.0 to 1.0)
+            self.bg_music = None
+        # Music decodes on the asset thread; update() starts it once it is ready
+        self.assets.load_in_background(MUSIC_FILE)
+        self.music_requested = True
 
     def stop_background_music(self):
+        self.music_requested = False
         if self.bg_music:
             arcade.stop_sound(self.bg_music)
             self.bg_music = None
 
+    def on_close(self):
+        self.export_latency()
+        if self.event_log:
+            self.event_log.flush()
+        if self.spectator_feed:
+            self.spectator_feed.close()
+        if self.metrics:
+            self.dump_metrics()
+        if self.metrics_socket:
+            self.metrics_socket.close()
+        self.high_score_store.close()
+        self.writer.close()
+        super().on_close()
+
 def main():
-    game = BKGame()
+    parser = argparse.ArgumentParser(description=SCREEN_TITLE)
+    parser.add_argument("--host", nargs="?", type=int, const=DEFAULT_PORT, metavar="PORT",
+                        help="host an online versus game")
+    parser.add_argument("--join", metavar="HOST[:PORT]", help="join an online versus game")
+    parser.add_argument("--spectate", nargs="?", type=int, const=SPECTATOR_PORT, metavar="PORT",
+                        help="publish a live feed of the game for blocko_spectate.py")
+    parser.add_argument("--metrics-file", nargs="?", const=METRICS_FILE, metavar="PATH",
+                        help="dump Prometheus metrics to a textfile every few seconds")
+    parser.add_argument("--metrics-socket", metavar="PATH", help="serve Prometheus metrics on a Unix socket")
+    args = parser.parse_args()
+    net_session = None
+    if args.host is not None or args.join:
+        net_session = open_session(args.host, args.join)
+    spectator_feed = SpectatorFeed(port=args.spectate) if args.spectate is not None else None
+    game = BKGame(net_session, spectator_feed, args.metrics_file, args.metrics_socket)
     arcade.run()
 
 if __name__ == "__main__":
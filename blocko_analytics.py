@@ -0,0 +1,242 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from blocko_core import BLOCK_NAMES, GRID_WIDTH, GRID_HEIGHT, BUFFER_ZONE_HEIGHT, EngineEvent, GameMode
+from blocko_eventlog import (
+    EVENT_CODES, EVENT_LOG_HEADER, EVENT_LOG_MAGIC, EVENT_LOG_VERSION, EVENT_RECORD, EVENT_RECORD_FIELDS, NO_PIECE
+)
+from blocko_replay import (
+    ARCHIVE_HEADER, INDEX_ENTRY_FIELDS, REPLAY_HEADER, REPLAY_HEADER_FIELDS, REPLAY_MAGIC, REPLAY_VERSION, index_path_for
+)
+import blocko_storage
+
+# Batch statistics over event logs (events.bin) and replay archives
+# (replays.bin). Files are read CHUNK_RECORDS records at a time and folded
+# into fixed-size totals with NumPy, so memory stays the same however many
+# games there are.
+#
+# Locks are matched to their line clears, and combos to their streaks, within
+# a chunk; the odd pair split by a chunk boundary is counted as two.
+
+CHUNK_RECORDS = 1 << 20
+EVENT_DTYPE = np.dtype(EVENT_RECORD_FIELDS)
+REPLAY_HEADER_DTYPE = np.dtype(REPLAY_HEADER_FIELDS)
+INDEX_DTYPE = np.dtype(INDEX_ENTRY_FIELDS)
+MODE_NAMES = ["Marathon", "Sprint", "Ultra", "Pressure", "Practice", "Versus"]
+TIMED_MODES = [GameMode.SPRINT, GameMode.ULTRA]  # Their games end on the clock, not by topping out
+KIND_NAMES = BLOCK_NAMES + ["?"]  # The last kind is a piece whose shape was not recognised
+BOARD_ROWS = GRID_HEIGHT + BUFFER_ZONE_HEIGHT
+MAX_CLEAR_ROWS = 5
+MAX_COMBO = 20  # Longer streaks are counted here
+PIECE_SECONDS_BINS = np.linspace(0, 3, 31)  # Beyond 3 s per piece counts in the last bin
+HEAT_SHADES = " .:-=+*#%@"
+
+LOCK = EVENT_CODES[EngineEvent.LOCK]
+LINE_CLEAR = EVENT_CODES[EngineEvent.LINE_CLEAR]
+COMBO = EVENT_CODES[EngineEvent.COMBO]
+GAME_OVER = EVENT_CODES[EngineEvent.GAME_OVER]
+
+def board_keys(records):
+    # One number per board of a game; 64-bit wraparound mixes in the board
+    return records["game"] * np.uint64(0x9E3779B97F4A7C15) + records["board"]
+
+def tick_keys(records):
+    return board_keys(records) * np.uint64(1000003) + records["tick"]
+
+def file_magic(path):
+    with open(path, "rb") as f:
+        return f.read(4)
+
+def event_chunks(path, chunk_records=CHUNK_RECORDS):
+    with open(path, "rb") as f:
+        magic, version, record_size = EVENT_LOG_HEADER.unpack(f.read(EVENT_LOG_HEADER.size))
+        if magic != EVENT_LOG_MAGIC or version != EVENT_LOG_VERSION or record_size != EVENT_RECORD.size:
+            raise ValueError(f"{path} is not a version 1 event log")
+        while True:
+            records = np.fromfile(f, EVENT_DTYPE, chunk_records)
+            if not len(records):
+                return
+            yield records
+
+def replay_header_chunks(path, chunk_records=CHUNK_RECORDS):
+    # Gathers the fixed-size header at the start of every record the index lists
+    index_path = index_path_for(path)
+    for file_path, magic in [(path, REPLAY_MAGIC), (index_path, None)]:
+        with open(file_path, "rb") as f:
+            header = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+        if (magic and header[0] != magic) or header[1] != REPLAY_VERSION:
+            raise ValueError(f"{file_path} is not part of a version {REPLAY_VERSION} replay archive")
+    count = (os.path.getsize(index_path) - ARCHIVE_HEADER.size) // INDEX_DTYPE.itemsize
+    if not count:
+        return
+    index = np.memmap(index_path, INDEX_DTYPE, "r", ARCHIVE_HEADER.size, (count,))
+    data = np.memmap(path, np.uint8, "r")
+    # Every header-sized window of the file as a row; indexing it with the
+    # record offsets copies just those headers, with no index per byte
+    windows = np.lib.stride_tricks.sliding_window_view(data, REPLAY_HEADER.size)
+    for start in range(0, count, chunk_records):
+        offsets = np.asarray(index["offset"][start:start + chunk_records])
+        yield windows[offsets].view(REPLAY_HEADER_DTYPE).ravel()
+
+class EventStats:
+    def __init__(self):
+        kinds = len(KIND_NAMES)
+        self.records = 0
+        self.games = 0
+        self.placements = np.zeros((kinds, BOARD_ROWS, GRID_WIDTH), np.int64)
+        self.locks = np.zeros(kinds, np.int64)
+        self.clearing_locks = np.zeros(kinds, np.int64)
+        self.line_clears = np.zeros(MAX_CLEAR_ROWS + 1, np.int64)
+        self.combos = np.zeros(MAX_COMBO + 1, np.int64)
+        self.top_out_heights = np.zeros(BOARD_ROWS + 1, np.int64)
+
+    def add(self, records):
+        self.records += len(records)
+        event = records["event"]
+
+        # Placements: where the corner of each piece's bounding box landed
+        locks = records[event == LOCK]
+        kind = np.where(locks["piece"] == NO_PIECE, len(BLOCK_NAMES), locks["piece"]).astype(np.int64)
+        x = locks["piece_x"].astype(np.int64)
+        y = locks["piece_y"].astype(np.int64)
+        inside = (x >= 0) & (x < GRID_WIDTH) & (y >= 0) & (y < BOARD_ROWS)
+        cells = (kind[inside] * BOARD_ROWS + y[inside]) * GRID_WIDTH + x[inside]
+        self.placements += np.bincount(cells, minlength=self.placements.size).reshape(self.placements.shape)
+        self.locks += np.bincount(kind, minlength=len(KIND_NAMES))
+
+        # A lock that clears rows is preceded by its LINE_CLEAR on the same tick
+        clears = records[event == LINE_CLEAR]
+        cleared = np.isin(tick_keys(locks), tick_keys(clears))
+        self.clearing_locks += np.bincount(kind[cleared], minlength=len(KIND_NAMES))
+        self.line_clears += np.bincount(np.clip(clears["value"], 0, MAX_CLEAR_ROWS), minlength=MAX_CLEAR_ROWS + 1)
+
+        # A streak ends where the next combo on the board does not count up from it
+        combos = records[event == COMBO]
+        keys = board_keys(combos)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        values = combos["value"][order].astype(np.int64)
+        ends = np.ones(len(values), bool)
+        ends[:-1] = (keys[1:] != keys[:-1]) | (values[1:] != values[:-1] + 1)
+        self.combos += np.bincount(np.clip(values[ends], 0, MAX_COMBO), minlength=MAX_COMBO + 1)
+
+        game_overs = records[event == GAME_OVER]
+        self.games += len(game_overs)
+        topped_out = game_overs[~np.isin(game_overs["mode"], TIMED_MODES)]
+        self.top_out_heights += np.bincount(np.minimum(topped_out["height"], BOARD_ROWS), minlength=BOARD_ROWS + 1)
+
+    def report(self, heatmaps):
+        print(f"Events: {self.records} records, {self.games} boards finished")
+        print("Pieces:")
+        for kind in np.nonzero(self.locks)[0]:
+            locks = self.locks[kind]
+            wasted = locks - self.clearing_locks[kind]
+            print(f"  {KIND_NAMES[kind]}: {locks} locked, {wasted / locks:.1%} cleared nothing")
+        print_distribution("Line clears by rows", self.line_clears, 1)
+        print_distribution("Combo streaks by length", self.combos, 1, MAX_COMBO)
+        print_distribution("Stack height at top out", self.top_out_heights, 0, BOARD_ROWS)
+        if not heatmaps:
+            return
+        for kind in np.nonzero(self.locks)[0]:
+            heat = self.placements[kind]
+            print(f"Placements of {KIND_NAMES[kind]}, bottom left of the piece, {heat.sum()} in the playfield:")
+            top = max(np.nonzero(heat.any(axis=1))[0], default=0)
+            scale = (len(HEAT_SHADES) - 1) / max(heat.max(), 1)
+            for row in heat[top::-1]:
+                print("  |" + "".join(HEAT_SHADES[int(np.ceil(count * scale))] for count in row) + "|")
+
+    def arrays(self):
+        return {
+            "placements": self.placements, "locks": self.locks, "clearing_locks": self.clearing_locks,
+            "line_clears": self.line_clears, "combos": self.combos, "top_out_heights": self.top_out_heights
+        }
+
+class ReplayStats:
+    def __init__(self):
+        modes = len(MODE_NAMES)
+        self.games = np.zeros(modes, np.int64)
+        self.scores = np.zeros(modes)
+        self.lines = np.zeros(modes)
+        self.pieces = np.zeros(modes)
+        self.seconds = np.zeros(modes)
+        self.piece_seconds = np.zeros(len(PIECE_SECONDS_BINS) - 1, np.int64)
+
+    def add(self, headers):
+        modes = len(MODE_NAMES)
+        mode = headers["mode"]
+        seconds = headers["ticks"] / headers["tick_rate"]
+        pieces = headers["pieces"].astype(np.float64)
+        self.games += np.bincount(mode, minlength=modes)
+        self.scores += np.bincount(mode, headers["score"].astype(np.float64), modes)
+        self.lines += np.bincount(mode, headers["lines"], modes)
+        self.pieces += np.bincount(mode, pieces, modes)
+        self.seconds += np.bincount(mode, seconds, modes)
+        # Average time per piece of each game
+        per_piece = np.minimum(seconds / np.maximum(pieces, 1), PIECE_SECONDS_BINS[-1])
+        self.piece_seconds += np.histogram(per_piece, PIECE_SECONDS_BINS)[0]
+
+    def report(self):
+        print(f"Replays: {self.games.sum()} games")
+        for mode in np.nonzero(self.games)[0]:
+            games = self.games[mode]
+            print(f"  {MODE_NAMES[mode]}: {games} games, average score {self.scores[mode] / games:.0f}, "
+                  f"{self.lines[mode] / games:.1f} lines, {self.pieces[mode] / games:.0f} pieces, "
+                  f"{self.seconds[mode] / max(self.pieces[mode], 1):.2f} s per piece")
+        print("Games by average time per piece:")
+        total = max(self.piece_seconds.sum(), 1)
+        for i in np.nonzero(self.piece_seconds)[0]:
+            count = self.piece_seconds[i]
+            print(f"  {PIECE_SECONDS_BINS[i]:.1f}-{PIECE_SECONDS_BINS[i + 1]:.1f} s: {count} ({count / total:.1%})")
+
+    def arrays(self):
+        return {
+            "replay_games": self.games, "replay_scores": self.scores, "replay_lines": self.lines,
+            "replay_pieces": self.pieces, "replay_seconds": self.seconds,
+            "piece_seconds": self.piece_seconds, "piece_seconds_bins": PIECE_SECONDS_BINS
+        }
+
+def print_distribution(title, counts, first, last_open=None):
+    # last_open marks the bucket that also counts everything above it
+    total = counts[first:].sum()
+    print(f"{title}:")
+    for value in range(first, len(counts)):
+        if counts[value]:
+            label = f"{value}+" if value == last_open else str(value)
+            print(f"  {label}: {counts[value]} ({counts[value] / total:.1%})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics over bLocKo event logs and replay archives")
+    parser.add_argument("files", nargs="*", help=f"event logs and replay archives (default {blocko_storage.EVENT_LOG_FILE} "
+                                                 f"and {blocko_storage.REPLAY_FILE})")
+    parser.add_argument("--heatmaps", action="store_true", help="print a placement heatmap for every piece")
+    parser.add_argument("--output", metavar="PATH", help="also save the totals as a NumPy .npz file")
+    parser.add_argument("--chunk", type=int, default=CHUNK_RECORDS, help="records read at a time")
+    args = parser.parse_args()
+    files = args.files or [path for path in [blocko_storage.EVENT_LOG_FILE, blocko_storage.REPLAY_FILE]
+                           if os.path.exists(path)]
+    if not files:
+        parser.error("no event log or replay archive found")
+
+    start = time.perf_counter()
+    events = EventStats()
+    replays = ReplayStats()
+    for path in files:
+        if file_magic(path) == REPLAY_MAGIC:
+            for headers in replay_header_chunks(path, args.chunk):
+                replays.add(headers)
+        else:
+            for records in event_chunks(path, args.chunk):
+                events.add(records)
+    if events.records:
+        events.report(args.heatmaps)
+    if replays.games.sum():
+        replays.report()
+    print(f"Read {len(files)} files in {time.perf_counter() - start:.2f} s")
+    if args.output:
+        np.savez(args.output, **events.arrays(), **replays.arrays())
+
+if __name__ == "__main__":
+    main()
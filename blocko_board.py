@@ -0,0 +1,60 @@
+from blocko_core import GRID_WIDTH, GRID_HEIGHT, BUFFER_ZONE_HEIGHT, CELL_PALETTE
+
+# Canonical compact form of a grid: an occupancy plane with one bit per cell
+# (bit x + y * GRID_WIDTH, bottom row first), then a color plane with the
+# CELL_PALETTE index of each filled cell in the same order, two to a byte.
+# An empty board is 30 bytes and a full one 150. The same grid always packs
+# to the same bytes, so packed boards compare and hash as plain bytes, and
+# can key a dict or a set directly.
+#
+# Everything goes through bytes.translate, big integers and str.join, with no
+# per-cell Python loop: packing takes 2-4 microseconds, unpacking 3 for an
+# empty board, 7-11 for a typical one and about 15 for a full one.
+
+BOARD_CELLS = GRID_WIDTH * (GRID_HEIGHT + BUFFER_ZONE_HEIGHT)
+OCCUPANCY_BYTES = (BOARD_CELLS + 7) // 8
+# Translation tables; palette indices fit in four bits
+assert len(CELL_PALETTE) <= 16
+OCCUPIED_DIGITS = b"0" + b"1" * 255
+HIGH_NIBBLE = bytes(i >> 4 for i in range(256))
+LOW_NIBBLE = bytes(i & 15 for i in range(256))
+SHIFTED_NIBBLE = bytes((i << 4) & 255 for i in range(256))
+
+def pack_cells(cells):
+    # cells: one palette index per cell, as in grid order
+    occupancy = int(cells.translate(OCCUPIED_DIGITS)[::-1], 2)
+    colors = cells.translate(None, b"\0")
+    if len(colors) % 2:
+        colors += b"\0"
+    high = int.from_bytes(colors[0::2].translate(SHIFTED_NIBBLE), "big")
+    low = int.from_bytes(colors[1::2], "big")
+    return occupancy.to_bytes(OCCUPANCY_BYTES, "little") + (high | low).to_bytes(len(colors) // 2, "big")
+
+def unpack_cells(data, offset=0):
+    # Returns the cells and the offset just past the board
+    occupancy = board_occupancy(data, offset)
+    count = bin(occupancy).count("1")
+    size = (count + 1) // 2
+    offset += OCCUPANCY_BYTES
+    packed = data[offset:offset + size]
+    colors = bytearray(size * 2)
+    colors[0::2] = packed.translate(HIGH_NIBBLE)
+    colors[1::2] = packed.translate(LOW_NIBBLE)
+    # Each filled cell follows a run of empty ones; interleave the runs and
+    # colors as latin-1 characters and join them in one go
+    runs = f"{occupancy:0{BOARD_CELLS}b}"[::-1].replace("0", "\0").split("1")
+    cells = [""] * (count * 2 + 1)
+    cells[0::2] = runs
+    cells[1::2] = colors[:count].decode("latin-1")
+    return "".join(cells).encode("latin-1"), offset + size
+
+def board_occupancy(data, offset=0):
+    # The occupancy plane as an int, for bitwise tests on a packed board
+    return int.from_bytes(data[offset:offset + OCCUPANCY_BYTES], "little")
+
+def pack_board(grid):
+    return pack_cells(b"".join(grid))
+
+def unpack_board(data, offset=0):
+    cells, offset = unpack_cells(data, offset)
+    return [bytearray(cells[y:y + GRID_WIDTH]) for y in range(0, BOARD_CELLS, GRID_WIDTH)], offset
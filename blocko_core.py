@@ -0,0 +1,465 @@
+# Constants and data types shared by the game, its tools and headless workers.
+# Nothing in here may import arcade.
+import os
+import random
+
+# Constants
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 800
+SCREEN_TITLE = "bLocKo - The Puzzle Game"
+
+BLOCK_SIZE = 30
+GRID_WIDTH = 10
+GRID_HEIGHT = 20
+BUFFER_ZONE_HEIGHT = 4  # Number of rows above the visible playfield
+
+GRID_ORIGIN_X = (SCREEN_WIDTH - GRID_WIDTH * BLOCK_SIZE) // 2
+GRID_ORIGIN_Y = (SCREEN_HEIGHT - GRID_HEIGHT * BLOCK_SIZE) // 2
+
+# Colors are plain RGB(A) tuples, the same values as arcade.color
+BACKGROUND_COLOR = (0, 0, 0)
+GRID_COLOR = (128, 128, 128)
+BLOCK_COLORS = [
+    (255, 0, 0),      # Red
+    (0, 0, 255),      # Blue
+    (0, 255, 0),      # Green
+    (255, 255, 0),    # Yellow
+    (255, 165, 0),    # Orange
+    (128, 0, 128),    # Purple
+    (0, 255, 255)     # Cyan
+]
+GHOST_COLOR = (255, 255, 255, 50)
+FLASH_COLOR = (255, 255, 255)
+EXPLOSION_COLOR = (255, 165, 0)
+
+HARD_DROP_COOLDOWN = 0.5
+INITIAL_DROP_INTERVAL = 1.0
+MIN_DROP_INTERVAL = 0.05
+LOCK_DELAY = 0.75
+PREVIEW_DEPTH = 3  # Upcoming pieces shown, up to MAX_PREVIEW_DEPTH
+MAX_PREVIEW_DEPTH = 6
+
+# Levels past 15 keep speeding up until 20G, twenty rows per 1/60 s frame,
+# where a new piece lands the moment it spawns
+MAX_LEVEL = 30
+FRAME_TIME = 1 / 60
+HIGH_LEVEL_DROP_INTERVALS = [
+    0.25, 0.20, 0.15, 0.10, MIN_DROP_INTERVAL,                                   # 16-20
+    FRAME_TIME * 2, FRAME_TIME, FRAME_TIME / 2, FRAME_TIME / 3, FRAME_TIME / 5,  # 21-25: 0.5G-5G
+    FRAME_TIME / 8, FRAME_TIME / 10, FRAME_TIME / 12, FRAME_TIME / 15, FRAME_TIME / 20  # 26-30: 8G-20G
+]
+
+WALL_KICK_OFFSETS = {
+    'non-I': [
+        (0, 0),
+        (-1, 0),
+        (-1, 1),
+        (0, -2),
+        (-1, -2),
+        (1, 0),
+        (1, 1),
+        (0, 2),
+        (1, -2)
+    ],
+    'I': [
+        (0, 0),
+        (-2, 0),
+        (+1, 0),
+        (-2, -1),
+        (+1, +2),
+        (+2, 0),
+        (-1, 0),
+        (+2, +1),
+        (-1, -2)
+    ]
+}
+
+BLOCK_SHAPES = [
+    [(0,1), (1,1), (1,0), (1,2), (2,1)],  # F
+    [(0,2), (1,2), (2,2), (3,2), (4,2)],  # I
+    [(0,0), (1,0), (2,0), (3,0), (3,1)],  # L
+    [(0,1), (1,1), (2,1), (2,0), (3,0)],  # N
+    [(0,0), (0,1), (1,0), (1,1), (2,0)],  # P
+    [(0,1), (1,0), (1,1), (1,2), (2,1)],  # T
+    [(0,0), (0,2), (1,0), (1,1), (1,2)],  # U
+    [(0,0), (1,0), (2,0), (2,1), (2,2)],  # V
+    [(0,0), (1,0), (1,1), (2,1), (2,2)],  # W
+    [(0,1), (1,0), (1,1), (2,1), (3,1)],  # Y
+    [(0,0), (0,1), (1,1), (1,2), (2,2)]   # Z
+]
+# What each shape really is: the F and T entries are both the X pentomino and
+# the Z entry is a W, so shape_kind() reports those as the first of each
+BLOCK_NAMES = ["X", "I", "L", "N", "P", "X", "U", "V", "W", "Y", "W"]
+
+def normalize_shape(cells):
+    min_x = min(x for x, _ in cells)
+    min_y = min(y for _, y in cells)
+    return frozenset((x - min_x, y - min_y) for x, y in cells)
+
+# Every rotation of every shape, to tell which pentomino a rotated piece is
+SHAPE_KINDS = {}
+for kind, shape in enumerate(BLOCK_SHAPES):
+    for _ in range(4):
+        SHAPE_KINDS.setdefault(normalize_shape(shape), kind)
+        shape = [(y, -x) for x, y in shape]
+
+def shape_kind(shape):
+    return SHAPE_KINDS.get(normalize_shape(shape))
+
+SCORE_SINGLE = 100
+SCORE_DOUBLE = 300
+SCORE_TRIPLE = 600
+SCORE_QUADRUPLE = 1000
+SCORE_BLOCKO = 1500
+SCORE_SOFT_DROP = 1
+SCORE_HARD_DROP = 2
+SCORE_B_SPIN = 800
+
+# Particle speed and fade are per frame at 60 FPS
+PARTICLE_SPEED = 2
+PARTICLE_FADE_RATE = 5
+PARTICLE_COUNT = 20
+
+# Game logic runs at a fixed rate whatever the display refresh rate. After a
+# stall, at most MAX_CATCH_UP_TIME of missed ticks are replayed; the rest is dropped.
+LOGIC_RATE = 240
+MAX_CATCH_UP_TIME = 0.25
+
+POWER_UP_CHANCE = 0.05
+POWER_UP_TYPES = {
+    "CLEAR_ROW": {"chance": 0.3, "duration": 0},
+    "SLOW_TIME": {"chance": 0.3, "duration": 15},
+    "AVALANCHE": {"chance": 0.2, "duration": 0},
+    "BOMB": {"chance": 0.2, "duration": 0}
+}
+
+INITIAL_PRESSURE_INTERVAL = 30
+MIN_PRESSURE_INTERVAL = 10
+INITIAL_PRESSURE_HEIGHT = 1
+MAX_PRESSURE_HEIGHT = 5
+GARBAGE_BLOCK_COLOR = (128, 128, 128)
+PRESSURE_INCREASE_INTERVAL = 60
+
+# Every color a grid cell can hold, so a cell fits in one byte. Index 0 is empty.
+# Grid rows are bytearrays of these indices and pieces carry one as cell_index;
+# colors are looked up when drawing.
+CELL_PALETTE = [None] + BLOCK_COLORS + [GARBAGE_BLOCK_COLOR, FLASH_COLOR]
+CELL_INDEX = {color: i for i, color in enumerate(CELL_PALETTE)}
+GARBAGE_CELL = CELL_INDEX[GARBAGE_BLOCK_COLOR]
+BLOCK_CELLS = [CELL_INDEX[color] for color in BLOCK_COLORS]
+FLASH_CELL = CELL_INDEX[FLASH_COLOR]
+
+MASK64 = (1 << 64) - 1
+
+# SplitMix64 behind the random.Random interface. Its whole state is one 64-bit
+# integer, so a game's RNG can be saved and restored along with the board.
+class GameRandom(random.Random):
+    def seed(self, a=None, version=2):
+        if a is None:
+            a = int.from_bytes(os.urandom(8), "little")
+        elif not isinstance(a, int):
+            a = hash(a)
+        self.state = a & MASK64
+
+    def next64(self):
+        self.state = (self.state + 0x9E3779B97F4A7C15) & MASK64
+        z = self.state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return z ^ (z >> 31)
+
+    def random(self):
+        return (self.next64() >> 11) * (1.0 / (1 << 53))
+
+    def getrandbits(self, k):
+        if k <= 64:
+            return self.next64() >> (64 - k)
+        bits = 0
+        for shift in range(0, k, 64):
+            bits |= self.next64() << shift
+        return bits & ((1 << k) - 1)
+
+    def getstate(self):
+        return self.state
+
+    def setstate(self, state):
+        self.state = state
+
+class FixedTimestep:
+    def __init__(self, rate=LOGIC_RATE, max_catch_up_time=MAX_CATCH_UP_TIME):
+        self.step = 1 / rate
+        self.max_ticks = max(1, int(max_catch_up_time * rate))
+        self.accumulator = 0.0
+        self.dropped_ticks = 0
+
+    def advance(self, elapsed):
+        # Number of whole ticks due after elapsed more seconds of real time
+        self.accumulator += elapsed
+        ticks = int(self.accumulator / self.step)
+        self.accumulator -= ticks * self.step
+        if ticks > self.max_ticks:
+            self.dropped_ticks += ticks - self.max_ticks
+            ticks = self.max_ticks
+        return ticks
+
+    def alpha(self):
+        # How far real time has got towards the next tick, for interpolation
+        return min(1.0, self.accumulator / self.step)
+
+# Key codes, the same values as arcade.key
+KEY_ENTER = 65293
+KEY_ESCAPE = 65307
+KEY_LEFT = 65361
+KEY_UP = 65362
+KEY_RIGHT = 65363
+KEY_DOWN = 65364
+KEY_SPACE = 32
+KEY_TAB = 65289
+KEY_A = 97
+KEY_C = 99
+KEY_D = 100
+KEY_E = 101
+KEY_P = 112
+KEY_Q = 113
+KEY_R = 114
+KEY_S = 115
+KEY_U = 117
+KEY_W = 119
+KEY_X = 120
+KEY_Z = 122
+KEY_F3 = 65472
+
+# Default key bindings
+DEFAULT_KEY_BINDINGS = {
+    "MOVE_LEFT": KEY_LEFT,
+    "MOVE_RIGHT": KEY_RIGHT,
+    "MOVE_UP": KEY_UP,
+    "MOVE_DOWN": KEY_DOWN,
+    "SOFT_DROP": KEY_DOWN,
+    "HARD_DROP": KEY_UP,
+    "ROTATE_LEFT": KEY_Z,
+    "ROTATE_RIGHT": KEY_X,
+    "HOLD": KEY_C,
+    "PAUSE": KEY_P,
+    "UNDO": KEY_U,
+    "REDO": KEY_R,
+    "SELECT": KEY_ENTER,
+    "BACK": KEY_ESCAPE,
+    "DEBUG_OVERLAY": KEY_F3,
+    "P2_MOVE_LEFT": KEY_A,
+    "P2_MOVE_RIGHT": KEY_D,
+    "P2_SOFT_DROP": KEY_S,
+    "P2_HARD_DROP": KEY_W,
+    "P2_ROTATE_LEFT": KEY_Q,
+    "P2_ROTATE_RIGHT": KEY_E,
+    "P2_HOLD": KEY_TAB
+}
+
+# Playfield actions of the second player in versus carry this prefix
+PLAYER_ACTION_PREFIXES = ["", "P2_"]
+PLAYER_ACTIONS = ["MOVE_LEFT", "MOVE_RIGHT", "SOFT_DROP", "HARD_DROP", "ROTATE_LEFT", "ROTATE_RIGHT", "HOLD"]
+
+def split_player_action(action):
+    # "P2_HOLD" -> (1, "HOLD"); actions without a prefix belong to player one
+    for index in range(len(PLAYER_ACTION_PREFIXES) - 1, 0, -1):
+        prefix = PLAYER_ACTION_PREFIXES[index]
+        if action.startswith(prefix):
+            return index, action[len(prefix):]
+    return 0, action
+
+class GameMode:
+    MARATHON = 0
+    SPRINT = 1
+    ULTRA = 2
+    PRESSURE = 3
+    PRACTICE = 4  # Marathon rules with undo/redo, kept off the high score table
+    VERSUS = 5    # Two players on one machine, sending each other garbage
+
+class GameState:
+    MAIN_MENU = 0
+    GAME_MODE_SELECT = 1
+    OPTIONS = 2
+    PLAYING = 3
+    PAUSED = 4
+    GAME_OVER = 5
+    TUTORIAL = 6
+    KEY_BINDING = 7
+
+# Events a BlockoEngine publishes, and what handlers receive after the name
+class EngineEvent:
+    SPAWN = "spawn"            # no arguments
+    MOVE = "move"              # no arguments
+    ROTATE = "rotate"          # no arguments
+    HOLD = "hold"              # no arguments
+    LOCK = "lock"              # the piece that locked
+    LINE_CLEAR = "line_clear"  # cells as [(x, y, color), ...] before they are removed
+    COMBO = "combo"            # combo count
+    POWER_UP = "power_up"      # power-up type
+    ROW_WIPE = "row_wipe"      # cells as for LINE_CLEAR
+    EXPLOSION = "explosion"    # x, y
+    GARBAGE = "garbage"        # rows added
+    GAME_OVER = "game_over"    # no arguments
+
+ENGINE_EVENTS = [
+    EngineEvent.SPAWN, EngineEvent.MOVE, EngineEvent.ROTATE, EngineEvent.HOLD, EngineEvent.LOCK,
+    EngineEvent.LINE_CLEAR, EngineEvent.COMBO, EngineEvent.POWER_UP, EngineEvent.ROW_WIPE,
+    EngineEvent.EXPLOSION, EngineEvent.GARBAGE, EngineEvent.GAME_OVER
+]
+
+# Handlers subscribe to the events they want and are called as
+# handler(event, *args). Publishing an event nobody subscribed to is a single
+# dict lookup, and publishers can ask has_subscribers() before building an
+# expensive payload.
+class EventBus:
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, events, handler):
+        for event in events:
+            self.handlers[event] = self.handlers.get(event, ()) + (handler,)
+
+    def unsubscribe(self, events, handler):
+        for event in events:
+            handlers = tuple(h for h in self.handlers.get(event, ()) if h != handler)
+            if handlers:
+                self.handlers[event] = handlers
+            else:
+                self.handlers.pop(event, None)
+
+    def has_subscribers(self, event):
+        return event in self.handlers
+
+    def emit(self, event, *args):
+        handlers = self.handlers.get(event)
+        if handlers:
+            for handler in handlers:
+                handler(event, *args)
+
+# Actions each state responds to, highest priority first. When two of them
+# share a key, the earlier one wins and the pair is reported as a conflict.
+STATE_ACTIONS = {
+    GameState.MAIN_MENU: ["MOVE_UP", "MOVE_DOWN", "SELECT"],
+    GameState.GAME_MODE_SELECT: ["MOVE_UP", "MOVE_DOWN", "SELECT", "BACK"],
+    GameState.OPTIONS: ["MOVE_UP", "MOVE_DOWN", "SELECT", "BACK"],
+    GameState.PLAYING: PLAYER_ACTIONS + [PLAYER_ACTION_PREFIXES[1] + action for action in PLAYER_ACTIONS] +
+                       ["PAUSE", "UNDO", "REDO", "DEBUG_OVERLAY"],
+    GameState.PAUSED: ["PAUSE", "UNDO", "REDO", "DEBUG_OVERLAY"],
+    GameState.GAME_OVER: ["SELECT", "UNDO"],
+    GameState.TUTORIAL: ["SELECT", "BACK"],
+    GameState.KEY_BINDING: ["MOVE_UP", "MOVE_DOWN", "SELECT", "BACK"]
+}
+
+def binding_keys(binding):
+    # A binding is a single key code or a list of them
+    return binding if isinstance(binding, list) else [binding]
+
+def compile_key_bindings(key_bindings, state_actions=STATE_ACTIONS):
+    tables = {}
+    conflicts = set()
+    for state, actions in state_actions.items():
+        table = {}
+        for action in actions:
+            for key in binding_keys(key_bindings.get(action, [])):
+                if key in table:
+                    if table[key] != action:
+                        conflicts.add(table[key])
+                        conflicts.add(action)
+                else:
+                    table[key] = action
+        tables[state] = table
+    return tables, conflicts
+
+def key_to_string(key):
+    key_map = {
+        KEY_UP: "Up",
+        KEY_DOWN: "Down",
+        KEY_LEFT: "Left",
+        KEY_RIGHT: "Right",
+        KEY_ENTER: "Enter",
+        KEY_ESCAPE: "Esc",
+        KEY_SPACE: "Space",
+        KEY_TAB: "Tab",
+        KEY_Z: "Z",
+        KEY_X: "X",
+        KEY_C: "C",
+        KEY_P: "P",
+        KEY_F3: "F3"
+    }
+    return key_map.get(key, chr(key).upper())
+
+def binding_to_string(binding):
+    return "/".join(key_to_string(key) for key in binding_keys(binding))
+
+class PowerUp:
+    def __init__(self, type):
+        self.type = type
+        self.active = False
+        self.start_time = None
+        self.duration = POWER_UP_TYPES[type]["duration"]
+
+    def activate(self, current_time):
+        self.active = True
+        self.start_time = current_time
+
+    def deactivate(self):
+        self.active = False
+        self.start_time = None
+
+class Block:
+    def __init__(self, shape, cell_index, grid_x, grid_y, block_type='non-I'):
+        self.shape = shape
+        self.cell_index = cell_index
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+        self.block_type = block_type
+        self.rotation_state = 0
+
+    def get_global_positions(self):
+        return [(self.grid_x + x, self.grid_y + y) for x, y in self.shape]
+
+    def move(self, dx, dy):
+        self.grid_x += dx
+        self.grid_y += dy
+
+    def get_width(self):
+        xs = [x for x, y in self.shape]
+        return max(xs) - min(xs) + 1
+
+    def get_height(self):
+        ys = [y for _, y in self.shape]
+        return max(ys) - min(ys) + 1
+
+    def rotate(self, clockwise, game):
+        original_shape = self.shape.copy()
+        original_x = self.grid_x
+        original_y = self.grid_y
+        original_state = self.rotation_state
+
+        center_x = sum(x for x, _ in self.shape) / len(self.shape)
+        center_y = sum(y for _, y in self.shape) / len(self.shape)
+
+        if clockwise:
+            self.shape = [(round(-y + center_y + center_x), round(x - center_x + center_y)) for x, y in self.shape]
+            self.rotation_state = (self.rotation_state + 1) % 4
+        else:
+            self.shape = [(round(y - center_y + center_x), round(-x + center_x + center_y)) for x, y in self.shape]
+            self.rotation_state = (self.rotation_state - 1) % 4
+
+        min_x = min(x for x, _ in self.shape)
+        min_y = min(y for _, y in self.shape)
+        self.shape = [(x - min_x, y - min_y) for x, y in self.shape]
+
+        kick_set = WALL_KICK_OFFSETS['I' if self.block_type == 'I' else 'non-I']
+        for kick in kick_set:
+            test_x = self.grid_x + kick[0]
+            test_y = self.grid_y + kick[1]
+            if game.is_valid_position([(x + test_x, y + test_y) for x, y in self.shape]):
+                self.grid_x = test_x
+                self.grid_y = test_y
+                return True
+
+        self.shape = original_shape
+        self.grid_x = original_x
+        self.grid_y = original_y
+        self.rotation_state = original_state
+        return False
@@ -0,0 +1,116 @@
+from blocko_core import GRID_WIDTH, GRID_HEIGHT, BUFFER_ZONE_HEIGHT, ENGINE_EVENTS, EngineEvent
+
+# What changed on a board since the last message, for the match server and
+# the spectator feed. Messages are dicts ready for JSON, with only the keys
+# that changed:
+#   {"tick": 120, "cells": [index, color, ...], "piece": [color, [[x, y], ...]],
+#    "hold": [color, [[x, y], ...]], "next": [...], "score": [score, level, lines, combo],
+#    "events": [["line_clear", 2], ["combo"], ...], "over": true}
+# Cells are indexed x + y * GRID_WIDTH with colors from CELL_PALETTE, 0 for
+# empty. A keyframe has "key": true and describes the whole board.
+
+GRID_CELLS = GRID_WIDTH * (GRID_HEIGHT + BUFFER_ZONE_HEIGHT)
+# Events that change the board, hold or queue; piece movement is diffed every message
+DELTA_EVENTS = [event for event in ENGINE_EVENTS
+                if event not in [EngineEvent.SPAWN, EngineEvent.MOVE, EngineEvent.ROTATE]]
+
+def encode_shape(block):
+    if block is None:
+        return None
+    return [block.cell_index, [list(cell) for cell in block.shape]]
+
+def encode_piece(block):
+    if block is None:
+        return None
+    return [block.cell_index, [list(cell) for cell in block.get_global_positions()]]
+
+def encode_event(event, args):
+    # Cleared rows are sent as a row count, not the cells; pieces are left out
+    return [event] + [len(arg) // GRID_WIDTH if isinstance(arg, list) else arg
+                      for arg in args if isinstance(arg, (list, int, str))]
+
+class DeltaEncoder:
+    def __init__(self, engine):
+        self.engine = engine
+        self.reset()
+
+    def reset(self):
+        # Forget what was sent, so the next message is a keyframe
+        self.sent_cells = bytes(GRID_CELLS)
+        self.sent_piece = None
+        self.sent_hold = None
+        self.sent_next = None
+        self.sent_score = None
+        self.board_changed = True
+        self.events = []
+
+    def on_engine_event(self, event, *args):
+        # Subscribed to DELTA_EVENTS
+        self.board_changed = True
+        self.events.append(encode_event(event, args))
+
+    def encode(self, tick, keyframe=False):
+        engine = self.engine
+        message = {"tick": tick}
+        if keyframe:
+            events = self.events
+            self.reset()
+            self.events = events
+            message["key"] = True
+        if self.board_changed:
+            self.board_changed = False
+            board = b"".join(engine.grid)
+            cells = []
+            if board != self.sent_cells:
+                for i, (sent, index) in enumerate(zip(self.sent_cells, board)):
+                    if sent != index:
+                        cells += [i, index]
+                self.sent_cells = board
+            if cells:
+                message["cells"] = cells
+            hold = encode_shape(engine.hold_block)
+            if hold != self.sent_hold or keyframe:
+                message["hold"] = self.sent_hold = hold
+            next_blocks = [encode_shape(block) for block in engine.get_next_blocks()]
+            if next_blocks != self.sent_next:
+                message["next"] = self.sent_next = next_blocks
+        piece = encode_piece(engine.current_block)
+        if piece != self.sent_piece or keyframe:
+            message["piece"] = self.sent_piece = piece
+        score = [engine.score, engine.level, engine.lines_cleared, engine.combo_count]
+        if score != self.sent_score:
+            message["score"] = self.sent_score = score
+        if self.events:
+            message["events"] = self.events
+            self.events = []
+        if engine.is_game_over:
+            message["over"] = True
+        return message if len(message) > 1 else None
+
+# A board rebuilt from the messages of a DeltaEncoder
+class BoardMirror:
+    def __init__(self):
+        self.cells = [0] * GRID_CELLS
+        self.piece = None
+        self.hold = None
+        self.next = []
+        self.score = [0, 1, 0, 0]
+        self.tick = 0
+        self.over = False
+
+    def apply(self, message):
+        if message.get("key"):
+            self.cells = [0] * GRID_CELLS
+        self.tick = message.get("tick", self.tick)
+        cells = message.get("cells", [])
+        for i in range(0, len(cells), 2):
+            self.cells[cells[i]] = cells[i + 1]
+        if "piece" in message:
+            self.piece = message["piece"]
+        if "hold" in message:
+            self.hold = message["hold"]
+        if "next" in message:
+            self.next = message["next"]
+        if "score" in message:
+            self.score = message["score"]
+        self.over = message.get("over", False)
@@ -0,0 +1,614 @@
+import math
+import struct
+import time
+from collections import deque
+from itertools import islice
+
+from blocko_core import (
+    GRID_WIDTH, GRID_HEIGHT, BUFFER_ZONE_HEIGHT, BLOCK_SIZE, BLOCK_SHAPES, BLOCK_CELLS,
+    HARD_DROP_COOLDOWN, INITIAL_DROP_INTERVAL, LOCK_DELAY, PREVIEW_DEPTH, MAX_LEVEL, HIGH_LEVEL_DROP_INTERVALS,
+    SCORE_SINGLE, SCORE_DOUBLE, SCORE_TRIPLE, SCORE_QUADRUPLE, SCORE_BLOCKO,
+    SCORE_SOFT_DROP, SCORE_HARD_DROP, POWER_UP_CHANCE, POWER_UP_TYPES,
+    INITIAL_PRESSURE_INTERVAL, MIN_PRESSURE_INTERVAL, INITIAL_PRESSURE_HEIGHT,
+    PRESSURE_INCREASE_INTERVAL, GARBAGE_CELL, FLASH_CELL,
+    EngineEvent, EventBus, GameMode, GameRandom, PowerUp, Block
+)
+from blocko_board import pack_cells, unpack_cells
+
+def get_drop_interval(level):
+    if level <= 15:
+        return INITIAL_DROP_INTERVAL - 0.05 * (level - 1)
+    return HIGH_LEVEL_DROP_INTERVALS[min(level, MAX_LEVEL) - 16]
+
+# Snapshot layout, little endian:
+#   header, scalar state, current and hold piece, piece queue, flash lines,
+#   power-ups, grid (packed by blocko_board).
+# Times are stored as read from the engine clock; None is stored as NaN.
+# The grid goes last because its length varies: a lock then only changes the
+# bytes after its cells, which keeps rewind patches small.
+SNAPSHOT_MAGIC = b"BLKS"
+SNAPSHOT_VERSION = 4
+SNAPSHOT_HEADER = struct.Struct("<4sB")
+SNAPSHOT_STATE = struct.Struct("<B5?qHIH4BQ12d")
+SNAPSHOT_PIECE = struct.Struct("<BBhhB10b")
+SNAPSHOT_QUEUE = struct.Struct("<QB")
+SNAPSHOT_POWER_UP = struct.Struct("<?d")
+PIECE_PRESENT = 1
+PIECE_I = 2
+GRID_CELLS = GRID_WIDTH * (GRID_HEIGHT + BUFFER_ZONE_HEIGHT)
+POWER_UP_NAMES = list(POWER_UP_TYPES)
+I_SHAPE = BLOCK_SHAPES[1]
+PIECE_CHUNK = 8
+
+def encode_time(value):
+    return math.nan if value is None else value
+
+def decode_time(value):
+    return None if math.isnan(value) else value
+
+def encode_piece(block):
+    if block is None:
+        return SNAPSHOT_PIECE.pack(0, 0, 0, 0, 0, *[0] * 10)
+    flags = PIECE_PRESENT | (PIECE_I if block.block_type == 'I' else 0)
+    cells = [v for cell in block.shape for v in cell]
+    return SNAPSHOT_PIECE.pack(flags, block.cell_index, block.grid_x, block.grid_y,
+                               block.rotation_state, *cells)
+
+def decode_piece(data, offset):
+    flags, cell_index, grid_x, grid_y, rotation_state, *cells = SNAPSHOT_PIECE.unpack_from(data, offset)
+    if not flags & PIECE_PRESENT:
+        return None
+    block = Block([(cells[i], cells[i + 1]) for i in range(0, 10, 2)], cell_index,
+                  grid_x, grid_y, 'I' if flags & PIECE_I else 'non-I')
+    block.rotation_state = rotation_state
+    return block
+
+# Upcoming pieces, drawn PIECE_CHUNK at a time from a random stream of their
+# own, so the sequence depends on neither the preview depth nor the other
+# random events of a game. Its state is where the chunk holding the first
+# piece started and how far into it play has got, which does not change
+# however far ahead anyone has peeked.
+class PieceQueue:
+    def __init__(self, seed):
+        self.random = GameRandom(seed)
+        self.pieces = deque()
+        self.chunk_states = deque()
+        self.taken = 0
+
+    def refill(self):
+        self.chunk_states.append(self.random.getstate())
+        for _ in range(PIECE_CHUNK):
+            shape = self.random.choice(BLOCK_SHAPES)
+            cell_index = self.random.choice(BLOCK_CELLS)
+            self.pieces.append(Block(shape, cell_index, 0, 0, 'I' if shape == I_SHAPE else 'non-I'))
+
+    def pop(self):
+        if not self.pieces:
+            self.refill()
+        self.taken += 1
+        if self.taken == PIECE_CHUNK:
+            self.chunk_states.popleft()
+            self.taken = 0
+        return self.pieces.popleft()
+
+    def peek(self, depth):
+        while len(self.pieces) < depth:
+            self.refill()
+        return list(islice(self.pieces, depth))
+
+    def getstate(self):
+        if not self.chunk_states:
+            return self.random.getstate(), 0
+        return self.chunk_states[0], self.taken
+
+    def setstate(self, state, taken):
+        self.random.setstate(state)
+        self.pieces.clear()
+        self.chunk_states.clear()
+        self.taken = 0
+        for _ in range(taken):
+            self.pop()
+
+# The rules of one game of bLocKo, without any rendering, audio or input.
+# Side effects the front end cares about are published as EngineEvents on
+# self.events.
+class BlockoEngine:
+    def __init__(self, game_mode=GameMode.MARATHON, power_ups_enabled=True, clock=time.time, seed=None,
+                 preview_depth=PREVIEW_DEPTH):
+        self.game_mode = game_mode
+        self.power_ups_enabled = power_ups_enabled
+        self.clock = clock
+        self.random = GameRandom(seed)
+        self.events = EventBus()
+        self.grid = [bytearray(GRID_WIDTH) for _ in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT)]
+        self.current_block = None
+        self.piece_queue = PieceQueue(self.random.getrandbits(64))
+        self.preview_depth = preview_depth
+        self.hold_block = None
+        self.can_hold = True
+        self.score = 0
+        self.level = 1
+        self.lines_cleared = 0
+        self.last_hard_drop_time = -HARD_DROP_COOLDOWN
+        self.next_drop_time = self.clock() + INITIAL_DROP_INTERVAL
+        self.drop_interval = INITIAL_DROP_INTERVAL
+        self.flash_lines = []
+        self.is_flashing = False
+        self.flash_timer = 0
+        self.flash_duration = 0.1
+        self.total_flashes = 0
+        self.max_flashes = 4
+        self.flash_visible = True
+        self.lock_timer = None
+        self.start_time = None
+        self.time_limit = None
+        self.combo_count = 0
+        self.power_ups = {ptype: PowerUp(ptype) for ptype in POWER_UP_TYPES}
+        self.active_power_ups = []
+        self.combo_display_time = 0
+        self.power_up_display_time = 0
+        self.last_pressure_time = 0
+        self.pressure_interval = INITIAL_PRESSURE_INTERVAL
+        self.pressure_height = INITIAL_PRESSURE_HEIGHT
+        self.pressure_level = 0
+        self.lava_height = 0
+        self.pending_garbage = 0
+        self.is_game_over = False
+
+    def start(self):
+        self.start_time = self.clock()
+
+        if self.game_mode == GameMode.SPRINT:
+            self.time_limit = 120  # 2 minutes for Sprint mode
+        elif self.game_mode == GameMode.ULTRA:
+            self.time_limit = 180  # 3 minutes for Ultra mode
+        else:
+            self.time_limit = None
+
+        if not self.spawn_new_block():
+            return False
+
+        self.next_drop_time = self.clock() + self.drop_interval
+
+        # Initialize game mode specific variables
+        if self.game_mode == GameMode.PRESSURE:
+            self.last_pressure_time = self.clock()
+            self.pressure_level = 0
+            self.lava_height = 0
+        return True
+
+    def get_ghost_position(self):
+        if not self.current_block:
+            return []
+
+        return Block(
+            self.current_block.shape.copy(),
+            self.current_block.cell_index,
+            self.current_block.grid_x,
+            self.current_block.grid_y - self.get_drop_distance(),
+            self.current_block.block_type
+        )
+
+    def get_drop_distance(self):
+        # Rows the current block can fall: for each cell, the run of empty cells
+        # directly beneath it, minimised over the block
+        grid = self.grid
+        total_rows = GRID_HEIGHT + BUFFER_ZONE_HEIGHT
+        distance = total_rows + BUFFER_ZONE_HEIGHT
+        for x, y in self.current_block.get_global_positions():
+            below = y - 1
+            while below >= 0 and (below >= total_rows or not grid[below][x]):
+                below -= 1
+            distance = min(distance, y - 1 - below)
+        return distance
+
+    def spawn_new_block(self):
+        self.current_block = self.piece_queue.pop()
+
+        self.current_block.grid_x = (GRID_WIDTH - self.current_block.get_width()) // 2
+        self.current_block.grid_y = GRID_HEIGHT + BUFFER_ZONE_HEIGHT - self.current_block.get_height()
+
+        if not self.is_valid_position(self.current_block.get_global_positions()):
+            self.game_over()
+            return False
+
+        self.can_hold = True
+        self.events.emit(EngineEvent.SPAWN)
+        return True
+
+    def get_next_blocks(self, depth=None):
+        # The pieces after the current one, preview_depth of them unless asked for more
+        return self.piece_queue.peek(self.preview_depth if depth is None else depth)
+
+    def hold_piece(self):
+        if not self.can_hold or not self.current_block:
+            return
+
+        if self.hold_block:
+            self.current_block, self.hold_block = self.hold_block, self.current_block
+            self.current_block.grid_x = (GRID_WIDTH - self.current_block.get_width()) // 2
+            self.current_block.grid_y = GRID_HEIGHT + BUFFER_ZONE_HEIGHT - 1
+        else:
+            self.hold_block = self.current_block
+            self.spawn_new_block()
+
+        self.can_hold = False
+        self.events.emit(EngineEvent.HOLD)
+
+    def move_block(self, dx, dy):
+        if self.current_block:
+            new_positions = [(x + dx, y + dy) for x, y in self.current_block.get_global_positions()]
+            if self.is_valid_position(new_positions):
+                self.current_block.move(dx, dy)
+                if dy == -1:
+                    self.score += SCORE_SOFT_DROP
+                self.events.emit(EngineEvent.MOVE)
+                return True
+        return False
+
+    def rotate_block(self, clockwise):
+        if self.current_block and self.current_block.rotate(clockwise, self):
+            self.events.emit(EngineEvent.ROTATE)
+            return True
+        return False
+
+    def is_valid_position(self, positions):
+        for x, y in positions:
+            if x < 0 or x >= GRID_WIDTH or y < 0:
+                return False
+            if y < GRID_HEIGHT + BUFFER_ZONE_HEIGHT and self.grid[int(y)][int(x)]:
+                return False
+        return True
+
+    def apply_gravity(self, rows):
+        distance = min(rows, self.get_drop_distance())
+        if distance <= 0:
+            return False
+        self.current_block.move(0, -distance)
+        self.score += SCORE_SOFT_DROP * distance
+        self.events.emit(EngineEvent.MOVE)
+        return True
+
+    def hard_drop(self):
+        if not self.current_block:
+            return
+        drop_distance = self.get_drop_distance()
+        self.current_block.move(0, -drop_distance)
+        # Every row counts as a soft drop row as well, as it did when hard drop stepped through move_block
+        self.score += (SCORE_SOFT_DROP + SCORE_HARD_DROP) * drop_distance
+        self.place_block()
+
+    def place_block(self):
+        block = self.current_block
+        for x, y in block.get_global_positions():
+            if 0 <= y < GRID_HEIGHT and 0 <= x < GRID_WIDTH:
+                self.grid[int(y)][int(x)] = block.cell_index
+        lines_before = self.lines_cleared
+        self.clear_lines()
+        # Garbage sent by an opponent arrives on the first lock that clears nothing
+        if self.pending_garbage and self.lines_cleared == lines_before:
+            self.add_garbage_rows(self.pending_garbage)
+            self.pending_garbage = 0
+        self.spawn_new_block()
+        self.lock_timer = None
+        self.events.emit(EngineEvent.LOCK, block)
+
+    def clear_lines(self):
+        lines_to_clear = []
+        for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
+            if all(self.grid[y]):
+                lines_to_clear.append(y)
+
+        if lines_to_clear:
+            self.flash_lines = lines_to_clear.copy()
+            self.is_flashing = True
+            self.flash_timer = 0
+            self.flash_visible = True
+            self.total_flashes = 0
+            if self.events.has_subscribers(EngineEvent.LINE_CLEAR):
+                self.events.emit(EngineEvent.LINE_CLEAR, self.get_cells(lines_to_clear))
+            self.update_combo(len(lines_to_clear))
+            if self.power_ups_enabled:
+                self.spawn_power_up_block()
+
+            for y in sorted(lines_to_clear, reverse=True):
+                del self.grid[y]
+
+            for _ in range(len(lines_to_clear)):
+                self.grid.insert(0, bytearray(GRID_WIDTH))
+
+            self.lines_cleared += len(lines_to_clear)
+            self.score += self.calculate_score(len(lines_to_clear))
+            self.update_level()
+
+    def get_cells(self, lines):
+        return [(x, y, self.grid[y][x]) for y in lines for x in range(GRID_WIDTH) if self.grid[y][x]]
+
+    def calculate_score(self, lines_cleared):
+        base_scores = {1: SCORE_SINGLE, 2: SCORE_DOUBLE, 3: SCORE_TRIPLE, 4: SCORE_QUADRUPLE, 5: SCORE_BLOCKO}
+        return base_scores.get(lines_cleared, SCORE_BLOCKO) * self.level
+
+    def update_level(self):
+        self.level = min(self.lines_cleared // 10 + 1, MAX_LEVEL)
+        self.drop_interval = get_drop_interval(self.level)
+
+    def update_combo(self, lines_cleared):
+        if lines_cleared > 0:
+            self.combo_count += 1
+            combo_bonus = self.combo_count * 50 * self.level
+            self.score += combo_bonus
+            self.combo_display_time = self.clock()
+            self.events.emit(EngineEvent.COMBO, self.combo_count)
+        else:
+            self.combo_count = 0
+
+    def spawn_power_up_block(self):
+        if self.random.random() < POWER_UP_CHANCE:
+            power_up_type = self.random.choices(
+                list(POWER_UP_TYPES.keys()),
+                weights=[POWER_UP_TYPES[t]["chance"] for t in POWER_UP_TYPES]
+            )[0]
+            self.activate_power_up(power_up_type)
+
+    def activate_power_up(self, type):
+        power_up = self.power_ups[type]
+        power_up.activate(self.clock())
+        self.active_power_ups.append(power_up)
+        self.power_up_display_time = self.clock()
+        self.events.emit(EngineEvent.POWER_UP, type)
+
+        if type == "CLEAR_ROW":
+            self.clear_random_row()
+        elif type == "SLOW_TIME":
+            self.drop_interval *= 1.5
+        elif type == "AVALANCHE":
+            self.trigger_avalanche()
+        elif type == "BOMB":
+            self.trigger_bomb()
+
+    def clear_random_row(self):
+        row = self.random.randint(0, GRID_HEIGHT - 1)
+        if any(self.grid[row]):
+            if self.events.has_subscribers(EngineEvent.ROW_WIPE):
+                self.events.emit(EngineEvent.ROW_WIPE, self.get_cells([row]))
+            self.grid[row] = bytearray(GRID_WIDTH)
+
+    def trigger_avalanche(self):
+        self.settle_all_blocks()
+
+    def settle_all_blocks(self):
+        blocks_moved = False
+        for x in range(GRID_WIDTH):
+            column_settled = self.settle_column(x)
+            blocks_moved = blocks_moved or column_settled
+
+        if blocks_moved:
+            self.clear_lines()
+
+    def settle_column(self, x):
+        column = [self.grid[y][x] for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT)]
+        settled_column = [cell for cell in column if cell]
+        blocks_moved = len(settled_column) != len([cell for cell in column if cell])
+
+        settled_column = [0] * (GRID_HEIGHT + BUFFER_ZONE_HEIGHT - len(settled_column)) + settled_column
+
+        for y in range(GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
+            if self.grid[y][x] != settled_column[y]:
+                self.grid[y][x] = settled_column[y]
+
+        return blocks_moved
+
+    def trigger_bomb(self):
+        bomb_x = self.random.randint(0, GRID_WIDTH - 1)
+        bomb_y = self.random.randint(0, GRID_HEIGHT - 1)
+
+        for y in range(max(0, bomb_y - 2), min(GRID_HEIGHT + BUFFER_ZONE_HEIGHT, bomb_y + 3)):
+            for x in range(max(0, bomb_x - 2), min(GRID_WIDTH, bomb_x + 3)):
+                if self.grid[y][x]:
+                    self.grid[y][x] = 0
+                    self.events.emit(EngineEvent.EXPLOSION, x, y)
+
+        self.settle_all_blocks()
+
+    def update_power_ups(self):
+        current_time = self.clock()
+        for power_up in self.active_power_ups[:]:
+            if power_up.duration > 0 and current_time - power_up.start_time > power_up.duration:
+                if power_up.type == "SLOW_TIME":
+                    self.drop_interval /= 1.5
+                power_up.deactivate()
+                self.active_power_ups.remove(power_up)
+
+    def game_over(self):
+        if self.is_game_over:
+            return
+        self.is_game_over = True
+        self.current_block = None
+        self.events.emit(EngineEvent.GAME_OVER)
+
+    def update(self, delta_time):
+        if self.is_game_over:
+            return
+
+        current_time = self.clock()
+
+        if self.game_mode in [GameMode.SPRINT, GameMode.ULTRA]:
+            if self.time_limit and current_time - self.start_time >= self.time_limit:
+                self.game_over()
+                return
+
+        if self.is_flashing:
+            self.next_drop_time = max(self.next_drop_time, current_time)
+        elif current_time >= self.next_drop_time and self.current_block:
+            # Fast levels fall several rows per tick; the landing row caps the distance
+            overdue = current_time - self.next_drop_time
+            rows = 1 + int(overdue / self.drop_interval)
+            self.next_drop_time = current_time + self.drop_interval - overdue % self.drop_interval
+            moved = self.apply_gravity(rows)
+            if not moved:
+                if self.lock_timer is None:
+                    self.lock_timer = current_time
+            else:
+                self.lock_timer = None
+
+        if self.lock_timer is not None:
+            if current_time - self.lock_timer >= LOCK_DELAY:
+                self.place_block()
+                self.lock_timer = None
+
+        if self.is_flashing:
+            self.handle_line_clear_animation(delta_time)
+
+        self.update_power_ups()
+
+        if self.game_mode == GameMode.PRESSURE:
+            self.update_pressure_mode(current_time)
+
+    def handle_line_clear_animation(self, delta_time):
+        self.flash_timer += delta_time
+        if self.flash_timer >= self.flash_duration:
+            self.flash_timer = 0
+            self.flash_visible = not self.flash_visible
+            self.total_flashes += 1
+            if self.total_flashes >= self.max_flashes:
+                self.is_flashing = False
+                self.flash_timer = 0
+                self.total_flashes = 0
+                self.flash_visible = True
+                self.clear_lines()
+
+    def update_pressure_mode(self, current_time):
+        if current_time - self.last_pressure_time >= self.pressure_interval:
+            self.add_pressure_blocks()
+            self.last_pressure_time = current_time
+
+        if current_time - self.start_time >= PRESSURE_INCREASE_INTERVAL * (self.pressure_level + 1):
+            self.increase_pressure_difficulty()
+
+        target_height = (GRID_HEIGHT * BLOCK_SIZE) * (self.pressure_level / 10)
+        self.lava_height += (target_height - self.lava_height) * 0.1
+
+    def add_pressure_blocks(self):
+        self.add_garbage_rows(1, self.pressure_height, self.random.randint(1, 2))
+
+    def add_garbage_rows(self, count, row=0, holes=1):
+        # Push everything from row upwards up by count rows, losing the top
+        # rows, and fill the gap with garbage that has holes gaps per row
+        for _ in range(count):
+            garbage = bytearray([GARBAGE_CELL]) * GRID_WIDTH
+            for _ in range(holes):
+                garbage[self.random.randint(0, GRID_WIDTH - 1)] = 0
+            del self.grid[-1]
+            self.grid.insert(row, garbage)
+
+        # A falling piece the garbage ran into is lifted clear of it
+        if self.current_block:
+            for _ in range(count):
+                if self.is_valid_position(self.current_block.get_global_positions()):
+                    break
+                self.current_block.move(0, 1)
+
+        self.flash_lines = list(range(row, row + count))
+        self.is_flashing = True
+        self.flash_timer = 0
+        self.flash_visible = True
+        self.total_flashes = 0
+        self.events.emit(EngineEvent.GARBAGE, count)
+
+    def increase_pressure_difficulty(self):
+        self.pressure_level = min(self.pressure_level + 1, 5)
+        self.pressure_interval = max(MIN_PRESSURE_INTERVAL, self.pressure_interval - 5)
+
+    def snapshot(self):
+        # The whole game as a few hundred bytes; restore() brings it back exactly
+        parts = [
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION),
+            SNAPSHOT_STATE.pack(
+                self.game_mode, self.power_ups_enabled, self.can_hold, self.is_game_over,
+                self.is_flashing, self.flash_visible,
+                self.score, self.level, self.lines_cleared, self.combo_count,
+                self.total_flashes, self.pressure_height, self.pressure_level, self.pending_garbage,
+                self.random.getstate(),
+                self.drop_interval, self.next_drop_time, self.last_hard_drop_time,
+                encode_time(self.lock_timer), encode_time(self.start_time), encode_time(self.time_limit),
+                self.flash_timer, self.combo_display_time, self.power_up_display_time,
+                self.last_pressure_time, self.pressure_interval, self.lava_height
+            ),
+            encode_piece(self.current_block),
+            encode_piece(self.hold_block),
+            SNAPSHOT_QUEUE.pack(*self.piece_queue.getstate())
+        ]
+        parts.append(bytes([len(self.flash_lines)] + self.flash_lines))
+        for name in POWER_UP_NAMES:
+            power_up = self.power_ups[name]
+            parts.append(SNAPSHOT_POWER_UP.pack(power_up.active, encode_time(power_up.start_time)))
+        parts.append(bytes([len(self.active_power_ups)] +
+                           [POWER_UP_NAMES.index(power_up.type) for power_up in self.active_power_ups]))
+        parts.append(pack_cells(b"".join(self.grid)))
+        return b"".join(parts)
+
+    def restore(self, data):
+        magic, version = SNAPSHOT_HEADER.unpack_from(data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not a bLocKo snapshot, or from an incompatible version")
+        offset = SNAPSHOT_HEADER.size
+
+        (self.game_mode, self.power_ups_enabled, self.can_hold, self.is_game_over,
+         self.is_flashing, self.flash_visible,
+         self.score, self.level, self.lines_cleared, self.combo_count,
+         self.total_flashes, self.pressure_height, self.pressure_level, self.pending_garbage,
+         rng_state,
+         self.drop_interval, self.next_drop_time, self.last_hard_drop_time,
+         lock_timer, start_time, time_limit,
+         self.flash_timer, self.combo_display_time, self.power_up_display_time,
+         self.last_pressure_time, self.pressure_interval, self.lava_height) = SNAPSHOT_STATE.unpack_from(data, offset)
+        offset += SNAPSHOT_STATE.size
+        self.random.setstate(rng_state)
+        self.lock_timer = decode_time(lock_timer)
+        self.start_time = decode_time(start_time)
+        self.time_limit = decode_time(time_limit)
+        if self.time_limit is not None:
+            self.time_limit = int(self.time_limit)
+
+        self.current_block = decode_piece(data, offset)
+        offset += SNAPSHOT_PIECE.size
+        self.hold_block = decode_piece(data, offset)
+        offset += SNAPSHOT_PIECE.size
+        self.piece_queue.setstate(*SNAPSHOT_QUEUE.unpack_from(data, offset))
+        offset += SNAPSHOT_QUEUE.size
+
+        count = data[offset]
+        self.flash_lines = list(data[offset + 1:offset + 1 + count])
+        offset += 1 + count
+
+        for name in POWER_UP_NAMES:
+            active, start_time = SNAPSHOT_POWER_UP.unpack_from(data, offset)
+            offset += SNAPSHOT_POWER_UP.size
+            power_up = self.power_ups[name]
+            power_up.active = active
+            power_up.start_time = decode_time(start_time)
+        count = data[offset]
+        self.active_power_ups = [self.power_ups[POWER_UP_NAMES[i]] for i in data[offset + 1:offset + 1 + count]]
+        offset += 1 + count
+
+        cells, offset = unpack_cells(data, offset)
+        self.grid = [bytearray(cells[y:y + GRID_WIDTH]) for y in range(0, GRID_CELLS, GRID_WIDTH)]
+
+    def test_game_over_condition(self):
+        # Fill the grid to test game over condition
+        for y in range(GRID_HEIGHT):
+            for x in range(GRID_WIDTH):
+                self.grid[y][x] = FLASH_CELL
+
+        # Leave top rows empty
+        for y in range(GRID_HEIGHT, GRID_HEIGHT + BUFFER_ZONE_HEIGHT):
+            for x in range(GRID_WIDTH):
+                self.grid[y][x] = 0
+
+        # Attempt to spawn a new block
+        if not self.spawn_new_block():
+            print("Game over condition working correctly")
+        else:
+            print("Game over condition failed")
+    #Call this method after starting the game to test
+    #engine.test_game_over_condition()
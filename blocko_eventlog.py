@@ -0,0 +1,117 @@
+import functools
+import os
+import random
+import struct
+
+from blocko_core import GRID_WIDTH, POWER_UP_TYPES, ENGINE_EVENTS, EngineEvent, shape_kind
+import blocko_storage
+
+# events.bin: a header, then one fixed-size record per logged event, so a
+# log can be read straight into an array (see EVENT_RECORD_FIELDS). Records
+# are buffered in memory and appended by the BackgroundWriter in batches.
+#
+# Each record carries the game, the tick and a summary of the board after
+# the event. value depends on the event: rows for a clear or garbage, the
+# combo count, or the power-up's index in POWER_UP_TYPES. The piece fields
+# describe the piece that locked and are NO_PIECE otherwise.
+EVENT_LOG_MAGIC = b"BLKE"
+EVENT_LOG_VERSION = 1
+EVENT_LOG_HEADER = struct.Struct("<4sBH")  # magic, version, record size
+EVENT_RECORD = struct.Struct("<QIBBBhBbbBBBBBHI")
+EVENT_RECORD_FIELDS = [
+    ("game", "<u8"), ("tick", "<u4"), ("board", "u1"), ("mode", "u1"), ("event", "u1"), ("value", "<i2"),
+    ("piece", "u1"), ("piece_x", "i1"), ("piece_y", "i1"), ("rotation", "u1"),
+    ("height", "u1"), ("holes", "u1"), ("filled", "u1"), ("level", "u1"), ("lines", "<u2"), ("score", "<u4")
+]
+LOGGED_EVENTS = [
+    EngineEvent.LOCK, EngineEvent.LINE_CLEAR, EngineEvent.COMBO,
+    EngineEvent.POWER_UP, EngineEvent.GARBAGE, EngineEvent.GAME_OVER
+]
+EVENT_CODES = {event: i for i, event in enumerate(ENGINE_EVENTS)}
+POWER_UP_CODES = {name: i for i, name in enumerate(POWER_UP_TYPES)}
+NO_PIECE = 255
+FLUSH_SIZE = 64 * 1024
+
+def board_summary(grid):
+    # Stack height, empty cells with a block somewhere above them, and filled cells
+    height = 0
+    holes = 0
+    filled = 0
+    covered = [False] * GRID_WIDTH
+    for y in range(len(grid) - 1, -1, -1):
+        row = grid[y]
+        empty = row.count(0)
+        if empty == GRID_WIDTH and not height:
+            continue
+        if not height:
+            height = y + 1
+        filled += GRID_WIDTH - empty
+        for x in range(GRID_WIDTH):
+            if row[x]:
+                covered[x] = True
+            elif covered[x]:
+                holes += 1
+    return height, holes, filled
+
+def event_value(event, args):
+    if event == EngineEvent.LINE_CLEAR:
+        return len(args[0]) // GRID_WIDTH
+    if event == EngineEvent.POWER_UP:
+        return POWER_UP_CODES[args[0]]
+    if event in [EngineEvent.COMBO, EngineEvent.GARBAGE]:
+        return args[0]
+    return 0
+
+class EventLog:
+    def __init__(self, writer, path=blocko_storage.EVENT_LOG_FILE):
+        self.writer = writer
+        self.path = path
+        self.buffer = bytearray()
+        self.records = 0
+        # A batch cut short by a crash is trimmed away before anything is appended
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < EVENT_LOG_HEADER.size:
+            writer.submit(lambda: blocko_storage.write_file_atomic(path, b""))
+            self.buffer += EVENT_LOG_HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION, EVENT_RECORD.size)
+        elif (size - EVENT_LOG_HEADER.size) % EVENT_RECORD.size:
+            writer.submit(lambda: os.truncate(path, size - (size - EVENT_LOG_HEADER.size) % EVENT_RECORD.size))
+
+    def watch(self, engines, tick_source, buses=None, game_id=None):
+        # One game id covers every board of a game; any number of games can
+        # be watched at once. Events come from the engines unless other buses
+        # are given, as for online play.
+        game_id = random.getrandbits(64) if game_id is None else game_id
+        for index, events in enumerate(buses or [engine.events for engine in engines]):
+            events.subscribe(LOGGED_EVENTS, functools.partial(self.on_engine_event, game_id, tick_source, engines[index], index))
+
+    def on_engine_event(self, game_id, tick_source, engine, index, event, *args):
+        height, holes, filled = board_summary(engine.grid)
+        if event == EngineEvent.LOCK:
+            block = args[0]
+            kind = shape_kind(block.shape)
+            piece = (NO_PIECE if kind is None else kind, block.grid_x, block.grid_y, block.rotation_state)
+        else:
+            piece = (NO_PIECE, 0, 0, 0)
+        self.buffer += EVENT_RECORD.pack(
+            game_id, tick_source(), index, engine.game_mode, EVENT_CODES[event],
+            event_value(event, args), *piece,
+            height, holes, filled, min(engine.level, 255), min(engine.lines_cleared, 0xFFFF), min(engine.score, 0xFFFFFFFF)
+        )
+        self.records += 1
+        if event == EngineEvent.GAME_OVER or len(self.buffer) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        self.writer.submit(lambda: blocko_storage.append_file(self.path, data))
+
+def read_events(data):
+    # Records of an events.bin file as tuples in EVENT_RECORD order
+    magic, version, record_size = EVENT_LOG_HEADER.unpack_from(data)
+    if magic != EVENT_LOG_MAGIC or version != EVENT_LOG_VERSION or record_size != EVENT_RECORD.size:
+        raise ValueError("Not a version 1 event log")
+    count = (len(data) - EVENT_LOG_HEADER.size) // EVENT_RECORD.size
+    return EVENT_RECORD.iter_unpack(data[EVENT_LOG_HEADER.size:EVENT_LOG_HEADER.size + count * EVENT_RECORD.size])
@@ -0,0 +1,185 @@
+import time
+from collections import deque
+
+# Playfield actions grouped the way latency is reported
+LATENCY_ACTION_TYPES = {
+    "MOVE_LEFT": "move",
+    "MOVE_RIGHT": "move",
+    "SOFT_DROP": "soft_drop",
+    "HARD_DROP": "hard_drop",
+    "ROTATE_LEFT": "rotate",
+    "ROTATE_RIGHT": "rotate",
+    "HOLD": "hold"
+}
+LATENCY_SAMPLES = 1024
+
+# Held-key handling for the playfield: delayed auto shift (DAS), auto repeat
+# rate (ARR) and soft drop. Everything is worked out from how long a key has
+# been held, not from how many frames have passed, so the result is the same
+# at any frame or tick rate.
+
+DEFAULT_DAS = 0.167            # Seconds before a held direction starts repeating
+DEFAULT_ARR = 0.033            # Seconds between repeats; 0 shifts straight to the wall
+DEFAULT_SOFT_DROP_FACTOR = 20  # Soft drop speed as a multiple of gravity; 0 drops instantly
+
+# Values the options menu cycles through
+DAS_PRESETS = [0.050, 0.083, 0.117, 0.133, 0.167, 0.200, 0.267]
+ARR_PRESETS = [0, 0.017, 0.033, 0.050, 0.083]
+SOFT_DROP_FACTOR_PRESETS = [5, 10, 20, 40, 0]
+
+def next_preset(presets, value):
+    if value in presets:
+        return presets[(presets.index(value) + 1) % len(presets)]
+    return presets[0]
+
+class AutoShift:
+    def __init__(self, das=DEFAULT_DAS, arr=DEFAULT_ARR, soft_drop_factor=DEFAULT_SOFT_DROP_FACTOR):
+        self.das = das
+        self.arr = arr
+        self.soft_drop_factor = soft_drop_factor
+        self.reset()
+
+    def reset(self):
+        self.held_directions = []
+        self.held_time = 0.0
+        self.shifts_done = 0
+        self.soft_drop_held = False
+        self.soft_drop_time = 0.0
+
+    def save_state(self):
+        return (list(self.held_directions), self.held_time, self.shifts_done,
+                self.soft_drop_held, self.soft_drop_time)
+
+    def load_state(self, state):
+        held_directions, self.held_time, self.shifts_done, self.soft_drop_held, self.soft_drop_time = state
+        self.held_directions = list(held_directions)
+
+    def press(self, engine, direction):
+        if direction in self.held_directions:
+            self.held_directions.remove(direction)
+        # The most recently pressed direction wins
+        self.held_directions.append(direction)
+        self.held_time = 0.0
+        self.shifts_done = 1
+        engine.move_block(direction, 0)
+
+    def release(self, direction):
+        if direction not in self.held_directions:
+            return
+        was_active = self.held_directions[-1] == direction
+        self.held_directions.remove(direction)
+        if was_active and self.held_directions:
+            # Fall back to the other direction, charging DAS again
+            self.held_time = 0.0
+            self.shifts_done = 1
+
+    def press_soft_drop(self, engine):
+        self.soft_drop_held = True
+        self.soft_drop_time = 0.0
+        if not engine.current_block:
+            return
+        if self.soft_drop_factor == 0:
+            engine.apply_gravity(engine.get_drop_distance())
+        else:
+            engine.move_block(0, -1)
+
+    def release_soft_drop(self):
+        self.soft_drop_held = False
+
+    def shifts_due(self, held_time):
+        if held_time < self.das:
+            return 1
+        if self.arr == 0:
+            return None
+        return 2 + int((held_time - self.das) / self.arr)
+
+    def update(self, engine, delta_time):
+        if not engine.current_block:
+            return
+
+        if self.held_directions:
+            direction = self.held_directions[-1]
+            self.held_time += delta_time
+            due = self.shifts_due(self.held_time)
+            if due is None:
+                while engine.move_block(direction, 0):
+                    pass
+            else:
+                while self.shifts_done < due:
+                    self.shifts_done += 1
+                    if not engine.move_block(direction, 0):
+                        # Against a wall or the stack: keep the timing, skip the rest
+                        self.shifts_done = due
+                        break
+
+        if self.soft_drop_held:
+            if self.soft_drop_factor == 0:
+                engine.apply_gravity(engine.get_drop_distance())
+                return
+            interval = engine.drop_interval / self.soft_drop_factor
+            self.soft_drop_time += delta_time
+            rows = int(self.soft_drop_time / interval)
+            if rows:
+                self.soft_drop_time -= rows * interval
+                engine.apply_gravity(rows)
+
+# Key events stamped with a monotonic high resolution clock when they arrive,
+# for the simulation to consume in order at the moment each one happened
+class InputQueue:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.events = deque()
+        self.last_latency = 0.0
+
+    def push(self, key, modifiers, pressed):
+        self.events.append((self.clock(), key, modifiers, pressed))
+
+    def drain(self, until):
+        events = self.events
+        while events and events[0][0] <= until:
+            event = events.popleft()
+            self.last_latency = self.clock() - event[0]
+            yield event
+
+# Time from a key event arriving to the end of the first frame drawn after it
+# was applied, kept per action type over the most recent samples
+class LatencyTracker:
+    def __init__(self, max_samples=LATENCY_SAMPLES):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.pending = []
+        # Percentiles as of the last samples added, rebuilt only once more arrive
+        self.report = None
+
+    def record_input(self, timestamp, action):
+        action_type = LATENCY_ACTION_TYPES.get(action)
+        if action_type:
+            self.pending.append((timestamp, action_type))
+
+    def frame_presented(self, now):
+        if not self.pending:
+            return
+        for timestamp, action_type in self.pending:
+            samples = self.samples.get(action_type)
+            if samples is None:
+                samples = self.samples[action_type] = deque(maxlen=self.max_samples)
+            samples.append(now - timestamp)
+        self.pending.clear()
+        self.report = None
+
+    def summary(self):
+        if self.report is not None:
+            return self.report
+        report = {}
+        for action_type, samples in self.samples.items():
+            ordered = sorted(samples)
+            count = len(ordered)
+            report[action_type] = {
+                "count": count,
+                "p50": ordered[int(count * 0.50)],
+                "p95": ordered[min(count - 1, int(count * 0.95))],
+                "p99": ordered[min(count - 1, int(count * 0.99))],
+                "max": ordered[-1]
+            }
+        self.report = report
+        return report
@@ -0,0 +1,153 @@
+import bisect
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from blocko_core import EngineEvent
+
+# Counters, gauges and histograms for fleet monitoring, rendered in the
+# Prometheus text format. The game dumps them every METRICS_INTERVAL to a file
+# for a node_exporter textfile collector, or serves the latest dump on a Unix
+# socket, or both.
+
+METRICS_FILE = "metrics.prom"
+METRICS_INTERVAL = 15.0
+FRAME_BUCKETS = [0.001, 0.002, 0.004, 0.008, 0.0167, 0.025, 0.0333, 0.05, 0.1, 0.25]
+WRITE_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0]
+METRIC_EVENTS = [EngineEvent.SPAWN, EngineEvent.LOCK]
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Bucket i counts values up to buckets[i]; the last one is +Inf
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.families = {}
+
+    def counter(self, name, help):
+        self.families[name] = ["counter", help, 0]
+
+    def gauge(self, name, help):
+        self.families[name] = ["gauge", help, 0]
+
+    def histogram(self, name, help, buckets):
+        self.families[name] = ["histogram", help, Histogram(buckets)]
+
+    def inc(self, name, amount=1):
+        self.families[name][2] += amount
+
+    def set(self, name, value):
+        self.families[name][2] = value
+
+    def observe(self, name, value):
+        self.families[name][2].observe(value)
+
+    def render(self):
+        lines = []
+        for name, (kind, help, value) in self.families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                lines.append(f"{name} {value}")
+                continue
+            total = 0
+            for bound, count in zip(value.buckets + ["+Inf"], value.counts):
+                total += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {total}')
+            lines.append(f"{name}_sum {value.sum}")
+            lines.append(f"{name}_count {value.count}")
+        return "\n".join(lines) + "\n"
+
+# The game's own metrics, with the bookkeeping for the rates
+class GameMetrics(Metrics):
+    def __init__(self):
+        super().__init__()
+        self.histogram("blocko_frame_seconds", "Time between the starts of two frames.", FRAME_BUCKETS)
+        self.histogram("blocko_update_seconds", "Time spent in update, including game logic.", FRAME_BUCKETS)
+        self.histogram("blocko_draw_seconds", "Time spent drawing a frame.", FRAME_BUCKETS)
+        self.histogram("blocko_write_seconds", "Duration of each background disk write.", WRITE_BUCKETS)
+        self.counter("blocko_frames_total", "Frames drawn.")
+        self.counter("blocko_locks_total", "Pieces locked.")
+        self.counter("blocko_pieces_total", "Pieces spawned.")
+        self.counter("blocko_games_total", "Games started.")
+        self.gauge("blocko_particles", "Particles alive.")
+        self.gauge("blocko_locks_per_minute", "Pieces locked in the last minute.")
+        self.gauge("blocko_pieces_per_second", "Pieces per second of game time in the current game.")
+        self.gauge("blocko_sound_voices", "Sound voices playing.")
+        self.lock_times = deque()
+        self.game_pieces = 0
+        self.game_start_time = 0.0
+        self.last_frame_start = None
+
+    def start_game(self, game_time=0.0):
+        # Resumed games start counting from where they were suspended
+        self.inc("blocko_games_total")
+        self.game_pieces = 0
+        self.game_start_time = game_time
+
+    def on_engine_event(self, event, *args):
+        if event == EngineEvent.LOCK:
+            self.inc("blocko_locks_total")
+            self.lock_times.append(time.perf_counter())
+        else:
+            self.inc("blocko_pieces_total")
+            self.game_pieces += 1
+
+    def frame_started(self, now):
+        if self.last_frame_start is not None:
+            self.observe("blocko_frame_seconds", now - self.last_frame_start)
+        self.last_frame_start = now
+        self.inc("blocko_frames_total")
+
+    def update_rates(self, now, game_time):
+        while self.lock_times and self.lock_times[0] < now - 60:
+            self.lock_times.popleft()
+        self.set("blocko_locks_per_minute", len(self.lock_times))
+        played = game_time - self.game_start_time
+        self.set("blocko_pieces_per_second", round(self.game_pieces / played, 3) if played > 0 else 0)
+
+# Hands the latest dump to whoever connects, then hangs up
+class MetricsSocket:
+    def __init__(self, path):
+        self.path = path
+        self.text = ""
+        if os.path.exists(path):
+            os.remove(path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        self.thread = threading.Thread(target=self.run, name="blocko-metrics", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    conn.sendall(self.text.encode())
+                except OSError:
+                    pass
+
+    def close(self):
+        try:
+            self.server.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.server.close()
+        self.thread.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
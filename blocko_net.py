@@ -0,0 +1,392 @@
+import argparse
+import functools
+import heapq
+import random
+import socket
+import struct
+import time
+import zlib
+
+from blocko_core import ENGINE_EVENTS, EngineEvent, EventBus, GameMode, PLAYER_ACTIONS
+from blocko_engine import BlockoEngine
+from blocko_input import AutoShift
+from blocko_versus import VersusMatch
+
+# Online versus with input delay and rollback. Both peers run the same
+# deterministic simulation from a shared seed and exchange only their inputs.
+# Local input is scheduled INPUT_DELAY ticks ahead; the other player's input
+# is predicted to stay the same until it arrives. When it arrives and differs
+# from the prediction, the game is restored to the snapshot before that tick
+# and simulated forward again within the same frame.
+
+NET_TICK_RATE = 60
+INPUT_DELAY = 2          # Ticks between a key press and it taking effect, on both screens
+MAX_ROLLBACK = 10        # Ticks a peer may run ahead of the last confirmed input
+INPUT_REDUNDANCY = 32    # Unacknowledged ticks resent in every input packet
+DEFAULT_PORT = 47999
+
+NET_MAGIC = b"BLKN"
+PACKET_HELLO = 1
+PACKET_INPUT = 2
+HELLO_PACKET = struct.Struct("<4sBQ")        # magic, type, seed
+INPUT_HEADER = struct.Struct("<4sBiIB")      # magic, type, ack tick, first tick, count
+
+# A tick's input is one bit per playfield action held during the tick
+ACTION_BITS = {action: 1 << i for i, action in enumerate(PLAYER_ACTIONS)}
+
+def apply_action(engine, auto_shift, action, pressed):
+    if pressed:
+        if action == "MOVE_LEFT":
+            auto_shift.press(engine, -1)
+        elif action == "MOVE_RIGHT":
+            auto_shift.press(engine, 1)
+        elif action == "SOFT_DROP":
+            auto_shift.press_soft_drop(engine)
+        elif action == "HARD_DROP":
+            engine.hard_drop()
+        elif action == "ROTATE_LEFT":
+            engine.rotate_block(False)
+        elif action == "ROTATE_RIGHT":
+            engine.rotate_block(True)
+        elif action == "HOLD":
+            engine.hold_piece()
+    elif action == "MOVE_LEFT":
+        auto_shift.release(-1)
+    elif action == "MOVE_RIGHT":
+        auto_shift.release(1)
+    elif action == "SOFT_DROP":
+        auto_shift.release_soft_drop()
+
+def apply_input(engine, auto_shift, previous_mask, mask):
+    changed = mask ^ previous_mask
+    for action, bit in ACTION_BITS.items():
+        if changed & bit:
+            apply_action(engine, auto_shift, action, mask & bit)
+
+# UDP socket that can hold packets back and drop them, to try the netcode
+# on one machine. Delays are measured on the given clock.
+class UdpTransport:
+    def __init__(self, local_address, remote_address=None, latency=0.0, jitter=0.0, loss=0.0,
+                 clock=time.perf_counter, seed=None):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(local_address)
+        self.sock.setblocking(False)
+        self.remote_address = remote_address
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.outbox = []
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, data):
+        if self.remote_address is None:
+            return
+        self.sent += 1
+        if self.loss and self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay <= 0:
+            self.sock.sendto(data, self.remote_address)
+            return
+        self.sequence += 1
+        heapq.heappush(self.outbox, (self.clock() + delay, self.sequence, data))
+
+    def flush(self):
+        now = self.clock()
+        while self.outbox and self.outbox[0][0] <= now:
+            _, _, data = heapq.heappop(self.outbox)
+            self.sock.sendto(data, self.remote_address)
+
+    def receive(self):
+        self.flush()
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                return
+            if self.remote_address is None:
+                self.remote_address = address
+            yield data
+
+    def close(self):
+        self.sock.close()
+
+def handshake(transport, seed=None, timeout=30.0):
+    # The host (seed given) answers every HELLO with the game seed; the
+    # joining side keeps asking until it gets one
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if seed is None:
+            transport.send(HELLO_PACKET.pack(NET_MAGIC, PACKET_HELLO, 0))
+        for data in transport.receive():
+            if len(data) != HELLO_PACKET.size:
+                continue
+            magic, packet_type, remote_seed = HELLO_PACKET.unpack(data)
+            if magic != NET_MAGIC or packet_type != PACKET_HELLO:
+                continue
+            if seed is not None:
+                transport.send(HELLO_PACKET.pack(NET_MAGIC, PACKET_HELLO, seed))
+                return seed
+            return remote_seed
+        time.sleep(0.05)
+    raise TimeoutError("No answer from the other player")
+
+class RollbackSession:
+    def __init__(self, transport, local_player, seed, game_mode=GameMode.VERSUS,
+                 power_ups_enabled=False, input_delay=INPUT_DELAY):
+        self.transport = transport
+        self.local_player = local_player
+        self.remote_player = 1 - local_player
+        self.seed = seed
+        self.input_delay = input_delay
+        self.step = 1 / NET_TICK_RATE
+        self.tick = 0
+        self.engines = []
+        for index in range(2):
+            engine = BlockoEngine(game_mode, power_ups_enabled, clock=self.get_time, seed=seed)
+            engine.events.subscribe(ENGINE_EVENTS, functools.partial(self.on_engine_event, index))
+            self.engines.append(engine)
+        self.auto_shifts = [AutoShift(), AutoShift()]
+        self.match = VersusMatch(self.engines)
+        self.game_over_tick = None
+        # Events of each board, minus those from ticks being simulated over
+        self.events = [EventBus(), EventBus()]
+        self.resimulating = False
+
+        # Inputs by tick; the first input_delay ticks have none on either side
+        self.inputs = [{tick: 0 for tick in range(input_delay)} for _ in range(2)]
+        self.applied = [{}, {}]
+        self.confirmed_tick = input_delay - 1
+        self.acked_tick = input_delay - 1
+        self.snapshots = {}
+        self.checksums = {}
+        self.rollback_from = None
+
+        self.rollbacks = 0
+        self.resimulated_ticks = 0
+        self.last_rollback_time = 0.0
+        self.max_rollback_time = 0.0
+        self.stalls = 0
+
+        for engine in self.engines:
+            engine.start()
+
+    def get_time(self):
+        return self.tick * self.step
+
+    def on_engine_event(self, index, event, *args):
+        if event == EngineEvent.GAME_OVER and self.game_over_tick is None:
+            self.game_over_tick = self.tick
+        # Effects are shown once, not again when a tick is simulated over
+        if not self.resimulating:
+            self.events[index].emit(event, *args)
+
+    def finished(self):
+        # Only a game over that no late input can undo
+        return self.game_over_tick is not None and self.game_over_tick <= self.confirmed_tick
+
+    def save(self):
+        return (
+            [engine.snapshot() for engine in self.engines],
+            [auto_shift.save_state() for auto_shift in self.auto_shifts],
+            self.match.winner, list(self.match.garbage_sent), self.game_over_tick
+        )
+
+    def load(self, state):
+        engine_states, auto_shift_states, self.match.winner, garbage_sent, self.game_over_tick = state
+        for engine, data in zip(self.engines, engine_states):
+            engine.restore(data)
+        for auto_shift, auto_shift_state in zip(self.auto_shifts, auto_shift_states):
+            auto_shift.load_state(auto_shift_state)
+        self.match.garbage_sent = list(garbage_sent)
+
+    def input_for(self, player, tick):
+        inputs = self.inputs[player]
+        if tick in inputs:
+            return inputs[tick]
+        # Not here yet: assume the last input we have is still held
+        return inputs.get(self.confirmed_tick, 0) if player == self.remote_player else 0
+
+    def simulate_tick(self):
+        tick = self.tick
+        self.snapshots[tick] = self.save()
+        self.snapshots.pop(tick - MAX_ROLLBACK - 2, None)
+        for player in range(2):
+            mask = self.input_for(player, tick)
+            self.applied[player][tick] = mask
+            self.applied[player].pop(tick - MAX_ROLLBACK - 2, None)
+            apply_input(self.engines[player], self.auto_shifts[player],
+                        self.applied[player].get(tick - 1, 0), mask)
+        for engine, auto_shift in zip(self.engines, self.auto_shifts):
+            auto_shift.update(engine, self.step)
+            engine.update(self.step)
+        self.tick += 1
+
+    def advance(self, local_mask):
+        # One tick of local time; False if the peer is too far behind to go on
+        self.poll()
+        # A tick's input may already have been sent while stalled; it must not change
+        self.inputs[self.local_player].setdefault(self.tick + self.input_delay, local_mask)
+        self.inputs[self.local_player].pop(self.tick - MAX_ROLLBACK - INPUT_REDUNDANCY, None)
+        self.send_inputs()
+        if self.tick - self.confirmed_tick > MAX_ROLLBACK:
+            self.stalls += 1
+            return False
+        self.simulate_tick()
+        return True
+
+    def poll(self):
+        for data in self.transport.receive():
+            self.handle_packet(data)
+        if self.rollback_from is not None:
+            self.roll_back(max(self.rollback_from, min(self.snapshots)))
+            self.rollback_from = None
+        self.record_checksums()
+
+    def handle_packet(self, data):
+        if len(data) == HELLO_PACKET.size:
+            # The other side missed our HELLO and is still asking for the seed
+            if self.local_player == 0:
+                self.transport.send(HELLO_PACKET.pack(NET_MAGIC, PACKET_HELLO, self.seed))
+            return
+        if len(data) < INPUT_HEADER.size:
+            return
+        magic, packet_type, ack_tick, first_tick, count = INPUT_HEADER.unpack_from(data)
+        if magic != NET_MAGIC or packet_type != PACKET_INPUT:
+            return
+        self.acked_tick = max(self.acked_tick, ack_tick)
+        inputs = self.inputs[self.remote_player]
+        applied = self.applied[self.remote_player]
+        for i, mask in enumerate(data[INPUT_HEADER.size:INPUT_HEADER.size + count]):
+            tick = first_tick + i
+            # Confirmed ticks are final; a late duplicate may outlive their inputs and snapshots
+            if tick <= self.confirmed_tick or tick in inputs:
+                continue
+            inputs[tick] = mask
+            # Simulated with a wrong guess: replay from there
+            if tick < self.tick and applied.get(tick) != mask:
+                if self.rollback_from is None or tick < self.rollback_from:
+                    self.rollback_from = tick
+        while self.confirmed_tick + 1 in inputs:
+            self.confirmed_tick += 1
+        inputs.pop(self.confirmed_tick - MAX_ROLLBACK - INPUT_REDUNDANCY, None)
+
+    def send_inputs(self):
+        inputs = self.inputs[self.local_player]
+        first_tick = self.acked_tick + 1
+        last_tick = min(self.tick + self.input_delay, first_tick + INPUT_REDUNDANCY - 1)
+        masks = bytes(inputs.get(tick, 0) for tick in range(first_tick, last_tick + 1))
+        self.transport.send(INPUT_HEADER.pack(NET_MAGIC, PACKET_INPUT, self.confirmed_tick,
+                                              first_tick, len(masks)) + masks)
+
+    def roll_back(self, tick):
+        start = time.perf_counter()
+        target = self.tick
+        self.load(self.snapshots[tick])
+        self.tick = tick
+        self.resimulating = True
+        try:
+            while self.tick < target:
+                self.simulate_tick()
+        finally:
+            self.resimulating = False
+        self.rollbacks += 1
+        self.resimulated_ticks += target - tick
+        self.last_rollback_time = time.perf_counter() - start
+        self.max_rollback_time = max(self.max_rollback_time, self.last_rollback_time)
+
+    def record_checksums(self):
+        # State at the start of a tick is final once every input before it is known
+        last = min(self.confirmed_tick + 1, self.tick - 1)
+        first = max(self.checksums, default=-1) + 1
+        for tick in range(first, last + 1):
+            if tick in self.snapshots:
+                self.checksums[tick] = zlib.crc32(b"".join(self.snapshots[tick][0]))
+
+    def close(self):
+        self.transport.close()
+
+def open_session(host_port=None, join_address=None, timeout=300.0):
+    # Host (player one) or join (player two) an online game; blocks until
+    # the other side answers
+    if host_port is not None:
+        transport = UdpTransport(("0.0.0.0", host_port))
+        print(f"Waiting for another player on port {host_port}...")
+        seed = handshake(transport, random.getrandbits(64), timeout)
+        return RollbackSession(transport, 0, seed)
+    host, _, port = join_address.partition(":")
+    transport = UdpTransport(("0.0.0.0", 0), (host, int(port or DEFAULT_PORT)))
+    print(f"Joining {host}:{port or DEFAULT_PORT}...")
+    seed = handshake(transport, timeout=timeout)
+    return RollbackSession(transport, 1, seed)
+
+def run_loopback(ticks, latency, jitter, loss, seed):
+    # Two sessions in one process, each pressing random keys, over real UDP
+    # sockets on 127.0.0.1 with simulated latency and loss
+    now = [0.0]
+    clock = lambda: now[0]
+    host = UdpTransport(("127.0.0.1", 0), latency=latency, jitter=jitter, loss=loss, clock=clock, seed=1)
+    guest = UdpTransport(("127.0.0.1", 0), host.sock.getsockname(), latency, jitter, loss, clock, seed=2)
+    host.remote_address = guest.sock.getsockname()
+    sessions = [RollbackSession(host, 0, seed), RollbackSession(guest, 1, seed)]
+    bots = [random.Random(seed + 1), random.Random(seed + 2)]
+    masks = [0, 0]
+    frame_times = []
+    frame = 0
+    while min(session.tick for session in sessions) < ticks and frame < ticks * 10:
+        frame += 1
+        now[0] = frame / NET_TICK_RATE
+        for index, session in enumerate(sessions):
+            if bots[index].random() < 0.1:
+                masks[index] = bots[index].getrandbits(len(PLAYER_ACTIONS)) & bots[index].getrandbits(len(PLAYER_ACTIONS))
+            start = time.perf_counter()
+            session.advance(masks[index])
+            frame_times.append(time.perf_counter() - start)
+        time.sleep(0)
+
+    # Let the last inputs arrive, then compare the confirmed history
+    for _ in range(int((latency + jitter) * NET_TICK_RATE) + 2 * MAX_ROLLBACK):
+        frame += 1
+        now[0] = frame / NET_TICK_RATE
+        time.sleep(0.001)
+        for session in sessions:
+            session.poll()
+            session.send_inputs()
+    common = sorted(set(sessions[0].checksums) & set(sessions[1].checksums))
+    mismatched = [tick for tick in common if sessions[0].checksums[tick] != sessions[1].checksums[tick]]
+
+    frame_times.sort()
+    for index, session in enumerate(sessions):
+        print(f"Player {index + 1}: tick {session.tick}, {session.rollbacks} rollbacks, "
+              f"{session.resimulated_ticks} ticks resimulated, worst rollback "
+              f"{session.max_rollback_time * 1000:.2f} ms, {session.stalls} stalled frames, "
+              f"{session.transport.dropped}/{session.transport.sent} packets dropped")
+    print(f"Frame time p50 {frame_times[len(frame_times) // 2] * 1000:.2f} ms, "
+          f"p99 {frame_times[int(len(frame_times) * 0.99)] * 1000:.2f} ms, "
+          f"max {frame_times[-1] * 1000:.2f} ms")
+    if mismatched:
+        print(f"DESYNC: {len(mismatched)} of {len(common)} confirmed ticks differ, first at tick {mismatched[0]}")
+    else:
+        print(f"In sync over {len(common)} confirmed ticks")
+    for session in sessions:
+        session.close()
+    return not mismatched
+
+def main():
+    parser = argparse.ArgumentParser(description="Try bLocKo rollback netcode over the loopback interface")
+    parser.add_argument("--ticks", type=int, default=3600)
+    parser.add_argument("--latency", type=float, default=0.05, help="One-way delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Extra random delay in seconds")
+    parser.add_argument("--loss", type=float, default=0.05, help="Fraction of packets dropped")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not run_loopback(args.ticks, args.latency, args.jitter, args.loss, args.seed):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+import argparse
+import bisect
+import mmap
+import os
+import struct
+
+from blocko_core import PLAYER_ACTIONS, EngineEvent, FixedTimestep
+from blocko_engine import BlockoEngine
+from blocko_input import AutoShift
+from blocko_net import ACTION_BITS, apply_action
+import blocko_storage
+
+# Archive of finished games. replays.bin holds one record per game, only ever
+# appended to; replays.idx holds a fixed-size INDEX_ENTRY per record (game id,
+# offset, size), so any game is found without reading the others. Readers map
+# both files with mmap and only touch the records they look at.
+#
+# A record is REPLAY_HEADER with the settings and final stats, then the input
+# stream (one INPUT_RECORD per press or release, by tick), then the keyframe
+# table and the keyframes. A keyframe is the auto shift state and an engine
+# snapshot at a tick boundary, taken every KEYFRAME_PIECES pieces, so a game
+# can be picked up at any piece by restoring the keyframe before it and
+# playing the inputs forward.
+#
+# Ticks follow the window: inputs recorded at tick t are applied after t
+# ticks have run, and the engine clock reads t / tick_rate while they are.
+# The header's tick count is the boundary the recording stopped at, by a game
+# over or by saving a running game; its inputs are applied, then play stops.
+REPLAY_MAGIC = b"BLKR"
+REPLAY_INDEX_MAGIC = b"BLKX"
+REPLAY_VERSION = 3  # Keyframes hold version 4 engine snapshots
+ARCHIVE_HEADER = struct.Struct("<4sB")  # magic, version; starts both files
+REPLAY_HEADER = struct.Struct("<QQB?HdddIIQHIIH")
+REPLAY_HEADER_FIELDS = [
+    ("game", "<u8"), ("seed", "<u8"), ("mode", "u1"), ("power_ups", "?"), ("tick_rate", "<u2"),
+    ("das", "<f8"), ("arr", "<f8"), ("soft_drop_factor", "<f8"),
+    ("ticks", "<u4"), ("pieces", "<u4"), ("score", "<u8"), ("level", "<u2"), ("lines", "<u4"),
+    ("inputs", "<u4"), ("keyframes", "<u2")
+]
+INDEX_ENTRY = struct.Struct("<QQI")  # game id, offset, size
+INDEX_ENTRY_FIELDS = [("game", "<u8"), ("offset", "<u8"), ("size", "<u4")]
+INPUT_RECORD = struct.Struct("<IB")  # tick, action index | INPUT_PRESSED
+KEYFRAME_ENTRY = struct.Struct("<IIII")  # tick, pieces spawned, inputs before it, size
+AUTO_SHIFT_STATE = struct.Struct("<bbdI?d")
+INPUT_PRESSED = 0x80
+ACTION_CODES = {action: i for i, action in enumerate(PLAYER_ACTIONS)}
+KEYFRAME_PIECES = 10
+
+def index_path_for(path):
+    return os.path.splitext(path)[0] + ".idx"
+
+def pack_auto_shift(auto_shift):
+    held_time, shifts_done, soft_drop_held, soft_drop_time = auto_shift.save_state()[1:]
+    directions = auto_shift.held_directions + [0, 0]
+    return AUTO_SHIFT_STATE.pack(directions[0], directions[1], held_time, shifts_done, soft_drop_held, soft_drop_time)
+
+def unpack_auto_shift(data):
+    first, second, *state = AUTO_SHIFT_STATE.unpack_from(data)
+    return ([direction for direction in [first, second] if direction], *state)
+
+# Records one board as it is played; finish() returns the archive record
+class ReplayRecorder:
+    def __init__(self, engine, auto_shift, game_id, seed, tick_rate):
+        self.engine = engine
+        self.auto_shift = auto_shift
+        self.game_id = game_id
+        self.seed = seed
+        self.tick_rate = tick_rate
+        self.tick = 0
+        self.pieces = 0
+        self.inputs = bytearray()
+        self.input_count = 0
+        self.keyframes = []
+        self.keyframe_data = []
+        self.next_keyframe_piece = 0
+        engine.events.subscribe([EngineEvent.SPAWN], self.on_spawn)
+
+    def on_spawn(self, event, *args):
+        self.pieces += 1
+
+    def start(self):
+        # Once the engine has started; the first keyframe is where playback begins
+        self.add_keyframe()
+
+    def record_input(self, action, pressed):
+        self.inputs += INPUT_RECORD.pack(self.tick, ACTION_CODES[action] | (INPUT_PRESSED if pressed else 0))
+        self.input_count += 1
+
+    def record_mask(self, previous_mask, mask):
+        # Same order as blocko_net.apply_input
+        changed = mask ^ previous_mask
+        for action, bit in ACTION_BITS.items():
+            if changed & bit:
+                self.record_input(action, mask & bit)
+
+    def end_tick(self):
+        self.tick += 1
+        if self.pieces >= self.next_keyframe_piece:
+            self.add_keyframe()
+
+    def add_keyframe(self):
+        data = pack_auto_shift(self.auto_shift) + self.engine.snapshot()
+        self.keyframes.append(KEYFRAME_ENTRY.pack(self.tick, self.pieces, self.input_count, len(data)))
+        self.keyframe_data.append(data)
+        self.next_keyframe_piece = self.pieces + KEYFRAME_PIECES
+
+    def finish(self):
+        engine = self.engine
+        auto_shift = self.auto_shift
+        header = REPLAY_HEADER.pack(
+            self.game_id, self.seed, engine.game_mode, engine.power_ups_enabled, self.tick_rate,
+            auto_shift.das, auto_shift.arr, auto_shift.soft_drop_factor,
+            self.tick, self.pieces, engine.score, engine.level, engine.lines_cleared,
+            self.input_count, len(self.keyframes)
+        )
+        return b"".join([header, self.inputs] + self.keyframes + self.keyframe_data)
+
+# Appends finished games through the BackgroundWriter, which owns both files
+class ReplayWriter:
+    def __init__(self, writer, path=blocko_storage.REPLAY_FILE):
+        self.writer = writer
+        self.path = path
+        self.index_path = index_path_for(path)
+        self.games = 0
+        writer.submit(self.prepare)
+
+    def prepare(self):
+        # New files get their headers; an index entry cut short by a crash is
+        # trimmed. A record whose entry never made it is left unreferenced.
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < ARCHIVE_HEADER.size:
+            blocko_storage.write_file_atomic(self.path, ARCHIVE_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION))
+            blocko_storage.write_file_atomic(self.index_path, ARCHIVE_HEADER.pack(REPLAY_INDEX_MAGIC, REPLAY_VERSION))
+            return
+        size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        if size < ARCHIVE_HEADER.size:
+            blocko_storage.write_file_atomic(self.index_path, ARCHIVE_HEADER.pack(REPLAY_INDEX_MAGIC, REPLAY_VERSION))
+        elif (size - ARCHIVE_HEADER.size) % INDEX_ENTRY.size:
+            os.truncate(self.index_path, size - (size - ARCHIVE_HEADER.size) % INDEX_ENTRY.size)
+
+    def append(self, recorder):
+        data = recorder.finish()
+        game_id = recorder.game_id
+        self.games += 1
+        self.writer.submit(lambda: self.write(game_id, data))
+
+    def write(self, game_id, data):
+        offset = os.path.getsize(self.path)
+        blocko_storage.append_file(self.path, data)
+        blocko_storage.append_file(self.index_path, INDEX_ENTRY.pack(game_id, offset, len(data)))
+
+# One record, read in place. Only the header is unpacked up front.
+class Replay:
+    def __init__(self, data, offset=0):
+        (self.game_id, self.seed, self.game_mode, self.power_ups_enabled, self.tick_rate,
+         self.das, self.arr, self.soft_drop_factor,
+         self.ticks, self.pieces, self.score, self.level, self.lines,
+         self.input_count, self.keyframe_count) = REPLAY_HEADER.unpack_from(data, offset)
+        self.data = data
+        self.inputs_offset = offset + REPLAY_HEADER.size
+        self.keyframes_offset = self.inputs_offset + self.input_count * INPUT_RECORD.size
+
+    def inputs(self):
+        return list(INPUT_RECORD.iter_unpack(self.data[self.inputs_offset:self.keyframes_offset]))
+
+    def keyframes(self):
+        # (tick, pieces, input index, offset, size) of every keyframe, oldest first
+        keyframes = []
+        offset = self.keyframes_offset + self.keyframe_count * KEYFRAME_ENTRY.size
+        for i in range(self.keyframe_count):
+            tick, pieces, input_index, size = KEYFRAME_ENTRY.unpack_from(self.data, self.keyframes_offset + i * KEYFRAME_ENTRY.size)
+            keyframes.append((tick, pieces, input_index, offset, size))
+            offset += size
+        return keyframes
+
+class ReplayArchive:
+    def __init__(self, path=blocko_storage.REPLAY_FILE):
+        self.files = [open(path, "rb"), open(index_path_for(path), "rb")]
+        self.data, self.index = [mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) for f in self.files]
+        for data, magic in [(self.data, REPLAY_MAGIC), (self.index, REPLAY_INDEX_MAGIC)]:
+            if ARCHIVE_HEADER.unpack_from(data) != (magic, REPLAY_VERSION):
+                raise ValueError(f"Not a version {REPLAY_VERSION} replay archive")
+        self.count = (len(self.index) - ARCHIVE_HEADER.size) // INDEX_ENTRY.size
+        self.positions = None
+
+    def __len__(self):
+        return self.count
+
+    def entry(self, position):
+        return INDEX_ENTRY.unpack_from(self.index, ARCHIVE_HEADER.size + position * INDEX_ENTRY.size)
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError("No such replay")
+        return Replay(self.data, self.entry(position)[1])
+
+    def find(self, game_id):
+        # The id -> position table is built on the first lookup
+        if self.positions is None:
+            self.positions = {self.entry(position)[0]: position for position in range(self.count)}
+        return self[self.positions[game_id]]
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield Replay(self.data, self.entry(position)[1])
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+        for f in self.files:
+            f.close()
+
+# Plays a replay back on a headless engine, from its first keyframe or from
+# the keyframe before any piece
+class ReplayPlayer:
+    def __init__(self, replay):
+        self.replay = replay
+        self.input_list = replay.inputs()
+        self.keyframe_list = replay.keyframes()
+        self.step = FixedTimestep(replay.tick_rate).step
+        self.tick = 0
+        self.pieces = 0
+        self.input_index = 0
+        self.engine = BlockoEngine(replay.game_mode, replay.power_ups_enabled, clock=self.get_time, seed=replay.seed)
+        self.engine.events.subscribe([EngineEvent.SPAWN], self.on_spawn)
+        self.auto_shift = AutoShift(replay.das, replay.arr, replay.soft_drop_factor)
+        self.load_keyframe(0)
+
+    def get_time(self):
+        return self.tick * self.step
+
+    def on_spawn(self, event, *args):
+        self.pieces += 1
+
+    def load_keyframe(self, i):
+        self.tick, self.pieces, self.input_index, offset, size = self.keyframe_list[i]
+        data = self.replay.data[offset:offset + size]
+        self.auto_shift.load_state(unpack_auto_shift(data))
+        self.engine.restore(data[AUTO_SHIFT_STATE.size:])
+
+    def advance(self):
+        # The inputs due at this tick boundary, then one tick unless the
+        # recording ended here, by a game over or by saving a running game
+        inputs = self.input_list
+        while self.input_index < len(inputs) and inputs[self.input_index][0] <= self.tick:
+            code = inputs[self.input_index][1]
+            apply_action(self.engine, self.auto_shift, PLAYER_ACTIONS[code & ~INPUT_PRESSED], code & INPUT_PRESSED)
+            self.input_index += 1
+        if self.engine.is_game_over or self.tick >= self.replay.ticks:
+            return False
+        self.tick += 1
+        self.auto_shift.update(self.engine, self.step)
+        self.engine.update(self.step)
+        return not self.engine.is_game_over
+
+    def seek_piece(self, piece):
+        # Stops at the first tick boundary with the piece on the board
+        pieces = [keyframe[1] for keyframe in self.keyframe_list]
+        self.load_keyframe(max(bisect.bisect_right(pieces, piece) - 1, 0))
+        while self.pieces < piece and self.advance():
+            pass
+
+    def play(self):
+        while self.advance():
+            pass
+        return self.engine
+
+def main():
+    parser = argparse.ArgumentParser(description="List, check or inspect bLocKo replays")
+    parser.add_argument("archive", nargs="?", default=blocko_storage.REPLAY_FILE)
+    parser.add_argument("--game", type=lambda value: int(value, 16), help="game id in hex")
+    parser.add_argument("--piece", type=int, help="show the board when this piece spawned")
+    parser.add_argument("--verify", action="store_true", help="play every game and compare the final score")
+    args = parser.parse_args()
+    archive = ReplayArchive(args.archive)
+    replays = [archive.find(args.game)] if args.game is not None else archive
+    mismatches = 0
+    for replay in replays:
+        print(f"{replay.game_id:016x}: mode {replay.game_mode}, score {replay.score}, level {replay.level}, "
+              f"lines {replay.lines}, {replay.pieces} pieces, {replay.ticks / replay.tick_rate:.1f} s, "
+              f"{replay.input_count} inputs, {replay.keyframe_count} keyframes")
+        if args.verify:
+            engine = ReplayPlayer(replay).play()
+            if (engine.score, engine.lines_cleared) != (replay.score, replay.lines):
+                mismatches += 1
+                print(f"  Replayed to score {engine.score}, lines {engine.lines_cleared}")
+        if args.piece is not None:
+            player = ReplayPlayer(replay)
+            player.seek_piece(args.piece)
+            for row in reversed(player.engine.grid):
+                print("  " + "".join("#" if cell else "." for cell in row))
+    if args.verify:
+        print(f"{len(replays) - mismatches} of {len(replays)} replays match")
+    archive.close()
+
+if __name__ == "__main__":
+    main()
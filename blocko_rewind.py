@@ -0,0 +1,81 @@
+import struct
+from collections import deque
+
+# Undo/redo history for practice mode. One state is recorded per piece, and
+# only the bytes that changed since the previous state are kept: a lock
+# touches five cells plus any cleared rows, a few counters and the pieces.
+# Changes are stored as XOR runs, so the same patch takes a state one step
+# back or one step forward.
+
+REWIND_CAPACITY = 10000  # Pieces kept; the oldest are forgotten first
+PATCH_HEADER = struct.Struct("<HH")  # Length before and after
+PATCH_RUN = struct.Struct("<HB")     # Offset and length of a changed run
+
+def make_patch(old, new):
+    size = max(len(old), len(new))
+    diff = (int.from_bytes(old.ljust(size, b"\0"), "little") ^
+            int.from_bytes(new.ljust(size, b"\0"), "little")).to_bytes(size, "little")
+    parts = [PATCH_HEADER.pack(len(old), len(new))]
+    i = 0
+    while i < size:
+        if diff[i] == 0:
+            i += 1
+            continue
+        start = i
+        while i < size and i - start < 255 and (diff[i] or (i + 1 < size and diff[i + 1])):
+            i += 1
+        parts.append(PATCH_RUN.pack(start, i - start))
+        parts.append(diff[start:i])
+    return b"".join(parts)
+
+def apply_patch(state, patch):
+    # Works in both directions: the result has whichever length state did not
+    old_length, new_length = PATCH_HEADER.unpack_from(patch, 0)
+    size = max(old_length, new_length)
+    data = bytearray(state.ljust(size, b"\0"))
+    offset = PATCH_HEADER.size
+    while offset < len(patch):
+        start, length = PATCH_RUN.unpack_from(patch, offset)
+        offset += PATCH_RUN.size
+        for i in range(length):
+            data[start + i] ^= patch[offset + i]
+        offset += length
+    return bytes(data[:new_length if len(state) == old_length else old_length])
+
+class RewindBuffer:
+    def __init__(self, capacity=REWIND_CAPACITY):
+        self.state = None
+        self.undo_patches = deque(maxlen=capacity)
+        self.redo_patches = []
+
+    def clear(self):
+        self.state = None
+        self.undo_patches.clear()
+        self.redo_patches.clear()
+
+    def record(self, state):
+        if self.state is not None:
+            if state == self.state:
+                return
+            self.undo_patches.append(make_patch(self.state, state))
+        self.state = state
+        self.redo_patches.clear()
+
+    def undo(self):
+        if not self.undo_patches:
+            return None
+        patch = self.undo_patches.pop()
+        self.state = apply_patch(self.state, patch)
+        self.redo_patches.append(patch)
+        return self.state
+
+    def redo(self):
+        if not self.redo_patches:
+            return None
+        patch = self.redo_patches.pop()
+        self.state = apply_patch(self.state, patch)
+        self.undo_patches.append(patch)
+        return self.state
+
+    def memory_used(self):
+        return sum(len(patch) for patch in self.undo_patches) + sum(len(patch) for patch in self.redo_patches)
@@ -0,0 +1,358 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import time
+from collections import deque
+
+from blocko_core import FixedTimestep, GameMode
+from blocko_delta import DELTA_EVENTS, BoardMirror, DeltaEncoder
+from blocko_engine import BlockoEngine
+from blocko_eventlog import EventLog
+from blocko_input import AutoShift
+from blocko_net import ACTION_BITS, NET_TICK_RATE, apply_input
+from blocko_replay import ReplayRecorder, ReplayWriter
+import blocko_storage
+
+# Authoritative games for many players at once, all in one asyncio event loop
+# per process. Clients send the actions they hold; the server runs the rules
+# and answers with what changed since the last message it sent them.
+#
+# Messages are JSON, one per line. Client to server:
+#   {"join": "marathon", "power_ups": true}   start a game (marathon, sprint, ultra, pressure)
+#   {"input": 5}                               bitmask of held actions, see blocko_net.ACTION_BITS
+# The server answers with the deltas described in blocko_delta.
+#
+# With --replays, every game that ends is added to a replay archive (see
+# blocko_replay), and with --event-log every game's events are logged (see
+# blocko_eventlog); each worker process has files of its own.
+
+SERVER_PORT = 48000
+SERVER_MODES = {
+    "marathon": GameMode.MARATHON,
+    "sprint": GameMode.SPRINT,
+    "ultra": GameMode.ULTRA,
+    "pressure": GameMode.PRESSURE
+}
+SLOW_CLIENT_BUFFER = 64 * 1024  # Skip sending to a client this far behind; the next delta catches it up
+STATS_INTERVAL = 10.0
+
+class ServerGame:
+    def __init__(self, game_mode, power_ups_enabled, seed, writer, replay_writer=None, event_log=None):
+        self.writer = writer
+        self.replay_writer = replay_writer
+        self.game_id = random.getrandbits(64)
+        self.tick = 0
+        self.step = 1 / NET_TICK_RATE
+        self.engine = BlockoEngine(game_mode, power_ups_enabled, clock=self.get_time, seed=seed)
+        self.auto_shift = AutoShift()
+        self.held_mask = 0
+        self.tapped_mask = 0
+        self.applied_mask = 0
+        self.encoder = DeltaEncoder(self.engine)
+        self.engine.events.subscribe(DELTA_EVENTS, self.encoder.on_engine_event)
+        self.finished = False
+        self.recorder = None
+        if replay_writer:
+            self.recorder = ReplayRecorder(self.engine, self.auto_shift, self.game_id, seed, NET_TICK_RATE)
+        if event_log:
+            event_log.watch([self.engine], self.get_tick, game_id=self.game_id)
+        self.engine.start()
+        if self.recorder:
+            self.recorder.start()
+
+    def get_time(self):
+        return self.tick * self.step
+
+    def get_tick(self):
+        return self.tick
+
+    def set_input(self, mask):
+        # A press and release between two ticks still counts as a press
+        self.tapped_mask |= mask & ~self.held_mask
+        self.held_mask = mask
+
+    def update(self):
+        mask = self.held_mask | self.tapped_mask
+        self.tapped_mask = 0
+        if self.recorder:
+            self.recorder.record_mask(self.applied_mask, mask)
+        apply_input(self.engine, self.auto_shift, self.applied_mask, mask)
+        self.applied_mask = mask
+        # The clock reads the end of the tick being run, as in the window
+        self.tick += 1
+        self.auto_shift.update(self.engine, self.step)
+        self.engine.update(self.step)
+        if not self.recorder:
+            return
+        self.recorder.end_tick()
+        if self.engine.is_game_over:
+            self.replay_writer.append(self.recorder)
+            self.recorder = None
+
+    def close(self):
+        # A game its player left, or that was cut short by shutdown, is saved as far as it got
+        if self.recorder:
+            self.replay_writer.append(self.recorder)
+            self.recorder = None
+
+    def delta(self):
+        message = self.encoder.encode(self.tick)
+        self.finished = self.engine.is_game_over
+        return message
+
+class MatchServer:
+    def __init__(self, tick_rate=NET_TICK_RATE, replay_path=None, event_log_path=None):
+        self.games = {}
+        self.writer = blocko_storage.BackgroundWriter()
+        self.replay_writer = ReplayWriter(self.writer, replay_path) if replay_path else None
+        self.event_log = EventLog(self.writer, event_log_path) if event_log_path else None
+        self.timestep = FixedTimestep(tick_rate)
+        self.tick_durations = deque(maxlen=1000)
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.skipped_sends = 0
+        self.server = None
+
+    async def handle_client(self, reader, writer):
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if "join" in message:
+                    mode = SERVER_MODES.get(message["join"])
+                    if mode is None:
+                        self.send(writer, {"error": f"Unknown mode {message['join']}"})
+                        continue
+                    seed = message.get("seed")
+                    if seed is None:
+                        seed = random.getrandbits(64)
+                    # Joining again ends the game already on this connection, saving it
+                    game = self.games.pop(writer, None)
+                    if game:
+                        game.close()
+                    self.games[writer] = ServerGame(mode, message.get("power_ups", True), seed, writer,
+                                                    self.replay_writer, self.event_log)
+                elif "input" in message and writer in self.games:
+                    self.games[writer].set_input(int(message["input"]))
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        finally:
+            # Cancellation at shutdown goes on up once the game is saved
+            game = self.games.pop(writer, None)
+            if game:
+                game.close()
+            writer.close()
+
+    def send(self, writer, message):
+        data = (json.dumps(message, separators=(",", ":")) + "\n").encode()
+        writer.write(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def run_ticks(self, ticks):
+        start = time.perf_counter()
+        games = list(self.games.values())
+        for _ in range(ticks):
+            for game in games:
+                if not game.finished:
+                    game.update()
+        for game in games:
+            if game.writer.transport.get_write_buffer_size() > SLOW_CLIENT_BUFFER:
+                self.skipped_sends += 1
+                continue
+            message = game.delta()
+            if message:
+                self.send(game.writer, message)
+            if game.finished:
+                self.games.pop(game.writer, None)
+        self.tick_durations.append(time.perf_counter() - start)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        last_time = loop.time()
+        next_stats = last_time + STATS_INTERVAL
+        while True:
+            await asyncio.sleep(self.timestep.step)
+            now = loop.time()
+            ticks = self.timestep.advance(now - last_time)
+            last_time = now
+            if ticks:
+                self.run_ticks(ticks)
+            if now >= next_stats:
+                next_stats = now + STATS_INTERVAL
+                self.print_stats()
+
+    def print_stats(self):
+        durations = sorted(self.tick_durations)
+        if not durations:
+            return
+        print(f"[{os.getpid()}] {len(self.games)} games, update p50 {durations[len(durations) // 2] * 1000:.2f} ms, "
+              f"p99 {durations[int(len(durations) * 0.99)] * 1000:.2f} ms, {self.timestep.dropped_ticks} ticks dropped, "
+              f"{self.messages_sent} messages, {self.bytes_sent // 1024} KB sent, {self.skipped_sends} sends skipped"
+              + (f", {self.replay_writer.games} replays saved" if self.replay_writer else ""), flush=True)
+
+    async def serve(self, host, port, reuse_port=False):
+        server = self.server = await asyncio.start_server(self.handle_client, host, port, reuse_port=reuse_port)
+        # Port 0 picks a free port
+        port = server.sockets[0].getsockname()[1]
+        print(f"[{os.getpid()}] Serving on {host}:{port}", flush=True)
+        loop = asyncio.get_running_loop()
+        # A service manager stops us with SIGTERM; shut down as for Ctrl+C
+        try:
+            loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        loop.set_exception_handler(ignore_cancelled_handlers)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run())
+
+def ignore_cancelled_handlers(loop, context):
+    # Before Python 3.12, asyncio reports every connection handler cancelled
+    # at shutdown as an error
+    if not isinstance(context.get("exception"), asyncio.CancelledError):
+        loop.default_exception_handler(context)
+
+def run_server(host, port, reuse_port=False, replay_path=None, event_log_path=None):
+    server = MatchServer(replay_path=replay_path, event_log_path=event_log_path)
+    # Connections are closed, and their games saved, before asyncio.run returns
+    try:
+        asyncio.run(server.serve(host, port, reuse_port))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if server.event_log:
+            server.event_log.flush()
+        server.writer.close()
+
+def worker_path(path, worker):
+    # replays.bin -> replays-0.bin
+    if not path:
+        return None
+    base, ext = os.path.splitext(path)
+    return f"{base}-{worker}{ext}"
+
+def run_workers(host, port, workers, replay_path=None, event_log_path=None):
+    # One process per core, all accepting on the same port; the kernel
+    # spreads new connections across them
+    if workers <= 1 or not hasattr(socket, "SO_REUSEPORT"):
+        if workers > 1:
+            print("SO_REUSEPORT is not available here; running a single process")
+        run_server(host, port, replay_path=replay_path, event_log_path=event_log_path)
+        return
+    processes = [multiprocessing.Process(target=run_server, args=(host, port, True, worker_path(replay_path, i),
+                                                                  worker_path(event_log_path, i)))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    # SIGTERM stops the workers too, each saving what it has
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+# Keeps a copy of one server game up to date from its deltas
+class MatchClient(BoardMirror):
+    def __init__(self):
+        super().__init__()
+        self.reader = None
+        self.writer = None
+        self.messages = 0
+        self.bytes_received = 0
+
+    async def connect(self, host="127.0.0.1", port=SERVER_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    def send(self, message):
+        self.writer.write((json.dumps(message) + "\n").encode())
+
+    def join(self, mode="marathon", power_ups=True, seed=None):
+        self.send({"join": mode, "power_ups": power_ups, "seed": seed})
+
+    def send_input(self, mask):
+        self.send({"input": mask})
+
+    async def receive(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        self.messages += 1
+        self.bytes_received += len(line)
+        message = json.loads(line)
+        self.apply(message)
+        return message
+
+    def apply(self, message):
+        if "error" in message:
+            raise ValueError(message["error"])
+        super().apply(message)
+
+    def close(self):
+        self.writer.close()
+
+async def run_bot(host, port, mode, seconds, seed):
+    # Presses random keys for a while, or until its game is over
+    client = MatchClient()
+    await client.connect(host, port)
+    client.join(mode, seed=seed)
+    rng = random.Random(seed)
+    deadline = time.monotonic() + seconds
+    actions = list(ACTION_BITS.values())
+
+    async def press_keys():
+        while not client.over and time.monotonic() < deadline:
+            client.send_input(rng.choice(actions) if rng.random() < 0.7 else 0)
+            await asyncio.sleep(rng.uniform(0.05, 0.2))
+
+    presser = asyncio.create_task(press_keys())
+    try:
+        while not client.over:
+            await asyncio.wait_for(client.receive(), max(0.01, deadline - time.monotonic()))
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    presser.cancel()
+    client.close()
+    return client
+
+async def run_bots(host, port, games, mode, seconds):
+    start = time.perf_counter()
+    clients = await asyncio.gather(*[run_bot(host, port, mode, seconds, seed) for seed in range(games)])
+    elapsed = time.perf_counter() - start
+    messages = sum(client.messages for client in clients)
+    received = sum(client.bytes_received for client in clients)
+    print(f"{games} games for {elapsed:.1f} s: {sum(client.over for client in clients)} finished, "
+          f"{messages / elapsed:.0f} messages/s, {received / elapsed / 1024:.0f} KB/s, "
+          f"average tick reached {sum(client.tick for client in clients) / games:.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="bLocKo match server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="host games")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=SERVER_PORT)
+    serve.add_argument("--workers", type=int, default=1, help="processes to shard games over; 0 for one per core")
+    serve.add_argument("--replays", nargs="?", const=blocko_storage.REPLAY_FILE, metavar="PATH",
+                       help=f"archive finished games (default {blocko_storage.REPLAY_FILE})")
+    serve.add_argument("--event-log", nargs="?", const=blocko_storage.EVENT_LOG_FILE, metavar="PATH",
+                       help=f"log game events (default {blocko_storage.EVENT_LOG_FILE})")
+    bots = commands.add_parser("bots", help="play many games against a server with random keys")
+    bots.add_argument("--host", default="127.0.0.1")
+    bots.add_argument("--port", type=int, default=SERVER_PORT)
+    bots.add_argument("--games", type=int, default=200)
+    bots.add_argument("--mode", default="marathon", choices=list(SERVER_MODES))
+    bots.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        run_workers(args.host, args.port, args.workers or os.cpu_count(), args.replays, args.event_log)
+    else:
+        asyncio.run(run_bots(args.host, args.port, args.games, args.mode, args.seconds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import functools
+import json
+import threading
+import time
+
+from blocko_delta import DELTA_EVENTS, BoardMirror, DeltaEncoder
+
+# Live feed of the game being played, for any number of watchers on local
+# sockets. The game thread encodes one delta per board per frame, only while
+# someone is watching, and hands the bytes to the feed thread, which writes
+# them to every subscriber. Messages are the JSON lines of blocko_delta, with
+# "board" set to the board index. Subscribers only listen; a new one starts
+# at the next keyframe, which its arrival requests.
+
+SPECTATOR_PORT = 48001
+KEYFRAME_INTERVAL = 2.0  # Seconds between keyframes even when nobody asks
+SLOW_SUBSCRIBER_BUFFER = 256 * 1024  # A subscriber this far behind waits for the next keyframe
+
+class SpectatorFeed:
+    def __init__(self, host="127.0.0.1", port=SPECTATOR_PORT):
+        self.encoders = []
+        # subscribers and waiting belong to the feed thread; the game thread
+        # only reads watchers and keyframe_requested
+        self.subscribers = set()
+        self.waiting = set()
+        self.watchers = 0
+        self.keyframe_requested = False
+        self.next_keyframe = 0.0
+        self.messages_sent = 0
+        self.last_encode_time = 0.0
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle_subscriber, host, port, start_serving=False))
+        self.thread = threading.Thread(target=self.run, name="blocko-spectate", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.start_serving())
+        self.loop.run_forever()
+        self.server.close()
+        for writer in self.subscribers | self.waiting:
+            writer.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+
+    async def handle_subscriber(self, reader, writer):
+        self.waiting.add(writer)
+        self.watchers += 1
+        self.keyframe_requested = True
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            self.waiting.discard(writer)
+            self.watchers -= 1
+            writer.close()
+
+    def watch(self, engines, buses=None):
+        # Events come from the engines unless other buses are given, as in
+        # online play where the session hides resimulated ticks
+        self.encoders = [DeltaEncoder(engine) for engine in engines]
+        for index, events in enumerate(buses or [engine.events for engine in engines]):
+            events.subscribe(DELTA_EVENTS, functools.partial(self.on_engine_event, index))
+        self.keyframe_requested = True
+
+    def invalidate(self):
+        # The boards changed without events, as on undo or a rollback
+        for encoder in self.encoders:
+            encoder.board_changed = True
+
+    def on_engine_event(self, index, event, *args):
+        if self.watchers:
+            self.encoders[index].on_engine_event(event, *args)
+
+    def publish(self, tick):
+        if not self.watchers:
+            return
+        start = time.perf_counter()
+        keyframe = self.keyframe_requested or start >= self.next_keyframe
+        if keyframe:
+            self.keyframe_requested = False
+            self.next_keyframe = start + KEYFRAME_INTERVAL
+        lines = []
+        for index, encoder in enumerate(self.encoders):
+            message = encoder.encode(tick, keyframe)
+            if message:
+                message["board"] = index
+                lines.append(json.dumps(message, separators=(",", ":")))
+        if lines:
+            data = ("\n".join(lines) + "\n").encode()
+            self.loop.call_soon_threadsafe(self.broadcast, data, keyframe)
+        self.last_encode_time = time.perf_counter() - start
+
+    def broadcast(self, data, keyframe):
+        if keyframe:
+            self.subscribers |= self.waiting
+            self.waiting.clear()
+        for writer in list(self.subscribers):
+            if writer.transport.get_write_buffer_size() > SLOW_SUBSCRIBER_BUFFER:
+                self.subscribers.discard(writer)
+                self.waiting.add(writer)
+                self.keyframe_requested = True
+                continue
+            writer.write(data)
+            self.messages_sent += 1
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+# Follows a feed, keeping a mirror of every board
+class SpectatorClient:
+    def __init__(self):
+        self.boards = {}
+        self.messages = 0
+        self.bytes_received = 0
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, host="127.0.0.1", port=SPECTATOR_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def receive(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Feed closed")
+        self.messages += 1
+        self.bytes_received += len(line)
+        message = json.loads(line)
+        self.boards.setdefault(message["board"], BoardMirror()).apply(message)
+        return message
+
+    def close(self):
+        self.writer.close()
+
+async def watch(host, port, watchers, seconds):
+    # The first watcher prints what happens; the rest only count messages
+    clients = [SpectatorClient() for _ in range(watchers)]
+    for client in clients:
+        await client.connect(host, port)
+
+    async def follow(client, verbose):
+        while True:
+            message = await client.receive()
+            if verbose:
+                for event in message.get("events", []):
+                    print(f"Board {message['board']} tick {message['tick']}: {' '.join(map(str, event))}")
+                if "score" in message:
+                    score, level, lines, combo = message["score"]
+                    print(f"Board {message['board']}: score {score}, level {level}, lines {lines}")
+
+    tasks = [asyncio.create_task(follow(client, i == 0)) for i, client in enumerate(clients)]
+    start = time.perf_counter()
+    try:
+        await asyncio.wait(tasks, timeout=seconds, return_when=asyncio.FIRST_EXCEPTION)
+    finally:
+        for task in tasks:
+            task.cancel()
+    elapsed = time.perf_counter() - start
+    print(f"{watchers} watchers: {sum(client.messages for client in clients) / elapsed:.0f} messages/s, "
+          f"{sum(client.bytes_received for client in clients) / elapsed / 1024:.0f} KB/s")
+    for client in clients:
+        client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a bLocKo game started with --spectate")
+    parser.add_argument("address", nargs="?", default=f"127.0.0.1:{SPECTATOR_PORT}", metavar="HOST[:PORT]")
+    parser.add_argument("--watchers", type=int, default=1, help="connections to open, for load testing")
+    parser.add_argument("--seconds", type=float, default=None, help="stop after this long")
+    args = parser.parse_args()
+    host, _, port = args.address.partition(":")
+    try:
+        asyncio.run(watch(host, int(port or SPECTATOR_PORT), args.watchers, args.seconds))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from blocko_core import DEFAULT_KEY_BINDINGS, LOGIC_RATE, PREVIEW_DEPTH, GameMode
+from blocko_input import DEFAULT_DAS, DEFAULT_ARR, DEFAULT_SOFT_DROP_FACTOR
+
+HIGH_SCORES_FILE = "high_scores.json"
+HIGH_SCORES_DB = "high_scores.db"
+KEY_BINDINGS_FILE = "key_bindings.json"
+LATENCY_LOG_FILE = "latency.log"
+EVENT_LOG_FILE = "events.bin"
+REPLAY_FILE = "replays.bin"
+SETTINGS_FILE = "settings.json"
+SUSPEND_FILE = "suspend.bin"
+HIGH_SCORES_SHOWN = 10
+
+DEFAULT_SETTINGS = {
+    "power_ups_enabled": True,
+    "difficulty": 1,
+    "preview_depth": PREVIEW_DEPTH,
+    "das": DEFAULT_DAS,
+    "arr": DEFAULT_ARR,
+    "soft_drop_factor": DEFAULT_SOFT_DROP_FACTOR,
+    "logic_rate": LOGIC_RATE,
+    "event_log": False,
+    "replays": False
+}
+
+def load_high_scores(path=HIGH_SCORES_FILE):
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return []
+    return []
+
+def load_key_bindings(path=KEY_BINDINGS_FILE):
+    # Actions added since the file was saved keep their default keys
+    key_bindings = DEFAULT_KEY_BINDINGS.copy()
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                key_bindings.update(json.load(f))
+        except json.JSONDecodeError:
+            pass
+    return key_bindings
+
+def load_settings(path=SETTINGS_FILE):
+    settings = DEFAULT_SETTINGS.copy()
+    if os.path.exists(path):
+        try:
+            with open(path, "r") as f:
+                settings.update(json.load(f))
+        except json.JSONDecodeError:
+            pass
+    return settings
+
+def write_file_atomic(path, data):
+    # Readers see either the old file or the new one, never a torn write
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def append_file(path, data):
+    with open(path, "ab" if isinstance(data, bytes) else "a") as f:
+        f.write(data)
+
+def load_file(path):
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    return None
+
+# Single thread that owns all disk writes. Files are coalesced per path, so a
+# burst of saves writes only the latest contents; other jobs run in order.
+# Writing None to a path removes the file.
+class BackgroundWriter:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending_files = {}
+        self.jobs = deque()
+        self.closing = False
+        self.last_write_duration = 0.0
+        self.write_durations = deque(maxlen=4096)
+        self.thread = threading.Thread(target=self.run, name="blocko-writer", daemon=True)
+        self.thread.start()
+
+    def write_json(self, path, data):
+        self.write_file(path, json.dumps(data))
+
+    def write_file(self, path, data):
+        with self.condition:
+            self.pending_files[path] = data
+            self.condition.notify()
+
+    def submit(self, job):
+        with self.condition:
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.pending_files or self.jobs or self.closing):
+                    self.condition.wait()
+                if not (self.pending_files or self.jobs):
+                    return
+                files, self.pending_files = self.pending_files, {}
+                jobs = list(self.jobs)
+                self.jobs.clear()
+
+            for job in jobs:
+                start = time.perf_counter()
+                try:
+                    job()
+                except Exception as e:
+                    print(f"Background job failed: {e}")
+                self.last_write_duration = time.perf_counter() - start
+                self.write_durations.append(self.last_write_duration)
+            for path, data in files.items():
+                start = time.perf_counter()
+                try:
+                    if data is None:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    else:
+                        write_file_atomic(path, data)
+                except OSError as e:
+                    print(f"Could not write {path}: {e}")
+                self.last_write_duration = time.perf_counter() - start
+                self.write_durations.append(self.last_write_duration)
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.thread.join()
+
+# Key bindings and options, read from disk once and kept in memory.
+# Saving hands a snapshot to the BackgroundWriter.
+class Settings:
+    def __init__(self, writer, key_bindings_path=KEY_BINDINGS_FILE, settings_path=SETTINGS_FILE):
+        self.writer = writer
+        self.key_bindings_path = key_bindings_path
+        self.settings_path = settings_path
+        self.key_bindings = load_key_bindings(key_bindings_path)
+        self.options = load_settings(settings_path)
+
+    def save_key_bindings(self):
+        self.writer.write_json(self.key_bindings_path, self.key_bindings)
+
+    def save_options(self):
+        self.writer.write_json(self.settings_path, self.options)
+
+# Every finished game, kept forever in SQLite. The (mode, score) index makes
+# a per-mode top-K query a single index walk, and each insert is its own
+# transaction, so a crash can never leave a half-written table behind.
+# The top entries of every mode are cached in memory; add() updates the cache
+# at once and leaves the insert to the BackgroundWriter, so the game-over
+# screen never waits on the disk.
+class HighScoreStore:
+    def __init__(self, writer, path=HIGH_SCORES_DB, legacy_path=HIGH_SCORES_FILE, top_k=HIGH_SCORES_SHOWN):
+        self.writer = writer
+        self.path = path
+        self.top_k = top_k
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.writer_conn = None
+
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS scores ("
+                    "id INTEGER PRIMARY KEY, mode INTEGER NOT NULL, score INTEGER NOT NULL, "
+                    "level INTEGER NOT NULL, lines INTEGER NOT NULL, created REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS scores_by_mode ON scores (mode, score DESC)")
+                if legacy_path and conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0] == 0:
+                    self.import_legacy(conn, legacy_path)
+            for mode, in conn.execute("SELECT DISTINCT mode FROM scores").fetchall():
+                self.cache[mode] = self.query_top(conn, mode, self.top_k)
+        finally:
+            conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def import_legacy(self, conn, legacy_path):
+        # high_scores.json predates game modes; every entry in it was Marathon
+        for entry in load_high_scores(legacy_path):
+            conn.execute(
+                "INSERT INTO scores (mode, score, level, lines, created) VALUES (?, ?, ?, ?, ?)",
+                (GameMode.MARATHON, entry["score"], entry["level"], entry.get("lines", 0), 0.0)
+            )
+
+    def query_top(self, conn, mode, limit):
+        rows = conn.execute(
+            "SELECT score, level, lines, created FROM scores WHERE mode = ? ORDER BY score DESC LIMIT ?",
+            (mode, limit)
+        ).fetchall()
+        return [{"score": score, "level": level, "lines": lines, "created": created}
+                for score, level, lines, created in rows]
+
+    def top(self, mode, limit=None):
+        with self.lock:
+            return list(self.cache.get(mode, [])[:limit or self.top_k])
+
+    def fetch_top(self, mode, limit):
+        # Straight from the database, for leaderboards deeper than the cache
+        conn = self.connect()
+        try:
+            return self.query_top(conn, mode, limit)
+        finally:
+            conn.close()
+
+    def add(self, mode, score, level, lines):
+        entry = {"score": score, "level": level, "lines": lines, "created": time.time()}
+        with self.lock:
+            entries = self.cache.setdefault(mode, [])
+            entries.append(entry)
+            entries.sort(key=lambda x: x["score"], reverse=True)
+            del entries[self.top_k:]
+        self.writer.submit(lambda: self.insert(mode, entry))
+
+    # insert() and close_connection() only ever run on the writer thread,
+    # which owns writer_conn
+    def insert(self, mode, entry):
+        if self.writer_conn is None:
+            self.writer_conn = self.connect()
+        with self.writer_conn:
+            self.writer_conn.execute(
+                "INSERT INTO scores (mode, score, level, lines, created) VALUES (?, ?, ?, ?, ?)",
+                (mode, entry["score"], entry["level"], entry["lines"], entry["created"])
+            )
+
+    def close_connection(self):
+        if self.writer_conn is not None:
+            self.writer_conn.close()
+            self.writer_conn = None
+
+    def close(self):
+        self.writer.submit(self.close_connection)
@@ -0,0 +1,37 @@
+import functools
+
+from blocko_core import GRID_WIDTH, GRID_HEIGHT, BUFFER_ZONE_HEIGHT, EngineEvent
+
+# Garbage rows sent for clearing this many lines with one piece
+VERSUS_GARBAGE = {1: 0, 2: 1, 3: 2, 4: 3, 5: 4}
+MAX_PENDING_GARBAGE = GRID_HEIGHT + BUFFER_ZONE_HEIGHT
+
+# Garbage exchange and the result of a versus game between two engines.
+# The front end steps the engines; the match follows them through their events.
+class VersusMatch:
+    def __init__(self, engines):
+        self.engines = engines
+        self.winner = None
+        self.garbage_sent = [0] * len(engines)
+        for index, engine in enumerate(engines):
+            engine.events.subscribe([EngineEvent.LINE_CLEAR, EngineEvent.GAME_OVER],
+                                    functools.partial(self.handle_event, index))
+
+    def handle_event(self, index, event, *args):
+        if event == EngineEvent.LINE_CLEAR:
+            lines = len(args[0]) // GRID_WIDTH
+            self.send_garbage(index, VERSUS_GARBAGE.get(lines, VERSUS_GARBAGE[5]))
+        elif event == EngineEvent.GAME_OVER and self.winner is None:
+            self.winner = 1 - index
+
+    def send_garbage(self, index, rows):
+        # Rows waiting for the sender are cancelled first
+        sender = self.engines[index]
+        cancelled = min(rows, sender.pending_garbage)
+        sender.pending_garbage -= cancelled
+        rows -= cancelled
+        if rows <= 0:
+            return
+        self.garbage_sent[index] += rows
+        receiver = self.engines[1 - index]
+        receiver.pending_garbage = min(MAX_PENDING_GARBAGE, receiver.pending_garbage + rows)
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# The game's modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class ManualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+# The game window, headless, in an empty directory, with key events timed by
+# a clock the test moves
+@pytest.fixture
+def window(tmp_path, monkeypatch):
+    import pyglet
+    pyglet.options["headless"] = True
+    import blocko
+    monkeypatch.chdir(tmp_path)
+    window = blocko.BKGame()
+    window.input_queue.clock = ManualClock()
+    window.last_input_time = 0.0
+    yield window
+    window.writer.close()
+    window.close()
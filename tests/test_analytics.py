@@ -0,0 +1,28 @@
+import random
+
+import blocko_storage
+from blocko_analytics import replay_header_chunks
+from blocko_replay import ReplayArchive, ReplayWriter
+from blocko_server import ServerGame
+
+def test_replay_headers_are_gathered_from_every_record(tmp_path):
+    path = str(tmp_path / "replays.bin")
+    writer = blocko_storage.BackgroundWriter()
+    replays = ReplayWriter(writer, path)
+    rng = random.Random(1)
+    for _ in range(7):
+        game = ServerGame(rng.randrange(4), True, rng.getrandbits(32), writer, replays)
+        for _ in range(rng.randrange(1, 600)):
+            if rng.random() < 0.2:
+                game.set_input(rng.getrandbits(7))
+            game.update()
+        game.close()
+    writer.close()
+    archive = ReplayArchive(path)
+    expected = [(replay.game_id, replay.game_mode, replay.ticks, replay.pieces, replay.score, replay.lines)
+                for replay in archive]
+    archive.close()
+    # Chunks smaller than the archive, so one ends part way
+    headers = [tuple(int(value) for value in header[["game", "mode", "ticks", "pieces", "score", "lines"]])
+               for chunk in replay_header_chunks(path, 3) for header in chunk]
+    assert headers == expected
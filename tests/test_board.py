@@ -0,0 +1,40 @@
+import random
+
+from blocko_board import BOARD_CELLS, OCCUPANCY_BYTES, board_occupancy, pack_board, pack_cells, unpack_board, unpack_cells
+from blocko_core import CELL_PALETTE, GRID_WIDTH
+
+def random_cells(rng, fill):
+    return bytes(rng.randrange(1, len(CELL_PALETTE)) if rng.random() < fill else 0 for _ in range(BOARD_CELLS))
+
+def test_cells_round_trip():
+    rng = random.Random(1)
+    for fill in (0, 0.05, 0.3, 0.5, 0.7, 0.95, 1):
+        for _ in range(50):
+            cells = random_cells(rng, fill)
+            data = pack_cells(cells)
+            assert len(data) == OCCUPANCY_BYTES + (sum(1 for c in cells if c) + 1) // 2
+            assert unpack_cells(data) == (cells, len(data))
+
+def test_unpack_at_offset():
+    rng = random.Random(2)
+    first, second = random_cells(rng, 0.4), random_cells(rng, 0.6)
+    data = b"head" + pack_cells(first) + pack_cells(second) + b"tail"
+    cells, offset = unpack_cells(data, 4)
+    assert cells == first
+    cells, offset = unpack_cells(data, offset)
+    assert cells == second
+    assert data[offset:] == b"tail"
+
+def test_occupancy_bits():
+    cells = bytearray(BOARD_CELLS)
+    cells[0] = cells[GRID_WIDTH + 3] = cells[-1] = len(CELL_PALETTE) - 1
+    occupancy = board_occupancy(pack_cells(bytes(cells)))
+    assert occupancy == 1 | 1 << GRID_WIDTH + 3 | 1 << BOARD_CELLS - 1
+
+def test_equal_grids_pack_equal():
+    rng = random.Random(3)
+    cells = random_cells(rng, 0.5)
+    grid = [bytearray(cells[y:y + GRID_WIDTH]) for y in range(0, BOARD_CELLS, GRID_WIDTH)]
+    data = pack_board(grid)
+    assert data == pack_cells(cells)
+    assert unpack_board(data) == (grid, len(data))
@@ -0,0 +1,53 @@
+import json
+import random
+
+from blocko_core import PLAYER_ACTIONS, FixedTimestep, GameMode
+from blocko_delta import DELTA_EVENTS, BoardMirror, DeltaEncoder, encode_piece, encode_shape
+from blocko_engine import BlockoEngine
+from blocko_input import AutoShift
+from blocko_net import apply_action
+
+STEP = FixedTimestep(60).step
+KEYFRAME_INTERVAL = 300
+
+def assert_mirrors(mirror, engine):
+    assert mirror.cells == list(b"".join(engine.grid))
+    assert mirror.piece == encode_piece(engine.current_block)
+    assert mirror.hold == encode_shape(engine.hold_block)
+    assert mirror.next == [encode_shape(block) for block in engine.get_next_blocks()]
+    assert mirror.score == [engine.score, engine.level, engine.lines_cleared, engine.combo_count]
+    assert mirror.over == engine.is_game_over
+
+def test_mirrors_converge_on_the_board():
+    rng = random.Random(1)
+    for game_mode in [GameMode.MARATHON, GameMode.SPRINT, GameMode.VERSUS]:
+        tick = [0]
+        engine = BlockoEngine(game_mode, True, clock=lambda: tick[0] * STEP, seed=rng.getrandbits(64))
+        auto_shift = AutoShift()
+        encoder = DeltaEncoder(engine)
+        engine.events.subscribe(DELTA_EVENTS, encoder.on_engine_event)
+        engine.start()
+        # One viewer from the start, one joining at each keyframe
+        mirror = BoardMirror()
+        late_mirror = None
+        while not engine.is_game_over and tick[0] < 8000:
+            if rng.random() < 0.15:
+                apply_action(engine, auto_shift, rng.choice(PLAYER_ACTIONS), rng.random() < 0.6)
+            if game_mode == GameMode.VERSUS and rng.random() < 0.005:
+                engine.pending_garbage += rng.randrange(1, 4)
+            tick[0] += 1
+            auto_shift.update(engine, STEP)
+            engine.update(STEP)
+            keyframe = tick[0] % KEYFRAME_INTERVAL == 0
+            message = encoder.encode(tick[0], keyframe)
+            if message is None:
+                continue
+            # Messages go out as JSON
+            message = json.loads(json.dumps(message))
+            if keyframe:
+                late_mirror = BoardMirror()
+            for viewer in [mirror, late_mirror]:
+                if viewer:
+                    viewer.apply(message)
+                    assert viewer.tick == tick[0]
+                    assert_mirrors(viewer, engine)
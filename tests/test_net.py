@@ -0,0 +1,73 @@
+import heapq
+import random
+
+from blocko_core import PLAYER_ACTIONS
+from blocko_net import INPUT_HEADER, MAX_ROLLBACK, NET_MAGIC, NET_TICK_RATE, PACKET_INPUT, RollbackSession
+
+# Delivers packets after a random delay of up to max_delay ticks, so they
+# arrive far out of order, and drops some
+class ShuffledTransport:
+    def __init__(self, clock, max_delay, loss, seed):
+        self.clock = clock
+        self.max_delay = max_delay
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.peer = None
+        self.inbox = []
+        self.sequence = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, data):
+        self.sent += 1
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        self.sequence += 1
+        heapq.heappush(self.peer.inbox, (self.clock() + self.random.randint(0, self.max_delay), self.sequence, data))
+
+    def receive(self):
+        while self.inbox and self.inbox[0][0] <= self.clock():
+            yield heapq.heappop(self.inbox)[2]
+
+    def close(self):
+        pass
+
+def play(ticks, max_delay, loss, seed):
+    frame = [0]
+    clock = lambda: frame[0]
+    transports = [ShuffledTransport(clock, max_delay, loss, seed), ShuffledTransport(clock, max_delay, loss, seed + 1)]
+    transports[0].peer, transports[1].peer = transports[1], transports[0]
+    sessions = [RollbackSession(transports[0], 0, seed), RollbackSession(transports[1], 1, seed)]
+    bots = [random.Random(seed + 2), random.Random(seed + 3)]
+    masks = [0, 0]
+    while min(session.tick for session in sessions) < ticks and frame[0] < ticks * 20:
+        frame[0] += 1
+        for index, session in enumerate(sessions):
+            if bots[index].random() < 0.1:
+                masks[index] = bots[index].getrandbits(len(PLAYER_ACTIONS)) & bots[index].getrandbits(len(PLAYER_ACTIONS))
+            session.advance(masks[index])
+    for _ in range(max_delay + 2 * MAX_ROLLBACK):
+        frame[0] += 1
+        for session in sessions:
+            session.poll()
+            session.send_inputs()
+    return sessions
+
+def test_peers_agree_despite_heavy_reordering():
+    sessions = play(NET_TICK_RATE * 20, max_delay=90, loss=0.1, seed=5)
+    assert min(session.tick for session in sessions) >= NET_TICK_RATE * 20
+    assert sum(session.rollbacks for session in sessions) > 0
+    common = sorted(set(sessions[0].checksums) & set(sessions[1].checksums))
+    assert len(common) >= NET_TICK_RATE * 20
+    assert [sessions[0].checksums[tick] for tick in common] == [sessions[1].checksums[tick] for tick in common]
+    last = common[-1]
+    assert sessions[0].checksums[last] == sessions[1].checksums[last]
+
+def test_late_duplicates_of_confirmed_ticks_are_ignored():
+    session = play(NET_TICK_RATE * 5, max_delay=0, loss=0.0, seed=9)[0]
+    assert session.confirmed_tick > MAX_ROLLBACK * 3
+    # Resent long ago, for ticks whose inputs and snapshots are already gone
+    session.handle_packet(INPUT_HEADER.pack(NET_MAGIC, PACKET_INPUT, 0, 1, 8) + bytes([0x7f] * 8))
+    assert session.rollback_from is None
+    session.poll()
@@ -0,0 +1,52 @@
+import random
+
+from blocko_core import DEFAULT_KEY_BINDINGS, PLAYER_ACTIONS, GameMode, GameState
+from blocko_replay import Replay, ReplayPlayer
+from blocko_server import ServerGame
+
+class CollectingWriter:
+    def __init__(self):
+        self.replays = []
+
+    def append(self, recorder):
+        self.replays.append(Replay(recorder.finish()))
+
+def assert_replays_match(replay, engine):
+    played = ReplayPlayer(replay).play()
+    assert played.snapshot() == engine.snapshot()
+    assert (played.score, played.lines_cleared, played.level) == (replay.score, replay.lines, replay.level)
+
+def test_server_games_replay_whether_finished_or_cut_short():
+    rng = random.Random(3)
+    for _ in range(12):
+        replays = CollectingWriter()
+        game = ServerGame(rng.randrange(4), True, rng.getrandbits(32), None, replays)
+        cut = rng.choice([rng.randrange(1, 2000), None])
+        while not game.engine.is_game_over and game.tick != cut:
+            if rng.random() < 0.2:
+                game.set_input(rng.getrandbits(len(PLAYER_ACTIONS)))
+            game.update()
+        game.close()
+        assert_replays_match(replays.replays[0], game.engine)
+
+def test_window_games_replay_to_their_game_over(window):
+    # Sprint ends on its timer inside a tick, where the window's GAME_OVER
+    # handler saves the replay
+    rng = random.Random(4)
+    replays = CollectingWriter()
+    window.replay_writer = replays
+    window.game_mode = GameMode.SPRINT
+    keys = [DEFAULT_KEY_BINDINGS[action] for action in PLAYER_ACTIONS]
+    clock = window.input_queue.clock
+    for _ in range(3):
+        window.start_game()
+        while window.game_state != GameState.GAME_OVER:
+            for _ in range(rng.randrange(4)):
+                key = rng.choice(keys)
+                window.on_key_press(key, 0)
+                clock.now += rng.random() * 0.05
+                window.on_key_release(key, 0)
+            clock.now += rng.random() * 0.1
+            window.update(0)
+        assert_replays_match(replays.replays[-1], window.engine)
+    assert len(replays.replays) == 3
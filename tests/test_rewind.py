@@ -0,0 +1,78 @@
+import random
+
+from blocko_core import BLOCK_CELLS, GRID_HEIGHT, GRID_WIDTH, GameMode, GameState
+from blocko_rewind import RewindBuffer, apply_patch, make_patch
+
+def mutate(rng, state):
+    data = bytearray(state)
+    for _ in range(rng.randrange(1, 20)):
+        if data and rng.random() < 0.8:
+            i = rng.randrange(len(data))
+            data[i:i + rng.randrange(1, 300)] = bytes(rng.randrange(256) for _ in range(rng.randrange(1, 300)))
+        else:
+            data += bytes(rng.randrange(256) for _ in range(rng.randrange(40)))
+    return bytes(data[:rng.randrange(len(data) + 1)] if rng.random() < 0.2 else data)
+
+def test_patch_goes_both_ways():
+    rng = random.Random(1)
+    old = bytes(rng.randrange(256) for _ in range(200))
+    for _ in range(300):
+        new = mutate(rng, old)
+        patch = make_patch(old, new)
+        assert apply_patch(old, patch) == new
+        assert apply_patch(new, patch) == old
+        old = new
+
+def test_identical_states_make_an_empty_patch():
+    state = bytes(range(256)) * 3
+    patch = make_patch(state, state)
+    assert apply_patch(state, patch) == state
+    assert len(patch) == len(make_patch(b"", b""))
+
+def test_undo_and_redo_walk_the_history():
+    rng = random.Random(2)
+    states = [bytes(150)]
+    while len(states) < 100:
+        state = mutate(rng, states[-1])
+        if state != states[-1]:
+            states.append(state)
+    rewind = RewindBuffer()
+    for state in states:
+        rewind.record(state)
+    for state in reversed(states[:-1]):
+        assert rewind.undo() == state
+    assert rewind.undo() is None
+    for state in states[1:]:
+        assert rewind.redo() == state
+    assert rewind.redo() is None
+    # Recording after an undo drops the redo history
+    rewind.undo()
+    rewind.record(b"branch")
+    assert rewind.redo() is None
+    assert rewind.undo() == states[-2]
+
+def test_undo_after_topping_out_takes_back_one_piece(window):
+    window.game_mode = GameMode.PRACTICE
+    window.power_ups_enabled = False
+    window.start_game()
+    engine = window.engine
+    for _ in range(5):
+        engine.hard_drop()
+    last_recorded = window.save_state()
+    # Bring the falling piece down onto a stack ten rows high, with the rows
+    # above it empty and the spawn rows full. No row is complete, so nothing
+    # clears, and within a piece or two the next one has nowhere to spawn.
+    block = engine.current_block
+    block.move(0, 10 - min(y for x, y in block.get_global_positions()))
+    for y, row in enumerate(engine.grid):
+        if y < 10 or y >= GRID_HEIGHT:
+            row[1:] = bytes([BLOCK_CELLS[0]]) * (GRID_WIDTH - 1)
+    for _ in range(10):
+        engine.hard_drop()
+        if engine.is_game_over:
+            break
+        last_recorded = window.save_state()
+    assert window.game_state == GameState.GAME_OVER
+    window.rewind_game()
+    assert window.game_state == GameState.PAUSED
+    assert window.save_state() == last_recorded
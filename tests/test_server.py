@@ -0,0 +1,101 @@
+import asyncio
+import random
+
+from blocko_core import PLAYER_ACTIONS, GameMode
+from blocko_delta import encode_piece, encode_shape
+from blocko_net import ACTION_BITS
+from blocko_replay import INPUT_PRESSED, ReplayArchive
+from blocko_server import SERVER_MODES, MatchClient, MatchServer, ServerGame
+
+async def start(server):
+    serving = asyncio.create_task(server.serve("127.0.0.1", 0))
+    while server.server is None:
+        await asyncio.sleep(0.01)
+    return serving, server.server.sockets[0].getsockname()[1]
+
+async def stop(serving):
+    # As at shutdown: the connection handlers are cancelled when the loop ends
+    serving.cancel()
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+
+async def receive_all(client):
+    # Cancelled between messages, so the mirror is left as of a whole one
+    while True:
+        await client.receive()
+
+def replay_masks(replay):
+    # The input mask each tick of a server game was run with
+    masks = {}
+    mask = 0
+    for tick, code in replay.inputs():
+        bit = ACTION_BITS[PLAYER_ACTIONS[code & ~INPUT_PRESSED]]
+        mask = mask | bit if code & INPUT_PRESSED else mask & ~bit
+        masks[tick] = mask
+    return masks
+
+def test_client_mirrors_a_game_played_over_a_socket(tmp_path):
+    path = str(tmp_path / "replays.bin")
+    server = MatchServer(replay_path=path)
+    rng = random.Random(1)
+    seed = 12345
+
+    async def play():
+        serving, port = await start(server)
+        client = MatchClient()
+        await client.connect(port=port)
+        client.join("marathon", seed=seed)
+        receiving = asyncio.create_task(receive_all(client))
+        actions = list(ACTION_BITS.values())
+        for _ in range(80):
+            client.send_input(rng.choice(actions) if rng.random() < 0.7 else 0)
+            await asyncio.sleep(rng.uniform(0, 0.03))
+        receiving.cancel()
+        client.close()
+        await stop(serving)
+        return client
+
+    client = asyncio.run(play())
+    server.writer.close()
+
+    # The same game run here, with each input on the tick the server applied it
+    archive = ReplayArchive(path)
+    replay = next(iter(archive))
+    masks = replay_masks(replay)
+    archive.close()
+    assert masks and client.tick
+    game = ServerGame(SERVER_MODES["marathon"], True, seed, None)
+    mask = 0
+    while game.tick < client.tick:
+        mask = masks.get(game.tick, mask)
+        game.set_input(mask)
+        game.update()
+    engine = game.engine
+    assert client.cells == list(b"".join(engine.grid))
+    assert client.piece == encode_piece(engine.current_block)
+    assert client.hold == encode_shape(engine.hold_block)
+    assert client.next == [encode_shape(block) for block in engine.get_next_blocks()]
+    assert client.score == [engine.score, engine.level, engine.lines_cleared, engine.combo_count]
+
+def test_joining_again_saves_the_game_it_replaces(tmp_path):
+    path = str(tmp_path / "replays.bin")
+    server = MatchServer(replay_path=path)
+
+    async def play():
+        serving, port = await start(server)
+        client = MatchClient()
+        await client.connect(port=port)
+        for seed in [1, 2, 3]:
+            client.join("sprint", seed=seed)
+            await client.receive()
+        # Left open: the last game is saved as the server shuts down
+        await stop(serving)
+        client.close()
+
+    asyncio.run(play())
+    server.writer.close()
+    archive = ReplayArchive(path)
+    assert [(replay.seed, replay.game_mode) for replay in archive] == [(seed, GameMode.SPRINT) for seed in [1, 2, 3]]
+    archive.close()